@@ -0,0 +1,265 @@
+############################################################################
+#
+# 历史数据的 Parquet 归档: record / record1 / fail_record 按天(和站)分区写到 archive/ 下,
+#   archive/mes1/record/date=2024-01-02/station=TSP-E/part-0.parquet
+# 只归档已结束的天, 每次运行从上次归档的最后一天继续; data_changes 中记录的已归档天的后续改动会让这些天重新导出.
+# archive_counts 按分区和列裁剪读取归档的天, 未归档的部分查 SQLite, 供 get_fpy / pareto 的 backend='archive' 使用.
+# 需要 pyarrow.
+# python archive.py                       # 归档 mes1.db 和 insight.db 到昨天为止的数据
+# python archive.py mes1.db --until 2024-01-10
+#
+############################################################################
+import argparse
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from db_pool import get_connection
+from timestamps import epoch_column, format_time, to_epoch
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+ARCHIVE_DIR = 'archive'
+
+# (数据库, 表) -> 站的列, None 表示只按天分区
+ARCHIVE_TABLES = {('mes1.db', 'record'): 'test_station',
+                  ('mes1.db', 'record1'): 'test_station',
+                  ('insight.db', 'record'): None,
+                  ('insight.db', 'fail_record'): None}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("the parquet archive needs pyarrow, pip install pyarrow")
+
+
+def table_dir(db_name, table, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, os.path.splitext(os.path.basename(db_name))[0], table)
+
+
+def _partitioning(db_name, table):
+    fields = [('date', pa.string())]
+    if ARCHIVE_TABLES[(os.path.basename(db_name), table)] is not None:
+        fields.append(('station', pa.string()))
+    return ds.partitioning(pa.schema(fields), flavor='hive')
+
+
+def _schema(conn, table):
+    # 按声明的类型存储, 不能转换的值存为空; 字典编码的表(dictionary.py)是视图, 不归档它的 rowid 列
+    types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    return pa.schema([(row[1], types.get(row[2].upper(), pa.string()))
+                      for row in conn.execute(f"PRAGMA table_info({table})") if row[1] != 'rowid'])
+
+
+def _frame_of_day(conn, table, epoch, day, schema):
+    # 只有导出时用到, archive_counts (get_fpy 等的 backend='archive') 不加载 pandas
+    import pandas as pd
+
+    columns = ', '.join(f'"{name}"' for name in schema.names)
+    return pd.read_sql(f'SELECT {columns} FROM {table} WHERE "{epoch}" >= ? AND "{epoch}" < ?', conn,
+                       params=(to_epoch(day), to_epoch(_next_day(day))))
+
+
+def _to_arrow(df, schema):
+    import pandas as pd
+
+    for field in schema:
+        if pa.types.is_string(field.type):
+            df[field.name] = df[field.name].astype('string')
+        elif pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors='coerce').astype('Int64')
+        else:
+            df[field.name] = pd.to_numeric(df[field.name], errors='coerce')
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def export_day(conn, db_name, table, day, archive_dir=ARCHIVE_DIR):
+    """ write the rows of table whose time is on day to its partitions, replacing what was archived for day
+    :param conn:
+    :param db_name:
+    :param table:
+    :param day: '%Y-%m-%d'
+    :param archive_dir:
+    :return: number of rows written
+    """
+    station_column = ARCHIVE_TABLES[(os.path.basename(db_name), table)]
+    schema = _schema(conn, table)
+    df = _frame_of_day(conn, table, epoch_column(db_name, table), day, schema)
+    base = table_dir(db_name, table, archive_dir)
+    target = os.path.join(base, f'date={day}')
+    # write next to the old partitions and swap them, a reader never sees half of a day
+    temp = os.path.join(base, f'.tmp-{day}')
+    shutil.rmtree(temp, ignore_errors=True)
+    if len(df):
+        data = _to_arrow(df, schema).append_column('date', pa.array([day] * len(df), pa.string()))
+        if station_column is not None:
+            data = data.append_column('station', data[station_column].fill_null('unknown'))
+        ds.write_dataset(data, temp, format='parquet', partitioning=_partitioning(db_name, table),
+                         basename_template='part-{i}.parquet')
+    shutil.rmtree(target, ignore_errors=True)
+    if len(df):
+        os.replace(os.path.join(temp, f'date={day}'), target)
+        shutil.rmtree(temp)
+    return len(df)
+
+
+def _next_day(day):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def _state(conn, table):
+    row = conn.execute("SELECT last_day, last_change FROM archive_state WHERE table_name = ?", (table,)).fetchone()
+    return row if row is not None else (None, 0)
+
+
+def _days_to_export(conn, table, epoch, last_day, last_change, until):
+    """ the closed days after last_day, and the archived days changed since last_change
+    :return: (sorted days, id of the last change seen)
+    """
+    # read first, a change committed while the days are listed is handled by the next run
+    seen = conn.execute("SELECT IFNULL(MAX(id), 0) FROM data_changes").fetchone()[0]
+    start = None if last_day is None else to_epoch(_next_day(last_day))
+    days = {row[0] for row in conn.execute(f'SELECT DISTINCT date("{epoch}", \'unixepoch\') FROM {table} '
+                                           f'WHERE "{epoch}" >= IFNULL(?, "{epoch}") AND "{epoch}" < ?',
+                                           (start, to_epoch(until)))
+            if row[0]}
+    changes = conn.execute("SELECT id, first_time, last_time FROM data_changes WHERE id > ? AND id <= ? "
+                           "AND table_name = ? ORDER BY id", (last_change, seen, table)).fetchall()
+    for _, first_time, last_time in changes:
+        if last_day is None or first_time is None:
+            continue
+        day = datetime.strptime(first_time[:10], '%Y-%m-%d')
+        while day.strftime('%Y-%m-%d') <= min(last_time[:10], last_day):
+            days.add(day.strftime('%Y-%m-%d'))
+            day += timedelta(days=1)
+    return sorted(days), max(seen, last_change)
+
+
+def export(db_name, until=None, archive_dir=ARCHIVE_DIR, verbose=False):
+    """ archive the closed days of every table of db_name that are new or changed since the last run
+    :param db_name:
+    :param until: '%Y-%m-%d', the days before it are closed, today by default
+    :param archive_dir:
+    :param verbose:
+    :return: {table: number of days written}
+    """
+    _require_pyarrow()
+    until = until or datetime.now().strftime('%Y-%m-%d')
+    conn = get_connection(db_name)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    if 'archive_state' not in tables:
+        raise RuntimeError(f"{db_name} has no archive_state table, run migrate.py first")
+    written = {}
+    for (name, table), _ in ARCHIVE_TABLES.items():
+        if name != os.path.basename(db_name) or table not in tables:
+            continue
+        last_day, last_change = _state(conn, table)
+        days, last_change = _days_to_export(conn, table, epoch_column(name, table), last_day, last_change, until)
+        for day in days:
+            rows = export_day(conn, db_name, table, day, archive_dir)
+            if verbose:
+                print(f"{db_name} {table} {day}: {rows} rows")
+        closed = (datetime.strptime(until, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+        last_day = closed if last_day is None else max(last_day, closed)
+        conn.execute("""INSERT INTO archive_state VALUES (?, ?, ?, ?)
+                        ON CONFLICT(table_name) DO UPDATE SET
+                        last_day = excluded.last_day, last_change = excluded.last_change,
+                        updated_at = excluded.updated_at""",
+                     (table, last_day, last_change, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+        written[table] = len(days)
+    return written
+
+
+def archive_counts(db_name, table, by, start, end, where=None, skip_null=False, limit=None,
+                   archive_dir=ARCHIVE_DIR):
+    """ like rollup.grouped_counts on the source table, the archived days are read from the parquet partitions
+    (only the needed columns, only the partitions of the range), the days after the archive from SQLite
+    :param db_name:
+    :param table:
+    :param by: columns to group by
+    :param start: '%Y-%m-%d %H:%M:%S' or datetime
+    :param end:
+    :param where: {column: value} filters
+    :param skip_null: leave out the rows where a column in by is NULL
+    :param limit: only the first limit groups
+    :param archive_dir:
+    :return: [(value of each column in by, ..., count), ...] by count descending
+    """
+    _require_pyarrow()
+    where = where or {}
+    start = format_time(start)
+    end = format_time(end)
+    conn = get_connection(db_name)
+    epoch = epoch_column(db_name, table)
+    last_day = _state(conn, table)[0] if _has_state(conn) else None
+    counts = {}
+    archived_end = end
+    if last_day is not None and start[:10] <= last_day:
+        archived_end = min(end, f'{last_day} 23:59:59')
+        for key, count in _parquet_counts(db_name, table, by, start, archived_end, where, skip_null, archive_dir):
+            counts[key] = counts.get(key, 0) + count
+    if last_day is None or end[:10] > last_day:
+        open_start = start if last_day is None else max(start, f'{_next_day(last_day)} 00:00:00')
+        names = ', '.join(f'"{column}"' for column in by)
+        filters = ''.join(f' AND "{column}" = ?' for column in where)
+        if skip_null:
+            filters += ''.join(f' AND "{column}" IS NOT NULL' for column in by)
+        rows = conn.execute(f'SELECT {names}, COUNT(*) FROM {table} WHERE "{epoch}" BETWEEN ? AND ?{filters} '
+                            f'GROUP BY {names}', [to_epoch(open_start), to_epoch(end)] + list(where.values()))
+        for row in rows:
+            counts[row[:-1]] = counts.get(row[:-1], 0) + row[-1]
+    result = sorted((key + (count,) for key, count in counts.items()),
+                    key=lambda row: (-row[-1],) + tuple((value is None, str(value)) for value in row[:-1]))
+    return result[:limit] if limit is not None else result
+
+
+def _has_state(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_state'").fetchone()
+
+
+def _parquet_counts(db_name, table, by, start, end, where, skip_null, archive_dir):
+    base = table_dir(db_name, table, archive_dir)
+    if not os.path.isdir(base):
+        return []
+    station_column = ARCHIVE_TABLES[(os.path.basename(db_name), table)]
+    epoch = epoch_column(db_name, table)
+    dataset = ds.dataset(base, format='parquet', partitioning=_partitioning(db_name, table))
+    # the date (and station) partitions prune the files, the epoch column trims the first and last day
+    condition = ((ds.field('date') >= start[:10]) & (ds.field('date') <= end[:10])
+                 & (ds.field(epoch) >= to_epoch(start)) & (ds.field(epoch) <= to_epoch(end)))
+    for column, value in where.items():
+        condition &= ds.field(column) == value
+        if column == station_column:
+            condition &= ds.field('station') == value
+    if skip_null:
+        for column in by:
+            condition &= ds.field(column).is_valid()
+    data = dataset.to_table(columns=list(by), filter=condition)
+    grouped = data.group_by(list(by)).aggregate([(by[0], 'count', pc.CountOptions(mode='all'))])
+    keys = zip(*(grouped[column].to_pylist() for column in by))
+    return list(zip(keys, grouped[f'{by[0]}_count'].to_pylist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="archive the closed days of mes1.db and insight.db to parquet")
+    parser.add_argument('databases', nargs='*', default=['mes1.db', 'insight.db'])
+    parser.add_argument('--until', help="archive the days before this date (YYYY-MM-DD), today by default")
+    parser.add_argument('--dir', default=ARCHIVE_DIR, help="archive folder")
+    args = parser.parse_args()
+    for db_name in args.databases:
+        if not os.path.exists(db_name):
+            print(f"{db_name} does not exist")
+            continue
+        written = export(db_name, until=args.until, archive_dir=args.dir, verbose=True)
+        for table, days in written.items():
+            print(f"{db_name} {table}: {days} days archived")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+############################################################################
+#
+# 对比 '数据信息' 列的两种解码方式:
+#   res/dva/tsp.JsonToListDataFrame(info_list).generate_dataframe()
+#   json_batch.decode_records(info_list, station)
+# python bench_json_decode.py                      # 100k 条生成的 tsp 记录
+# python bench_json_decode.py xlsx_files/xxx_tsp.xlsx
+#
+############################################################################
+import argparse
+import importlib
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from json_batch import RECORD_COLUMNS, _loads, decode_records, station_of
+from xlsx_reader import iter_info_column
+
+
+def synthetic_tsp(n, seed=0):
+    """ n json strings shaped like the TSP-E '数据信息' column
+    :param n:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    failures = ['', 'FSTestProbeFsItems_OOS;PowerTestOOS', 'OpenShortTestOOS', 'DisplayPowerOnFailed']
+    start = datetime(2024, 1, 2, 20)
+    info_list = []
+    for i in range(n):
+        result = rng.choice(['PASS', 'PASS', 'PASS', 'FAIL'])
+        info_list.append(json.dumps({
+            'bobcat_signature': 'x' * 32,
+            'lcg_sn': f'LCG{i:08d}',
+            'mac_address': '00:11:22:33:44:55',
+            'audit_mode': 0,
+            'product': 'D95x',
+            'sn': f'G9P{i:014d}+{rng.randint(0, 9)}',
+            'fixture_id': f'100{rng.randint(1, 6)}0{rng.randint(1, 6)}',
+            'test_station_name': 'TSP-E',
+            'start_time': (start + timedelta(seconds=30 * i - 120)).strftime('%Y-%m-%d %H:%M:%S'),
+            'stop_time': (start + timedelta(seconds=30 * i)).strftime('%Y-%m-%d %H:%M:%S'),
+            'station_id': 'TSP-E_01',
+            'result': result,
+            'sw_version': '1.2.3',
+            'failure_message': rng.choice(failures[1:]) if result == 'FAIL' else '',
+            'station_string': f'TSP;E;2941{rng.randint(0, 99999999):08d}',
+        }, ensure_ascii=False))
+    return info_list
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the batched json decoder against JsonToListDataFrame")
+    parser.add_argument('xlsx', nargs='?', help="an MES export, default synthetic tsp records")
+    parser.add_argument('-n', type=int, default=100000, help="number of synthetic records")
+    args = parser.parse_args()
+
+    if args.xlsx:
+        station = station_of(os.path.basename(args.xlsx))
+        info_list = list(iter_info_column(args.xlsx))
+    else:
+        station = 'tsp'
+        info_list = synthetic_tsp(args.n)
+    print(f"{len(info_list)} {station} records, json decoder: {_loads.__module__}")
+
+    converter = importlib.import_module(station).JsonToListDataFrame
+    old, old_seconds = timed(lambda: converter(info_list).generate_dataframe().reindex(columns=RECORD_COLUMNS))
+    new, new_seconds = timed(decode_records, info_list, station)
+    print(f"JsonToListDataFrame: {old_seconds:.3f}s  {len(info_list) / old_seconds:,.0f} rows/s")
+    print(f"decode_records:      {new_seconds:.3f}s  {len(info_list) / new_seconds:,.0f} rows/s")
+    print(f"speedup: {old_seconds / new_seconds:.1f}x")
+    same = old.astype(object).where(old.notna(), None).equals(new.astype(object).where(new.notna(), None))
+    print(f"same result: {same}")
+
+
+if __name__ == '__main__':
+    main()
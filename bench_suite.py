@@ -0,0 +1,274 @@
+############################################################################
+#
+# 端到端的性能测试: 在临时工作目录中把 synthetic_data.py 生成的数据依次入库, 再查询, 记录
+#   入库: 每条入库路径 (xlsx, Insight record csv, fail csv) 和 generate_record1 的耗时、行数/秒、MB/秒
+#   查询: get_fpy, get_fpy_by_tester, Pareto 等函数在整个时间范围和一天上的延迟 (查询缓存关闭, 重复多次)
+#   内存: 本进程和子进程 (xlsx 解析进程池) 的峰值 RSS
+# 结果保存为 bench_results/<时间>_<数据目录名>.json, --compare 与之前的结果对比.
+# python bench_suite.py --rows 100000                     # 数据生成到 bench_data/100000, 以后重复使用
+# python bench_suite.py --data synthetic --compare bench_results/20240110_120000_100000.json
+#
+############################################################################
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+
+from timestamps import format_time
+
+DATA_DIR = 'bench_data'
+RESULTS_DIR = 'bench_results'
+REPEATS = 5
+# 入库阶段: (名称, 目录, 数据库, 表)
+INGEST_STAGES = [('ingest xlsx', 'xlsx_files', 'mes1.db', 'record'),
+                 ('generate_record1', None, 'mes1.db', 'record1'),
+                 ('ingest record csv', 'csv_files/record', 'insight.db', 'record'),
+                 ('ingest fail csv', 'csv_files/fail_record', 'insight.db', 'fail_record')]
+
+
+def peak_rss_mb():
+    """ peak resident set size of this process and of its waited for children
+    :return: {'self': MB, 'children': MB}
+    """
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20}
+
+
+def folder_bytes(folder):
+    if not os.path.isdir(folder):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+
+def table_rows(db_name, table):
+    from db_pool import get_connection
+
+    conn = get_connection(db_name)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone() is None:
+        return 0
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def ingest_stage(name, folder, max_workers):
+    import collect_data2
+    import collect_fail_record
+    import collect_record
+
+    if name == 'ingest xlsx':
+        collect_data2.add_from_xlsx(folder, max_workers=max_workers)
+    elif name == 'generate_record1':
+        collect_data2.generate_record1()
+    elif name == 'ingest record csv':
+        collect_record.add_from_files(folder)
+    else:
+        collect_fail_record.add_from_files(folder)
+
+
+def run_ingest(max_workers=None, verbose=False):
+    """ run the ingest stages in the current directory
+    :param max_workers: size of the xlsx parser pool
+    :param verbose:
+    :return: {stage: {'seconds', 'rows', 'rows_per_second', 'mb_per_second', 'peak_rss_mb'}}
+    """
+    result = {}
+    for name, folder, db_name, table in INGEST_STAGES:
+        size = folder_bytes(folder) if folder else 0
+        before = table_rows(db_name, table)
+        started = time.perf_counter()
+        # the ingest functions print a line per file and draw progress bars
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            ingest_stage(name, folder, max_workers)
+        seconds = time.perf_counter() - started
+        rows = table_rows(db_name, table) - before
+        result[name] = {'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds if seconds else 0.0,
+                        'mb_per_second': size / 2 ** 20 / seconds if seconds and size else None,
+                        'peak_rss_mb': peak_rss_mb()}
+        if verbose:
+            print(f"{name:<20} {rows:>10} rows {seconds:>9.2f}s {result[name]['rows_per_second']:>12,.0f} rows/s")
+    return result
+
+
+def queries(station='TSP-E'):
+    """ the timed analysis functions
+    :param station: the MES station of the mes1.db queries
+    :return: [(name, function(start, end)), ...]
+    """
+    import collect_data2
+    import collect_fail_record
+    import collect_record
+
+    return [('collect_data2.get_fpy', lambda start, end: collect_data2.get_fpy(start, end, station)),
+            ('collect_data2.get_fpy_time_period',
+             lambda start, end: collect_data2.get_fpy_time_period(start, end, station=station)),
+            ('collect_data2.search_top_tester',
+             lambda start, end: collect_data2.search_top_tester(start, end, station)),
+            ('collect_data2.search_top_failure',
+             lambda start, end: collect_data2.search_top_failure(start, end, station)),
+            ('collect_data2.search_top_carrier',
+             lambda start, end: collect_data2.search_top_carrier(start, end, station)),
+            ('collect_record.get_fpy', collect_record.get_fpy),
+            ('collect_record.get_fpy_by_tester', collect_record.get_fpy_by_tester),
+            ('collect_record.get_fpy_time_period', collect_record.get_fpy_time_period),
+            ('collect_record.search_top_tester',
+             lambda start, end: collect_record.search_top_tester(start, end, 'RETEST')),
+            ('collect_record.search_top_failure',
+             lambda start, end: collect_record.search_top_failure(start, end, 'RETEST')),
+            ('collect_fail_record.search_top_fail_subcategory', collect_fail_record.search_top_fail_subcategory),
+            ('collect_fail_record.retest_failure_counts FIXTURE_ID',
+             lambda start, end: collect_fail_record.retest_failure_counts(start, end, 'FIXTURE_ID')),
+            ('collect_fail_record.get_fail_sn', collect_fail_record.get_fail_sn)]
+
+
+def data_range():
+    """ the time range of the ingested MES records
+    :return: (start, end) '%Y-%m-%d %H:%M:%S'
+    """
+    from db_pool import get_connection
+
+    first, last = get_connection('mes1.db').execute("SELECT MIN(stop_epoch), MAX(stop_epoch) FROM record").fetchone()
+    return format_time(first), format_time(last)
+
+
+def run_queries(repeats=REPEATS, verbose=False):
+    """ time every query on the whole range and on its first day, with the query cache off
+    :param repeats:
+    :param verbose:
+    :return: {'<name> <range>': {'min_ms', 'median_ms', 'max_ms'}}
+    """
+    import query_cache
+
+    query_cache.configure(enabled=False)
+    start, end = data_range()
+    day_end = format_time(min(datetime.strptime(start, '%Y-%m-%d %H:%M:%S') + timedelta(days=1),
+                              datetime.strptime(end, '%Y-%m-%d %H:%M:%S')))
+    result = {}
+    for name, function in queries():
+        for label, window in (('all', (start, end)), ('day', (start, day_end))):
+            times = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                function(*window)
+                times.append((time.perf_counter() - started) * 1000)
+            result[f'{name} {label}'] = {'min_ms': min(times), 'median_ms': statistics.median(times),
+                                         'max_ms': max(times)}
+            if verbose:
+                print(f"{name + ' ' + label:<60} {statistics.median(times):>10.1f} ms")
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(data_dir, work_dir=None, repeats=REPEATS, max_workers=None, keep=False, verbose=False):
+    """ copy data_dir to a new working directory, ingest it and time the queries
+    :param data_dir: a folder written by synthetic_data.generate
+    :param work_dir: default a temporary folder
+    :param repeats: runs of every query
+    :param max_workers: size of the xlsx parser pool
+    :param keep: keep the working directory with its databases
+    :param verbose:
+    :return: the result dict
+    """
+    from db_pool import close_all
+
+    data_dir = os.path.abspath(data_dir)
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='bench_'))
+    for folder in ('xlsx_files', 'csv_files'):
+        if os.path.isdir(os.path.join(data_dir, folder)):
+            shutil.copytree(os.path.join(data_dir, folder), os.path.join(work_dir, folder), dirs_exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    logging.basicConfig(filename='bench.log', level=logging.INFO)
+    try:
+        result = {'started': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(),
+                  'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                  'data': data_dir, 'ingest': run_ingest(max_workers, verbose),
+                  'queries': run_queries(repeats, verbose), 'peak_rss_mb': peak_rss_mb()}
+    finally:
+        close_all()
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if verbose:
+        print(f"peak rss: {result['peak_rss_mb']['self']:.0f} MB, children {result['peak_rss_mb']['children']:.0f} MB")
+    return result
+
+
+def save(result, label, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{datetime.now():%Y%m%d_%H%M%S}_{label}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(result, file, indent=2, ensure_ascii=False)
+    return path
+
+
+def compare(old, new):
+    """ print the metrics of two results side by side
+    :param old: result dict
+    :param new: result dict
+    :return: [(metric, old value, new value, new / old), ...]
+    """
+    rows = []
+    for stage in new['ingest']:
+        if stage in old['ingest']:
+            rows.append((f'{stage} rows/s', old['ingest'][stage]['rows_per_second'],
+                         new['ingest'][stage]['rows_per_second']))
+    for query in new['queries']:
+        if query in old['queries']:
+            rows.append((f'{query} ms', old['queries'][query]['median_ms'], new['queries'][query]['median_ms']))
+    for process in ('self', 'children'):
+        rows.append((f'peak rss {process} MB', old['peak_rss_mb'][process], new['peak_rss_mb'][process]))
+    rows = [(metric, before, after, after / before if before else None) for metric, before, after in rows]
+    print(f"{'':<66} {old.get('commit') or 'old':>12} {new.get('commit') or 'new':>12}")
+    for metric, before, after, ratio in rows:
+        print(f"{metric:<66} {before:>12.1f} {after:>12.1f} {'' if ratio is None else f'{ratio:.2f}x':>8}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ingest synthetic data and time the ingest paths and the queries")
+    parser.add_argument('--rows', type=int, default=100000, help="rows of each kind of synthetic data")
+    parser.add_argument('--data', help="a folder written by synthetic_data.py, default bench_data/<rows>")
+    parser.add_argument('--work', help="working directory, default a temporary folder")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="runs of every query")
+    parser.add_argument('--workers', type=int, help="xlsx parser processes")
+    parser.add_argument('--keep', action='store_true', help="keep the working directory")
+    parser.add_argument('--results', default=RESULTS_DIR, help="folder of the saved results")
+    parser.add_argument('--compare', help="a saved result to compare with")
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    data_dir = args.data or os.path.join(DATA_DIR, str(args.rows))
+    if not os.path.isdir(data_dir):
+        import synthetic_data
+
+        print(f"generating {args.rows} rows of each kind in {data_dir}")
+        synthetic_data.generate(data_dir, args.rows, max_workers=args.workers)
+    result = run(data_dir, args.work, args.repeats, args.workers, args.keep, verbose=True)
+    print(f"saved to {save(result, os.path.basename(os.path.normpath(data_dir)), args.results)}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(json.load(file), result)
+
+
+if __name__ == '__main__':
+    main()
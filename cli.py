@@ -0,0 +1,192 @@
+############################################################################
+#
+# 命令行入口: 入库、分类、FPY、Pareto 和失败分类报告.
+# 各子命令只在运行时导入自己需要的模块, pandas / tqdm / matplotlib 只有用到它们的子命令才加载,
+# fpy / pareto 这类简单查询不加载 pandas.
+# python cli.py ingest xlsx [xlsx_files] [--workers 4]
+# python cli.py ingest record | fail [folder] [--metrics-dir metrics]
+# python cli.py classify
+# python cli.py fpy mes "2024-01-09 20:00:00" "2024-01-16 20:00:00" --station TSP-E [--daily]
+# python cli.py fpy insight "2024-01-09 20:00:00" "2024-01-16 20:00:00" [--daily | --by-tester]
+# python cli.py pareto mes fixture_id "2024-01-09 20:00:00" "2024-01-16 20:00:00" --where test_station=TSP-E
+# python cli.py pareto fail FIXTURE_ID "2024-01-09 20:00:00" "2024-01-16 20:00:00" --sub-category xxx
+# python cli.py report --daily "2024-01-09 20:00:00" "2024-01-16 20:00:00"
+# python cli.py --memory-limit 512 pareto fail FIXTURE_ID "2024-01-01 00:00:00" "2024-02-01 00:00:00"
+#
+############################################################################
+import argparse
+import importlib
+import logging
+import os
+import sys
+import warnings
+
+from timestamps import format_time
+
+# 入库的类型 -> (模块, 入库函数, 默认目录), 目录与 ingest_daemon.ROUTES 一致
+INGEST = {'xlsx': ('collect_data2', 'add_from_xlsx', 'xlsx_files'),
+          'record': ('collect_record', 'add_from_files', 'csv_files/record'),
+          'fail': ('collect_fail_record', 'add_from_files', 'csv_files/fail_record')}
+# 数据源 -> (模块, 数据库, pareto 的默认表)
+SOURCES = {'mes': ('collect_data2', 'mes1.db', 'record'),
+           'insight': ('collect_record', 'insight.db', 'record'),
+           'fail': ('collect_fail_record', 'insight.db', 'fail_record')}
+
+
+def load(module_name):
+    """ import module_name and send the logging to its log file
+    :param module_name:
+    :return: the module
+    """
+    module = importlib.import_module(module_name)
+    warnings.filterwarnings('ignore')
+    logging.basicConfig(filename=module.LOG_FILE, level=logging.INFO)
+    return module
+
+
+def key_value(text):
+    column, sep, value = text.partition('=')
+    if not sep or not column:
+        raise argparse.ArgumentTypeError(f"{text!r} is not COLUMN=VALUE")
+    return column, value
+
+
+def time_text(text):
+    try:
+        return format_time(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a time like '2024-01-09 20:00:00'")
+
+
+def print_rows(header, rows):
+    print('\t'.join(header))
+    for row in rows:
+        print('\t'.join(f'{value:.4f}' if isinstance(value, float) else str(value) for value in row))
+
+
+def ingest(args):
+    module_name, function, folder = INGEST[args.kind]
+    module = load(module_name)
+    kwargs = {'max_workers': args.workers} if args.kind == 'xlsx' else {}
+    getattr(module, function)(args.folder or folder, **kwargs)
+    if args.metrics_dir:
+        import metrics
+
+        os.makedirs(args.metrics_dir, exist_ok=True)
+        metrics.write(os.path.join(args.metrics_dir, f'ingest_{args.kind}.prom'),
+                      os.path.join(args.metrics_dir, f'ingest_{args.kind}.json'))
+
+
+def classify(args):
+    print(f"{load('collect_data2').generate_record1()} sn classified")
+
+
+def fpy(args):
+    module = load(SOURCES[args.source][0])
+    station = {'station': args.station} if args.source == 'mes' else {}
+    if (args.daily or args.by_tester) and args.backend != 'sqlite':
+        raise SystemExit("--backend archive is only available for the fpy of the whole range")
+    if args.by_tester:
+        if args.source != 'insight':
+            raise SystemExit("--by-tester is only available for insight")
+        print(module.get_fpy_by_tester(args.start, args.end).to_string())
+    elif args.daily:
+        print_rows(['start', 'end'] + module.FPY_COLUMNS,
+                   module.get_fpy_time_period(args.start, args.end, **station))
+    else:
+        values = module.get_fpy(args.start, args.end, backend=args.backend, **station)
+        print_rows(module.FPY_COLUMNS, [values])
+
+
+def pareto(args):
+    module_name, db_name, table = SOURCES[args.source]
+    module = load(module_name)
+    if args.source == 'fail':
+        if args.where or args.table or args.backend != 'sqlite':
+            raise SystemExit("--where, --table and --backend archive are not available for fail")
+        # 失败记录按 sn 去掉真正失败的, 取每个 sn 的第一条
+        rows = module.retest_failure_rows(args.start, args.end, args.dimension, args.sub_category, args.top)
+    else:
+        if args.sub_category is not None:
+            raise SystemExit("--sub-category is only available for fail")
+
+        from pareto import pareto_rows
+
+        rows = pareto_rows(db_name, args.table or table, args.dimension, args.start, args.end, dict(args.where),
+                           args.top, args.backend)
+    print_rows([args.dimension, 'count'], rows)
+
+
+def report(args):
+    load('collect_fail_record')
+    import fail_report
+
+    windows = [tuple(window) for window in args.window]
+    if args.daily:
+        windows += fail_report.daily_windows(*args.daily)
+    if not windows:
+        raise SystemExit("no time window, use --window or --daily")
+    fail_report.run(windows, args.out, args.workers, verbose=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ingest and analyse the mes and insight test records")
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help="memory ceiling of the SQLite connections, sorts and temporary data go to disk beyond it")
+    parser.add_argument('--batch-rows', type=int, help="rows fetched at a time by the streamed queries")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('ingest', help="ingest the new files of a folder")
+    command.add_argument('kind', choices=sorted(INGEST))
+    command.add_argument('folder', nargs='?', help="default: the folder ingest_daemon watches")
+    command.add_argument('--workers', type=int, help="parser processes for xlsx")
+    command.add_argument('--metrics-dir', help="write the ingest metrics (.prom and .json) here when done")
+    command.set_defaults(run=ingest)
+
+    command = commands.add_parser('classify', help="classify the new mes records into record1")
+    command.set_defaults(run=classify)
+
+    command = commands.add_parser('fpy', help="first pass yield of a time range")
+    command.add_argument('source', choices=['mes', 'insight'])
+    command.add_argument('start', type=time_text)
+    command.add_argument('end', type=time_text)
+    command.add_argument('--station', default='TSP-E', help="mes only")
+    command.add_argument('--daily', action='store_true', help="one row per day")
+    command.add_argument('--by-tester', action='store_true', help="one row per fixture, insight only")
+    command.add_argument('--backend', choices=['sqlite', 'archive'], default='sqlite')
+    command.set_defaults(run=fpy)
+
+    command = commands.add_parser('pareto', help="record count of every value of a column")
+    command.add_argument('source', choices=sorted(SOURCES))
+    command.add_argument('dimension', help="the column to count")
+    command.add_argument('start', type=time_text)
+    command.add_argument('end', type=time_text)
+    command.add_argument('--table', help="mes / insight table, default record")
+    command.add_argument('--where', type=key_value, action='append', default=[], metavar='COLUMN=VALUE',
+                         help="filter, may be repeated")
+    command.add_argument('--sub-category', help="fail only, the rows of this sub category")
+    command.add_argument('--top', type=int)
+    command.add_argument('--backend', choices=['sqlite', 'archive'], default='sqlite')
+    command.set_defaults(run=pareto)
+
+    command = commands.add_parser('report', help="fail category reports (csv and png) of time windows")
+    command.add_argument('--window', nargs=2, action='append', default=[], metavar=('START', 'END'),
+                         help="a time window, may be repeated")
+    command.add_argument('--daily', nargs=2, metavar=('START', 'END'), help="one window per day from START to END")
+    command.add_argument('--out', default='out', help="output folder")
+    command.add_argument('--workers', type=int, help="number of rendering processes")
+    command.set_defaults(run=report)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.memory_limit is not None or args.batch_rows is not None:
+        import streaming
+
+        streaming.configure(args.memory_limit, args.batch_rows)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,56 +2,92 @@
 #
 #将xlsx文件中列‘数据信息’转化为一个dataframe,
 #获取一列中信息tolist()，遍历list，json.load()将其Json格式转化成-->字典，并最终append到一个新的list.
-#最后将Dict_list转化为dataframe.然后用to_sql将dataframe存储到数据库。
+#最后将Dict_list转化为dataframe.然后用executemany将dataframe存储到数据库, 与入库记录在同一个事务中。
 #
 #
 ############################################################################
 import os
 import sqlite3
+import time
 import pandas as pd
 import res, dva, tsp
+from xlsx_reader import iter_info_column
+from ingest_ledger import create_ledger, file_digest, is_ingested, mark_done, mark_failed, quarantine
 
-folder_path = "xlsx_files"
-
-# Create a connection object to the database
-conn = sqlite3.connect('mes.db')
-
-# Loop through each file in the folder
-for filename in os.listdir(folder_path):
-    if filename.endswith(".xlsx"):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            # Open the xlsx file ,return a dataframe
-            data = pd.read_excel(file_path)
-            # Get the necessary information from the "数据信息" column
-            info_list = data['数据信息'].tolist()
-
-            df = pd.DataFrame()
-            # Convert the json list to dataframe
-            if 'res' in filename or 'RES' in filename:
-                json_to_dataframe = res.JsonToListDataFrame(info_list)
-                df = json_to_dataframe.generate_dataframe()
-            elif 'dva' in filename or 'DVA' in filename:
-                json_to_dataframe = dva.JsonToListDataFrame(info_list)
-                df = json_to_dataframe.generate_dataframe()
-            elif 'tsp' in filename or 'TSP' in filename:
-                json_to_dataframe = tsp.JsonToListDataFrame(info_list)
-                df = json_to_dataframe.generate_dataframe()
-
-            # Convert stop_time to datetime format if it is not already
-            df['stop_time'] = pd.to_datetime(df['stop_time'])
-            # df['start_time'] = pd.to_datetime(df['start_time'])
-            # Calculate the test_time
-            # df['test_time'] = (df['stop_time'] - df['start_time']).dt.total_seconds()
-            # Drop the start_time column
-            # df = df.drop(['start_time'], axis=1)
-
-            # Store the DataFrame to the database
-            df.to_sql('record', conn, if_exists='append', index=False)
-        except Exception as e:
-            print(e)
-        finally:
+FOLDER_PATH = "xlsx_files"
+
+
+def insert_dataframe(conn, df):
+    """ insert df into record without committing (to_sql commits on its own), the table is created like to_sql does
+    :param conn:
+    :param df:
+    :return:
+    """
+    conn.execute(pd.io.sql.get_schema(df, 'record').replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+    # datetimes are stored as text, like to_sql
+    for column in df.select_dtypes(include='datetime').columns:
+        df[column] = df[column].map(lambda value: None if pd.isna(value) else value.isoformat(' '))
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    names = ', '.join(f'"{column}"' for column in df.columns)
+    placeholders = ', '.join('?' * len(df.columns))
+    conn.executemany(f"INSERT INTO record ({names}) VALUES ({placeholders})", rows)
+
+
+def main(folder_path=FOLDER_PATH):
+    # Create a connection object to the database
+    conn = sqlite3.connect('mes.db')
+    create_ledger(conn)
+
+    # Loop through each file in the folder
+    for filename in os.listdir(folder_path):
+        if filename.endswith(".xlsx"):
+            file_path = os.path.join(folder_path, filename)
+            # Skip the files which have already been ingested
+            digest = file_digest(file_path)
+            if is_ingested('mes.db', digest):
+                os.remove(file_path)
+                continue
+            started_at = time.time()
+            try:
+                # Stream the necessary information from the "数据信息" column
+                info_list = iter_info_column(file_path)
+
+                df = pd.DataFrame()
+                # Convert the json list to dataframe
+                if 'res' in filename or 'RES' in filename:
+                    json_to_dataframe = res.JsonToListDataFrame(info_list)
+                    df = json_to_dataframe.generate_dataframe()
+                elif 'dva' in filename or 'DVA' in filename:
+                    json_to_dataframe = dva.JsonToListDataFrame(info_list)
+                    df = json_to_dataframe.generate_dataframe()
+                elif 'tsp' in filename or 'TSP' in filename:
+                    json_to_dataframe = tsp.JsonToListDataFrame(info_list)
+                    df = json_to_dataframe.generate_dataframe()
+
+                # Convert stop_time to datetime format if it is not already
+                df['stop_time'] = pd.to_datetime(df['stop_time'])
+                # df['start_time'] = pd.to_datetime(df['start_time'])
+                # Calculate the test_time
+                # df['test_time'] = (df['stop_time'] - df['start_time']).dt.total_seconds()
+                # Drop the start_time column
+                # df = df.drop(['start_time'], axis=1)
+
+                # Store the DataFrame to the database, in the same transaction as the ledger entry
+                insert_dataframe(conn, df)
+                mark_done(conn, digest, filename, len(df), started_at)
+                conn.commit()
+            except Exception as e:
+                print(e)
+                conn.rollback()
+                # Keep the failed file for a retry
+                mark_failed('mes.db', digest, filename, started_at, e)
+                quarantine(file_path)
+                continue
             os.remove(file_path)
 
-# Close the connection
-conn.close()
+    # Close the connection
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,27 @@
 import logging
 import os
-import sqlite3
-import threading
+import time
 import warnings
-import pandas as pd
-from tqdm import tqdm
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime, timedelta
-
-import dva
-import res
-import tsp
-
-# 忽略警告
-warnings.filterwarnings('ignore')
-
-# 设置日志记录器
-logging.basicConfig(filename='database.log', level=logging.INFO)
+from itertools import islice
+
+import metrics
+from db_pool import get_connection
+from dictionary import insert_rows
+from ingest_ledger import file_digest, is_ingested, mark_done, mark_failed, quarantine
+from json_batch import RECORD_COLUMNS, decode_records, station_of
+from migrate import upgrade
+from pareto import pareto
+from query_cache import cached, record_change, whole_days_span
+from rollup import add_rows, grouped_counts, remove_rows
+from streaming import iter_rows
+from timestamps import add_epoch, parse_time, to_epoch
+from xlsx_reader import iter_info_column
+
+# 日志文件, 由脚本入口 (__main__, cli.py) 设置, 导入本模块没有副作用;
+# pandas / tqdm 等较重的模块在用到的函数中才导入
+LOG_FILE = 'database.log'
 
 
 def db_operation(func):
@@ -25,22 +31,26 @@ def db_operation(func):
     """
 
     def wrapper(*args, **kwargs):
-        # 连接数据库
-        conn = sqlite3.connect('mes1.db')
+        # 获取本线程的数据库连接
+        conn = get_connection('mes1.db')
+        started = time.perf_counter()
         try:
             # 执行数据库操作
             result = func(conn, *args, **kwargs)
-            # 提交事务并关闭连接
+            # 提交事务
             conn.commit()
         except Exception as e:
-            # 回滚事务并关闭连接
+            # 回滚事务
             conn.rollback()
+            # 记录日志和错误计数
+            logging.error(f"{func.__name__} failed: {type(e).__name__}: {e}")
+            metrics.inc('db_operation_errors_total', function=func.__name__, db='mes1.db', error=type(e).__name__)
             raise e
         finally:
-            # 关闭连接
-            conn.close()
-            # 记录日志
-            logging.info(f"{func.__name__} executed successfully")
+            metrics.observe('db_operation_seconds', time.perf_counter() - started, function=func.__name__,
+                            db='mes1.db')
+        # 记录日志
+        logging.info(f"{func.__name__} executed successfully")
         return result
 
     return wrapper
@@ -66,16 +76,38 @@ def create_table(conn):
 
 
 @db_operation
-def insert_records(conn, series):
+def insert_dataframe(conn, df, ledger_entries=()):
+    """ insert the whole dataframe in one transaction, rows already in record are skipped
+    :param conn:
+    :param df:
+    :param ledger_entries: (digest, filename, row_count, started_at) of the files in df,
+                           written to ingest_ledger in the same transaction
+    :return: (inserted_count, skipped_count)
+    """
+    with metrics.timer('ingest_stage_seconds', source='xlsx', stage='transform'):
+        df = add_epoch(df.reindex(columns=RECORD_COLUMNS), 'stop_time', 'stop_epoch')
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO record VALUES (?, ? ,? ,? ,? ,?, ?, ?)", tuple(series))
+    cursor.execute("SELECT IFNULL(MAX(rowid), 0) FROM record")
+    last_rowid = cursor.fetchone()[0]
+    with metrics.timer('ingest_stage_seconds', source='xlsx', stage='insert'):
+        inserted = insert_rows(conn, 'mes1.db', 'record', list(df.columns), rows, or_ignore=True)
+    # the rows just inserted are the ones after last_rowid
+    with metrics.timer('ingest_stage_seconds', source='xlsx', stage='rollup'):
+        add_rows(conn, 'mes1.db', 'record', 'rowid > ?', (last_rowid,))
+        record_change(conn, 'mes1.db', 'record', 'rowid > ?', (last_rowid,))
+    for digest, filename, row_count, started_at in ledger_entries:
+        mark_done(conn, digest, filename, row_count, started_at)
     conn.commit()
+    metrics.inc('ingest_rows_total', inserted, source='xlsx', outcome='inserted')
+    metrics.inc('ingest_rows_total', len(df) - inserted, source='xlsx', outcome='skipped')
+    return inserted, len(df) - inserted
 
 
 @db_operation
 def search_by_sn(conn, sn):
     cursor = conn.cursor()
-    cursor.execute(f"SELECT * FROM record WHERE sn = '{sn}'")
+    cursor.execute("SELECT * FROM record WHERE sn = ?", (sn,))
     result = cursor.fetchall()
     return result
 
@@ -92,11 +124,11 @@ def is_table_exists(db_name, table_name):
     if not os.path.exists(db_name):
         print(f"{db_name} does not exist")
         return False
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
+    # a dictionary encoded table (dictionary.py) is a view over <table>_data
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (table_name,))
     result = cursor.fetchone()
-    conn.close()
     if result:
         return True
     else:
@@ -104,14 +136,14 @@ def is_table_exists(db_name, table_name):
 
 
 def check_row_exists(series, db_name, table_name):
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
     row_values = series.tolist()
     row_index = series.index
-    query = f"SELECT * FROM {table_name} WHERE " + " AND ".join([f"{col} = ?" for col in row_index])
+    # 只判断是否存在, 不读整行
+    query = f"SELECT 1 FROM {table_name} WHERE " + " AND ".join([f"{col} = ?" for col in row_index]) + " LIMIT 1"
     cursor.execute(query, row_values)
     result = cursor.fetchone()
-    conn.close()
     if result:
         return True
     else:
@@ -119,74 +151,179 @@ def check_row_exists(series, db_name, table_name):
 
 
 def check_sn_exists(sn, db_name, table_name):
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
 
-    query = f"SELECT sn FROM {table_name} WHERE sn='{sn}'"
-    cursor.execute(query)
+    query = f"SELECT sn FROM {table_name} WHERE sn = ?"
+    cursor.execute(query, (sn,))
     result = cursor.fetchone()
-    conn.close()
     if result:
         return True
     else:
         return False
 
 
+def parse_file(file_path):
+    """ parse one xlsx file into a dataframe in record column order, runs in the worker processes
+    :param file_path:
+    :return:
+    """
+    import pandas as pd
+
+    filename = os.path.basename(file_path)
+    # Stream the "数据信息" column of the xlsx file and decode it in batches
+    station = station_of(filename)
+    if station is None:
+        return pd.DataFrame(columns=RECORD_COLUMNS)
+    df = decode_records(iter_info_column(file_path), station)
+    return df.reindex(columns=RECORD_COLUMNS)
+
+
+def parse_file_timed(file_path):
+    """ parse_file and its duration, the metrics of the worker processes are not seen by the main process
+    :param file_path:
+    :return: (dataframe, seconds)
+    """
+    started = time.perf_counter()
+    df = parse_file(file_path)
+    return df, time.perf_counter() - started
+
+
+def count_failure(files, error):
+    metrics.inc('ingest_files_total', files, source='xlsx', outcome='failed')
+    metrics.inc('ingest_errors_total', source='xlsx', error=type(error).__name__)
+
+
 def process_file(folder_path, filename):
 
     if filename.endswith(".xlsx"):
         file_path = os.path.join(folder_path, filename)
+        digest = file_digest(file_path)
+        if is_ingested('mes1.db', digest):
+            print(f"{filename} has already been ingested, skipped")
+            metrics.inc('ingest_files_total', source='xlsx', outcome='duplicate')
+            os.remove(file_path)
+            return
+        started_at = time.time()
+        metrics.inc('ingest_bytes_total', os.path.getsize(file_path), source='xlsx')
         try:
-            # Open the xlsx file
-            data = pd.read_excel(file_path)
-            # Get the necessary information from the "数据信息" column
-            info_list = data['数据信息'].tolist()
-            df = pd.DataFrame()
-            # Convert the json list to dataframe
-            if 'res' in filename or 'RES' in filename:
-                json_to_dataframe = res.JsonToListDataFrame(info_list)
-                df = json_to_dataframe.generate_dataframe()
-            elif 'dva' in filename or 'DVA' in filename:
-                json_to_dataframe = dva.JsonToListDataFrame(info_list)
-                df = json_to_dataframe.generate_dataframe()
-            elif 'tsp' in filename or 'TSP' in filename:
-                json_to_dataframe = tsp.JsonToListDataFrame(info_list)
-                df = json_to_dataframe.generate_dataframe()
-                df = df.reindex(
-                    columns=['fixture_id', 'stop_time', 'result', 'sn', 'sw_version', 'failure_message', 'Carrier_sn',
-                             'test_station'])
-            # df['stop_time'] = pd.to_datetime(df['stop_time'])
+            with metrics.timer('ingest_stage_seconds', source='xlsx', stage='parse'):
+                df = parse_file(file_path)
+            metrics.inc('ingest_rows_total', len(df), source='xlsx', outcome='read')
             if not is_table_exists('mes1.db', 'record'):
                 create_table()
-            for i in tqdm(range(len(df)), mininterval=2):
-                row = df.iloc[i]
-                if not check_row_exists(row, 'mes1.db', 'record'):
-                    insert_records(row)
+            upgrade('mes1.db')
+            inserted, skipped = insert_dataframe(df, [(digest, filename, len(df), started_at)])
         except Exception as e:
             print(e)
-        finally:
-            os.remove(file_path)
-
-
-def add_from_xlsx(folder_path):
-    threads = []
-    # Loop through each file in the folder
-    for filename in os.listdir(folder_path):
-        t = threading.Thread(target=process_file, args=(folder_path, filename))
-        t.start()
-        threads.append(t)
+            count_failure(1, e)
+            mark_failed('mes1.db', digest, filename, started_at, e)
+            quarantine(file_path)
+            return
+        metrics.inc('ingest_files_total', source='xlsx', outcome='done')
+        print(f"{filename}: {inserted} inserted, {skipped} skipped")
+        logging.info(f"{filename}: {inserted} inserted, {skipped} skipped")
+        os.remove(file_path)
+        return inserted, skipped
+
+
+def write_batch(frames, entries):
+    """ write the parsed frames of several files in one transaction, then remove the files
+    :param frames:
+    :param entries: (file_path, digest, started_at) of every frame
+    :return:
+    """
+    import pandas as pd
 
-    for t in threads:
-        t.join()
+    if not entries:
+        return
+    ledger_entries = [(digest, os.path.basename(file_path), len(df), started_at)
+                      for df, (file_path, digest, started_at) in zip(frames, entries)]
+    try:
+        inserted, skipped = insert_dataframe(pd.concat(frames, ignore_index=True), ledger_entries)
+    except Exception as e:
+        print(e)
+        count_failure(len(entries), e)
+        for file_path, digest, started_at in entries:
+            mark_failed('mes1.db', digest, os.path.basename(file_path), started_at, e)
+            quarantine(file_path)
+        return
+    metrics.inc('ingest_files_total', len(entries), source='xlsx', outcome='done')
+    print(f"{len(entries)} files: {inserted} inserted, {skipped} skipped")
+    logging.info(f"{len(entries)} files: {inserted} inserted, {skipped} skipped")
+    for file_path, _, _ in entries:
+        os.remove(file_path)
+
+
+def add_from_xlsx(folder_path, max_workers=None, batch_rows=200000):
+    """ parse the xlsx files in a process pool, the main process is the only writer of mes1.db
+    files already in ingest_ledger are removed without being parsed
+    :param folder_path:
+    :param max_workers: size of the process pool, default os.cpu_count()
+    :param batch_rows: parsed rows buffered before they are committed in one transaction
+    :return:
+    """
+    from tqdm import tqdm
+
+    file_paths = [os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+                  if filename.endswith(".xlsx")]
+    if not file_paths:
+        return
+    if not is_table_exists('mes1.db', 'record'):
+        create_table()
+    upgrade('mes1.db')
+
+    def new_files():
+        for file_path in file_paths:
+            digest = file_digest(file_path)
+            if is_ingested('mes1.db', digest):
+                print(f"{os.path.basename(file_path)} has already been ingested, skipped")
+                metrics.inc('ingest_files_total', source='xlsx', outcome='duplicate')
+                os.remove(file_path)
+                bar.update(1)
+                continue
+            metrics.inc('ingest_bytes_total', os.path.getsize(file_path), source='xlsx')
+            yield file_path, digest
+
+    max_workers = max_workers or os.cpu_count() or 1
+    # backpressure: at most 2 files per worker are in flight, so parsed frames waiting
+    # for the writer never exceed batch_rows plus those files
+    max_pending = 2 * max_workers
+    pending = {}
+    frames, entries, buffered = [], [], 0
+    with ProcessPoolExecutor(max_workers=max_workers) as pool, \
+            tqdm(total=len(file_paths), desc="parse xlsx", mininterval=1) as bar:
+        todo = new_files()
+        for file_path, digest in islice(todo, max_pending):
+            pending[pool.submit(parse_file_timed, file_path)] = (file_path, digest, time.time())
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_path, digest, started_at = pending.pop(future)
+                bar.update(1)
+                try:
+                    df, seconds = future.result()
+                except Exception as e:
+                    print(f"{file_path}: {e}")
+                    count_failure(1, e)
+                    mark_failed('mes1.db', digest, os.path.basename(file_path), started_at, e)
+                    quarantine(file_path)
+                    continue
+                metrics.observe('ingest_stage_seconds', seconds, source='xlsx', stage='parse')
+                metrics.inc('ingest_rows_total', len(df), source='xlsx', outcome='read')
+                frames.append(df)
+                entries.append((file_path, digest, started_at))
+                buffered += len(df)
+            if buffered >= batch_rows:
+                write_batch(frames, entries)
+                frames, entries, buffered = [], [], 0
+            for file_path, digest in islice(todo, max_pending - len(pending)):
+                pending[pool.submit(parse_file_timed, file_path)] = (file_path, digest, time.time())
+    write_batch(frames, entries)
 
     print("所有文件处理完成")
 
 
-#
-folder = "xlsx_files"
-add_from_xlsx(folder)
-
-
 # print(search_by_sn('G9P3503G0QL21KHA6'))
 
 #  create_table()
@@ -211,109 +348,175 @@ def create_table1(conn):
     conn.commit()
 
 
-@db_operation
-def insert_record1(conn, lst):
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO record1 VALUES (?, ? ,? )", tuple(lst))
-    conn.commit()
-
-
 # create_table1()
 
 
-def generate_record1(n):
-    # 连接数据库
-    conn = sqlite3.connect('mes1.db')
-    station = 'TSP-E'
-    sql_query = f"SELECT DISTINCT sn FROM record WHERE test_station ='{station}' "
-    # 查询数据
-
-    df = pd.read_sql_query(sql_query, conn)
-    sn_list = df['sn'].tolist()
-
-    for item in tqdm(sn_list[n:-1], desc="analysis records", colour='green', mininterval=1):
-        if not check_sn_exists(item, 'mes1.db', 'record1'):
-            sql = f"SELECT * FROM record WHERE sn='{item}' AND test_station ='TSP-E' ORDER BY stop_time DESC"
-            sorted_df = pd.read_sql_query(sql, conn)
-            recent_result = sorted_df.iloc[0]['result']
-            if len(sorted_df) == 1:
-                if recent_result == 'PASS':
-                    insert_record1([item, sorted_df.iloc[0]['stop_time'], 'PASS'])
-                else:
-                    insert_record1([item, sorted_df.iloc[0]['stop_time'], 'TO_BE_TESTING'])
-            elif 1 < len(sorted_df) < 4:
-                if recent_result == 'PASS':
-                    insert_record1([item, sorted_df.iloc[0]['stop_time'], 'RETEST'])
-                else:
-                    insert_record1([item, sorted_df.iloc[0]['stop_time'], 'TO_BE_TESTING'])
-            elif len(sorted_df) == 4:
-                if recent_result == 'PASS':
-                    insert_record1([item, sorted_df.iloc[0]['stop_time'], 'PASS'])
-                else:
-                    insert_record1([item, sorted_df.iloc[0]['stop_time'], 'FAIL'])
-            elif len(sorted_df) > 4:
-                insert_record1([item, sorted_df.iloc[0]['stop_time'], 'FAIL'])
-    conn.close()
-
-# generate_record1(145956)
-
-def get_fpy(start_time, end_time):
-    conn = sqlite3.connect('mes1.db')
-    sql_query = f"SELECT COUNT(*) FROM record1 WHERE stop_time BETWEEN? AND? "
-    result = get_records(start_time, end_time, sql_query)
-    input_count = result[0][0]
-    if input_count == 0:
-        return 0, 0, 0, 0, 0, 0, 0, 0
-    # print(f'input:\t{input_count}')
-
-    sql_query = f"SELECT COUNT(*) FROM record1 WHERE stop_time BETWEEN? AND? AND result_type = 'PASS' "
-    result = get_records(start_time, end_time, sql_query)
-    pass_count = result[0][0]
-    pass_rate = pass_count / input_count
-    # print(f'pass:\t{pass_count}\t\tYeild:\t{pass_rate:.2%}')
+# 每个 (sn, 站) 的首次测试结论, 按该 sn 在该站的测试次数和最近一次结果:
+#   1 次: PASS -> PASS, 否则 TO_BE_TESTING
+#   2~3 次: PASS -> RETEST, 否则 TO_BE_TESTING
+#   4 次: PASS -> PASS, 否则 FAIL
+#   4 次以上: FAIL
+CLASSIFY_SQL = """WITH touched AS (
+                      SELECT DISTINCT sn, test_station FROM record
+                      WHERE rowid > :last_rowid AND rowid <= :max_rowid
+                      AND sn IS NOT NULL AND test_station IS NOT NULL),
+                  history AS (
+                      SELECT record.sn, record.test_station, record.stop_time, record.stop_epoch, record.result,
+                             COUNT(*) OVER (PARTITION BY record.sn, record.test_station) AS tests,
+                             ROW_NUMBER() OVER (PARTITION BY record.sn, record.test_station
+                                                ORDER BY record.stop_epoch DESC) AS recent
+                      FROM record JOIN touched
+                      ON record.sn = touched.sn AND record.test_station = touched.test_station
+                      WHERE record.rowid <= :max_rowid)
+                  INSERT INTO record1 (sn, stop_time, stop_epoch, result_type, test_station)
+                  SELECT sn, stop_time, stop_epoch,
+                         CASE WHEN tests = 1 THEN CASE WHEN result = 'PASS' THEN 'PASS' ELSE 'TO_BE_TESTING' END
+                              WHEN tests < 4 THEN CASE WHEN result = 'PASS' THEN 'RETEST' ELSE 'TO_BE_TESTING' END
+                              WHEN tests = 4 THEN CASE WHEN result = 'PASS' THEN 'PASS' ELSE 'FAIL' END
+                              ELSE 'FAIL' END,
+                         test_station
+                  FROM history WHERE recent = 1
+                  ON CONFLICT (sn, test_station) DO UPDATE SET
+                  stop_time = excluded.stop_time, stop_epoch = excluded.stop_epoch,
+                  result_type = excluded.result_type"""
 
-    sql_query = f"SELECT COUNT(*) FROM record1 WHERE stop_time BETWEEN? AND? AND result_type = 'FAIL'"
-    result = get_records(start_time, end_time, sql_query)
-    fail_count = result[0][0]
-    fail_rate = fail_count / input_count
-    # print(f'fail:\t{fail_count}\t\tfail_rate:\t{fail_rate:.2%}')
 
-    sql_query = f"SELECT COUNT(*) FROM record1 WHERE stop_time BETWEEN? AND? AND result_type = 'RETEST'"
-    result = get_records(start_time, end_time, sql_query)
-    retest_count = result[0][0]
-    retest_rate = retest_count / input_count
-    # print(f'retest:\t{retest_count}\t\tretest_rate:\t{retest_rate:.2%}')
-
-    sql_query = f"SELECT COUNT(*) FROM record1 WHERE stop_time BETWEEN? AND? AND result_type = 'TO_BE_TESTING'"
-    result = get_records(start_time, end_time, sql_query)
-    testing_count = result[0][0]
+@db_operation
+def classify_records(conn):
+    """ (re)classify the sn of every station that got new records since the last run, in one transaction
+    :param conn:
+    :return: number of classified sn
+    """
+    cursor = conn.cursor()
+    # record 的 rowid 随入库递增, 作为上次分类位置的高水位
+    cursor.execute("SELECT last_rowid FROM record1_state")
+    last_rowid = cursor.fetchone()[0]
+    cursor.execute("SELECT IFNULL(MAX(rowid), 0) FROM record")
+    max_rowid = cursor.fetchone()[0]
+    if max_rowid <= last_rowid:
+        return 0
+    # record1 rows of the touched sn leave the hourly rollup before the upsert and come back after it
+    touched = ("(sn, test_station) IN (SELECT sn, test_station FROM record "
+               "WHERE rowid > :last_rowid AND rowid <= :max_rowid)")
+    params = {'last_rowid': last_rowid, 'max_rowid': max_rowid}
+    remove_rows(conn, 'mes1.db', 'record1', touched, params)
+    record_change(conn, 'mes1.db', 'record1', touched, params)
+    # rowcount is not set for a statement starting with WITH
+    changes = conn.total_changes
+    cursor.execute(CLASSIFY_SQL, params)
+    classified = conn.total_changes - changes
+    add_rows(conn, 'mes1.db', 'record1', touched, params)
+    record_change(conn, 'mes1.db', 'record1', touched, params)
+    cursor.execute("""UPDATE record1_state SET last_rowid = :max_rowid, updated_at = :now,
+                      stop_time = IFNULL((SELECT MAX(stop_time) FROM record
+                                          WHERE rowid > :last_rowid AND rowid <= :max_rowid), stop_time)""",
+                   {'last_rowid': last_rowid, 'max_rowid': max_rowid,
+                    'now': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+    return classified
+
+
+def generate_record1():
+    """ classify the records ingested since the last run into record1
+    :return: number of classified sn
+    """
+    create_table1()
+    upgrade('mes1.db')
+    classified = classify_records()
+    logging.info(f"generate_record1: {classified} sn classified")
+    return classified
 
-    # print(f'tesing:\t{testing_count}')
+# generate_record1()
 
-    conn.close()
-    return input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate, testing_count
+FPY_COLUMNS = ['input_count', 'pass_count', 'pass_rate', 'fail_count', 'fail_rate', 'retest_count', 'retest_rate',
+               'testing_count']
 
 
-def get_fpy_time_period(start, end):
-    start_datetime = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_datetime = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
+def fpy_of_counts(counts):
+    """ the get_fpy tuple of a {result_type: count} dict
+    :param counts:
+    :return:
+    """
+    input_count = sum(counts.values())
+    if input_count == 0:
+        return 0, 0, 0, 0, 0, 0, 0, 0
+    pass_count = counts.get('PASS', 0)
+    fail_count = counts.get('FAIL', 0)
+    retest_count = counts.get('RETEST', 0)
+    testing_count = counts.get('TO_BE_TESTING', 0)
+    return (input_count, pass_count, pass_count / input_count, fail_count, fail_count / input_count,
+            retest_count, retest_count / input_count, testing_count)
+
+
+@cached('mes1.db', 'record1')
+def get_fpy(start_time, end_time, station='TSP-E', backend='sqlite'):
+    if backend == 'archive':
+        # 已归档的天读 parquet 归档
+        from archive import archive_counts
+
+        counts = dict(archive_counts('mes1.db', 'record1', ['result_type'], start_time, end_time,
+                                     {'test_station': station}))
+        return fpy_of_counts(counts)
+    # 整小时部分从按小时汇总表读, 首尾不足一小时的部分按 result_type 分组扫描原始记录
+    counts = dict(grouped_counts('mes1.db', 'record1_hourly', start_time, end_time, ['result_type'],
+                                 {'test_station': station}))
+    return fpy_of_counts(counts)
+
+
+@cached('mes1.db', 'record1', span=whole_days_span)
+def get_fpy_time_period(start, end, as_frame=False, station='TSP-E'):
+    """ daily fpy from start, one day per period until the period start passes end
+    :param start:
+    :param end:
+    :param station:
+    :param as_frame: return a DataFrame instead of a list of tuples
+    :return: [(period_start, period_end, input_count, pass_count, pass_rate, fail_count, fail_rate,
+              retest_count, retest_rate, testing_count), ...]
+    """
+    start_datetime = parse_time(start)
+    end_datetime = parse_time(end)
     delta = timedelta(days=1)
-    current_datetime = start_datetime
+    days = int((end_datetime - start_datetime) / delta) + 1 if end_datetime >= start_datetime else 0
+    period_end = start_datetime + days * delta
+
+    # 一次扫描整个时间段, 按 (天, result_type) 分组计数
+    sql_query = """SELECT (stop_epoch - ?) / 86400 AS day, result_type, COUNT(*)
+                   FROM record1 WHERE test_station = ? AND stop_epoch BETWEEN ? AND ?
+                   GROUP BY day, result_type"""
+    if days and start_datetime.minute == start_datetime.second == 0:
+        # 从整点开始的每一天都由整小时组成, 按小时读汇总表再归到各天
+        rows = []
+        hourly = grouped_counts('mes1.db', 'record1_hourly', start_datetime, period_end, ['hour', 'result_type'],
+                                {'test_station': station})
+        for hour, result_type, count in hourly:
+            if hour is not None:
+                rows.append(((datetime.strptime(hour, '%Y-%m-%d %H:%M:%S') - start_datetime) // delta,
+                             result_type, count))
+    else:
+        start_epoch = to_epoch(start_datetime)
+        # 分组结果按批读取, 边读边归到各天
+        params = (start_epoch, station, start_epoch, to_epoch(period_end))
+        rows = iter_rows('mes1.db', sql_query, params) if days else []
+    daily_counts = [{} for _ in range(days)]
+    for day, result_type, count in rows:
+        if day is None:
+            # stop time that is not a date
+            continue
+        # stop_time == period_end belongs to the last period
+        counts = daily_counts[min(day, days - 1)]
+        counts[result_type] = counts.get(result_type, 0) + count
+
     time_periods = []
+    for i, counts in enumerate(daily_counts):
+        current_time_start = (start_datetime + i * delta).strftime('%Y-%m-%d %H:%M:%S')
+        current_time_end = (start_datetime + (i + 1) * delta).strftime('%Y-%m-%d %H:%M:%S')
+        time_periods.append((current_time_start, current_time_end) + fpy_of_counts(counts))
 
-    while current_datetime <= end_datetime:
-        current_time_start = current_datetime.strftime('%Y-%m-%d %H:%M:%S')
-        current_datetime_end = current_datetime + delta
-        current_time_end = current_datetime_end.strftime('%Y-%m-%d %H:%M:%S')
-        input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate, testing_count = get_fpy(
-            current_time_start, current_time_end)
-        time_periods.append((current_time_start, current_time_end, input_count, pass_count, pass_rate, fail_count,
-                             fail_rate, retest_count, retest_rate, testing_count))
-        current_datetime += delta
+    if as_frame:
+        import pandas as pd
 
+        return pd.DataFrame(time_periods, columns=['start', 'end'] + FPY_COLUMNS)
     return time_periods
 
-
 # start = '2024-01-14 00:00:00'
 # end = '2024-01-14 23:59:59'
 # get_fpy(start, end)
@@ -323,209 +526,50 @@ def get_fpy_time_period(start, end):
 #     print(i)
 
 # add_from_xlsx('xlsx_files')
-#  generate_record1(37200)
+#  generate_record1()
+
+@cached('mes1.db', 'record')
+def fail_pareto(start, end, station, dimension, where=None, top=None, backend='sqlite'):
+    """ count of the FAIL records of station for every value of dimension, the counting is done by sqlite
+    :param start:
+    :param end:
+    :param station:
+    :param dimension: column of record
+    :param where: more {column: value} filters
+    :param top: only the top values
+    :param backend: 'archive' reads the archived days from the parquet archive
+    :return: Series dimension -> count, like value_counts()
+    """
+    return pareto('mes1.db', 'record', dimension, start, end,
+                  {'test_station': station, 'result': 'FAIL', **(where or {})}, top, backend)
 
-def search_top_carrier(start, end, station):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('mes1.db')
 
-    # Create a cursor object
-    cur = conn.cursor()
-    # df = pd.DataFrame()
+def search_top_carrier(start, end, station, top=None):
+    return fail_pareto(start, end, station, 'Carrier_sn', top=top)
 
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        # Execute a SELECT query to retrieve data where stop_time is between the time range
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND test_station = ? AND result='FAIL'",
-                    (start_time, end_time, station))
-        # Fetch all the rows that match the condition
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
 
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['Carrier_sn'].value_counts()
+def search_top_tester(start, end, station, top=None):
+    return fail_pareto(start, end, station, 'fixture_id', top=top)
 
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
 
+def search_top_failure(start, end, station, top=None):
+    return fail_pareto(start, end, station, 'failure_message', top=top)
 
-def search_top_tester(start, end, station):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('mes1.db')
 
-    # Create a cursor object
-    cur = conn.cursor()
-    df = pd.DataFrame()
+def failure_count_of_tester(start, end, tester, station, top=None):
+    return fail_pareto(start, end, station, 'failure_message', {'fixture_id': tester}, top)
 
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        # Execute a SELECT query to retrieve data where stop_time is between the time range
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND test_station = ? AND result='FAIL'",
-                    (start_time, end_time, station))
-        # Fetch all the rows that match the condition
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
 
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['fixture_id'].value_counts()
+def carrier_count_of_tester(start, end, tester, station, top=None):
+    return fail_pareto(start, end, station, 'Carrier_sn', {'fixture_id': tester}, top)
 
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
 
+def tester_count_of_failure(start, end, failure, station, top=None):
+    return fail_pareto(start, end, station, 'fixture_id', {'failure_message': failure}, top)
 
-def search_top_failure(start, end, station):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('mes1.db')
 
-    # Create a cursor object
-    cur = conn.cursor()
-    df = pd.DataFrame()
-
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        # Execute a SELECT query to retrieve data where stop_time is between the time range
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND test_station = ? AND result='FAIL'",
-                    (start_time, end_time, station))
-        # Fetch all the rows that match the condition
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['failure_message'].value_counts()
-
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
-
-
-def failure_count_of_tester(start, end, tester, station):
-    conn = sqlite3.connect('mes1.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND result='FAIL' AND fixture_id = ? AND "
-                    "test_station = ?",
-                    (start_time, end_time, tester, station))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['failure_message'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
-
-
-def carrier_count_of_tester(start, end, tester, station):
-    conn = sqlite3.connect('mes1.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND result='FAIL' AND fixture_id = ? AND "
-                    "test_station = ?",
-                    (start_time, end_time, tester, station))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['Carrier_sn'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
-
-
-def tester_count_of_failure(start, end, failure, station):
-    conn = sqlite3.connect('mes1.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND result='FAIL' AND failure_message = ? AND "
-                    "test_station = ?",
-                    (start_time, end_time, failure, station))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['fixture_id'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
-
-
-def carrier_count_of_failure(start, end, failure, station):
-    conn = sqlite3.connect('mes1.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        cur.execute("SELECT * FROM record WHERE stop_time BETWEEN ? AND ? AND result='FAIL' AND failure_message = ? AND "
-                    "test_station = ?",
-                    (start_time, end_time, failure, station))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['Carrier_sn'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
+def carrier_count_of_failure(start, end, failure, station, top=None):
+    return fail_pareto(start, end, station, 'Carrier_sn', {'failure_message': failure}, top)
 
 # start = '2023-12-25 00:00:00'
 # end = '2024-01-09 23:59:59'
@@ -542,7 +586,7 @@ def carrier_count_of_failure(start, end, failure, station):
 # print("tester:",tester,fail_count)
 
 
-# generate_record1(90730)
+# generate_record1()
 #
 # start = '2024-01-02 20:00:00'
 # end = '2024-01-09 20:00:00'
@@ -585,4 +629,13 @@ def carrier_count_of_failure(start, end, failure, station):
 # end = '2024-01-09 20:00:00'
 # station = 'TSP-E'
 # input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate, testing_count=get_fpy(start, end)
-# print(input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate, testing_count)
\ No newline at end of file
+# print(input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate, testing_count)
+
+
+if __name__ == '__main__':
+    # 忽略警告
+    warnings.filterwarnings('ignore')
+    # 设置日志记录器
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO)
+    folder = "xlsx_files"
+    add_from_xlsx(folder)
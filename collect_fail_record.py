@@ -1,19 +1,28 @@
 import glob
 import logging
 import os
-import sqlite3
+import time
 import warnings
-from datetime import datetime
+from functools import lru_cache
 
-import pandas as pd
-from matplotlib import pyplot as plt
-from tqdm import tqdm
+import metrics
+from db_pool import get_connection
+from dictionary import insert_rows
+from ingest_ledger import file_digest, is_ingested, mark_done, mark_failed, quarantine
+from migrate import upgrade
+from pareto import counts_series
+from query_cache import cached, record_change
+from rollup import grouped_counts
+from streaming import iter_rows
+from timestamps import add_epoch, to_epoch
 
-# 忽略警告
-warnings.filterwarnings('ignore')
+# 日志文件, 由脚本入口 (__main__, cli.py) 设置, 导入本模块没有副作用;
+# pandas / tqdm / matplotlib 在用到的函数中才导入
+LOG_FILE = 'insight_fail_record.log'
 
-# 设置日志记录器
-logging.basicConfig(filename='insight_fail_record.log', level=logging.INFO)
+# fail key 与分类的对照表
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'Config-File_D95x-TSP_0809.csv')
+CATEGORY_COLUMNS = ['Category', 'Sub Category', 'Sub Sub Category']
 
 
 def db_operation(func):
@@ -23,22 +32,26 @@ def db_operation(func):
     """
 
     def wrapper(*args, **kwargs):
-        # 连接数据库
-        conn = sqlite3.connect('insight.db')
+        # 获取本线程的数据库连接
+        conn = get_connection('insight.db')
+        started = time.perf_counter()
         try:
             # 执行数据库操作
             result = func(conn, *args, **kwargs)
-            # 提交事务并关闭连接
+            # 提交事务
             conn.commit()
         except Exception as e:
-            # 回滚事务并关闭连接
+            # 回滚事务
             conn.rollback()
+            # 记录日志和错误计数
+            logging.error(f"{func.__name__} failed: {type(e).__name__}: {e}")
+            metrics.inc('db_operation_errors_total', function=func.__name__, db='insight.db', error=type(e).__name__)
             raise e
         finally:
-            # 关闭连接
-            conn.close()
-            # 记录日志
-            logging.info(f"{func.__name__} executed successfully")
+            metrics.observe('db_operation_seconds', time.perf_counter() - started, function=func.__name__,
+                            db='insight.db')
+        # 记录日志
+        logging.info(f"{func.__name__} executed successfully")
         return result
 
     return wrapper
@@ -68,8 +81,23 @@ def create_table(conn):
 
 
 @db_operation
-def insert_data(conn, data):
-    data.to_sql('fail_record', conn, if_exists='append', index=False)
+def insert_data(conn, data, digest, filename, started_at):
+    """ insert the rows of one file and its ingest_ledger entry in one transaction
+    :param conn:
+    :param data:
+    :param digest:
+    :param filename:
+    :param started_at:
+    :return:
+    """
+    data = add_epoch(data, 'EndTime', 'EndEpoch')
+    rows = data.astype(object).where(data.notna(), None).itertuples(index=False, name=None)
+    cursor = conn.cursor()
+    cursor.execute("SELECT IFNULL(MAX(rowid), 0) FROM fail_record")
+    last_rowid = cursor.fetchone()[0]
+    insert_rows(conn, 'insight.db', 'fail_record', list(data.columns), rows)
+    record_change(conn, 'insight.db', 'fail_record', 'rowid > ?', (last_rowid,))
+    mark_done(conn, digest, filename, len(data), started_at)
     conn.commit()
 
 
@@ -77,29 +105,67 @@ def is_table_exists(db_name, table_name):
     if not os.path.exists(db_name):
         print(f"{db_name} does not exist")
         return False
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
+    # a dictionary encoded table (dictionary.py) is a view over <table>_data
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (table_name,))
     result = cursor.fetchone()
-    conn.close()
     if result:
         return True
     else:
         return False
 
 
-def csv_to_database(folder_path, filename):
+@lru_cache(maxsize=None)
+def load_config(config_path=CONFIG_PATH):
+    """ load the config file once, indexed by Key (the first row of a duplicated key wins)
+    :param config_path:
+    :return: dataframe of the category columns indexed by Key
+    """
+    import pandas as pd
+
+    config = pd.read_csv(config_path)
+    return config.drop_duplicates(subset='Key').set_index('Key')[CATEGORY_COLUMNS]
+
+
+def categorize(data, config):
+    """ tag every failing row with Category/Sub Category/Sub Sub Category
+    the fail key is the first failing test with ' ' replaced by '^^', rows whose key is not in config stay empty
+    :param data:
+    :param config: the result of load_config()
+    :return:
+    """
+    fail_key = data['List of Failing Tests'].str.split(';').str[0].str.replace(' ', '^^', regex=False)
+    categories = config.reindex(fail_key)
+    for column in CATEGORY_COLUMNS:
+        data[column] = categories[column].to_numpy()
+    return data
+
+
+def csv_to_database(folder_path, filename, config_path=CONFIG_PATH):
     if filename.endswith(".csv"):
         file_path = os.path.join(folder_path, filename)
-        config_path = '/Users/chad/PycharmProjects/pythonProject/config/Config-File_D95x-TSP_0809.csv'
         print(f"Processing {file_path}")
+        digest = file_digest(file_path)
+        if is_ingested('insight.db', digest):
+            print(f"{filename} has already been ingested, skipped")
+            metrics.inc('ingest_files_total', source='fail', outcome='duplicate')
+            os.remove(file_path)
+            return
+        started_at = time.time()
+        metrics.inc('ingest_bytes_total', os.path.getsize(file_path), source='fail')
         try:
+            import pandas as pd
+
             # Open the csv file
-            data = pd.read_csv(str(file_path), header=1, na_values=['NA'], dtype={'FIXTURE_ID': str})
-            config = pd.read_csv(config_path)
+            with metrics.timer('ingest_stage_seconds', source='fail', stage='read'):
+                data = pd.read_csv(str(file_path), header=1, na_values=['NA'], dtype={'FIXTURE_ID': str})
+                config = load_config(config_path)
+            transform_started = time.perf_counter()
             data['CARRIER_TOTAL_TEST'] = data['CARRIER_TOTAL_TEST'].fillna(0)
             # Drop the first 5 rows
             data.drop(range(0, 5), inplace=True)
+            read_count = len(data)
             # Convert the columns to int
             data['CARRIER_TOTAL_TEST'] = data['CARRIER_TOTAL_TEST'].fillna(0)
             data['CARRIER_TOTAL_TEST'] = data['CARRIER_TOTAL_TEST'].astype(int)
@@ -116,34 +182,34 @@ def csv_to_database(folder_path, filename):
             data.drop(rows_to_delete, inplace=True)
             # reset the index
             data.reset_index(drop=True, inplace=True)
-            category = pd.Series(name='Category')
-            sub_category = pd.Series(name='Sub Category')
-            sub_sub_category = pd.Series(name='Sub Sub Category')
-
-            for i in range(len(data)):
-                fail_key = data['List of Failing Tests'][i].split(';')[0].replace(' ', '^^')
-                if fail_key in config['Key'].tolist():
-                    index = config['Key'].tolist().index(fail_key)
-                    category[i] = config['Category'][index]
-                    sub_category[i] = config['Sub Category'][index]
-                    sub_sub_category[i] = config['Sub Sub Category'][index]
-            data['Category'] = category
-            data['Sub Category'] = sub_category
-            data['Sub Sub Category'] = sub_sub_category
+            categorize(data, config)
+            metrics.observe('ingest_stage_seconds', time.perf_counter() - transform_started, source='fail',
+                            stage='transform')
 
             if not is_table_exists('insight.db', 'fail_record'):
                 create_table()
-                insert_data(data)
-            else:
-                insert_data(data)
-            print(f"{filename} has been successfully inserted into database")
+            upgrade('insight.db')
+            with metrics.timer('ingest_stage_seconds', source='fail', stage='insert'):
+                insert_data(data, digest, filename, started_at)
         except Exception as e:
             print(e)
-        finally:
-            os.remove(file_path)
+            metrics.inc('ingest_files_total', source='fail', outcome='failed')
+            metrics.inc('ingest_errors_total', source='fail', error=type(e).__name__)
+            mark_failed('insight.db', digest, filename, started_at, e)
+            quarantine(file_path)
+            return
+        # the PASS rows are not kept
+        metrics.inc('ingest_rows_total', read_count, source='fail', outcome='read')
+        metrics.inc('ingest_rows_total', len(data), source='fail', outcome='inserted')
+        metrics.inc('ingest_rows_total', read_count - len(data), source='fail', outcome='skipped')
+        metrics.inc('ingest_files_total', source='fail', outcome='done')
+        print(f"{filename} has been successfully inserted into database")
+        os.remove(file_path)
 
 
 def add_from_files(folder_path):
+    from tqdm import tqdm
+
     # Loop through each file in the folder
     for filename in tqdm(os.listdir(folder_path), desc="add csv to database", mininterval=1):
         csv_to_database(folder_path, filename)
@@ -172,61 +238,122 @@ def get_records_by_tester(conn, sql, start_time, end_time, tester):
     return result
 
 
-def search_top_fail_subcategory(start, end):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('insight.db')
-
-    # Create a cursor object
-    cur = conn.cursor()
-    top_fail_category = pd.Series(name='Sub Category')
-
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        # Execute a SELECT query to retrieve data where "Test End Time" is between the time range
-        cur.execute("""SELECT * FROM fail_record 
-                             WHERE "EndTime" BETWEEN ? AND ? """,
-                    (start_time, end_time))
-        # Fetch all the rows that match the condition
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(fail_record)")
-        column_names = [i[1] for i in cur.fetchall()]
-        # Create a dataframe from the rows
-        df = pd.DataFrame(rows, columns=column_names)
-        # drop true failed SerialNumber
-        fail_items = get_fail_sn(start_time, end_time)
-        drop_list = []
-        for sn in fail_items:
-            drop_list.append(sn[0])
-        df.drop(df[df['SerialNumber'].isin(drop_list)].index, axis=0, inplace=True)
-        # Drop the duplicate rows
-        df.drop_duplicates(subset='SerialNumber', inplace=True)
-        top_fail_category = df["Sub Category"].value_counts()
-
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_fail_category
+# fail_record 中 start~end 之间的失败行, 去掉同一时间范围内在 record 中有 FAIL 结果的 sn (真正失败的产品),
+# 每个 sn 只保留最早的一行; 排除用 NOT EXISTS 走 record_sn_result_epoch 索引, 去重用 ROW_NUMBER, 都在 SQLite 中完成
+# {columns} 只取需要的列, 窗口函数排序的临时数据不带上 fail_record 的其他列
+RETEST_FAILURES_SQL = """SELECT {columns} FROM (
+                             SELECT {columns},
+                                    ROW_NUMBER() OVER (PARTITION BY SerialNumber{partition}
+                                                       ORDER BY EndEpoch, fail_record.rowid) AS occurrence
+                             FROM fail_record
+                             WHERE EndEpoch BETWEEN :start AND :end{filters}
+                             AND NOT EXISTS (SELECT 1 FROM record
+                                             WHERE "Serial Number" = fail_record.SerialNumber
+                                             AND "Test Result" = 'FAIL'
+                                             AND "Test End Epoch" BETWEEN :start AND :end))
+                         WHERE occurrence = 1"""
+
+
+def select_columns(columns):
+    """ the select list of RETEST_FAILURES_SQL
+    :param columns: columns of fail_record, None for all of them
+    :return:
+    """
+    if columns is None:
+        return '*'
+    return ', '.join(f'"{column}"' for column in dict.fromkeys(columns))
+
+
+def retest_failures_sql(sub_category=None, columns=None):
+    """ the query of RETEST_FAILURES_SQL, only the rows of sub_category if given
+    :param sub_category:
+    :param columns: the columns it selects, default all of them
+    :return: (sql, params without start and end)
+    """
+    if sub_category is None:
+        return RETEST_FAILURES_SQL.format(columns=select_columns(columns), partition='', filters=''), {}
+    return (RETEST_FAILURES_SQL.format(columns=select_columns(columns), partition='',
+                                       filters=' AND "Sub Category" = :sub_category'),
+            {'sub_category': sub_category})
+
+
+def retest_failure_rows(start, end, dimension, sub_category=None, top=None):
+    """ count of every value of dimension among the first fail_record row of every sn that did not really fail
+    :param start:
+    :param end:
+    :param dimension: column of fail_record
+    :param sub_category: only the rows of this sub category, the first row of a sn is taken within it
+    :param top: only the top values
+    :return: [(value, count), ...] by count descending
+    """
+    sql, params = retest_failures_sql(sub_category, [dimension])
+    sql = (f'SELECT "{dimension}", COUNT(*) AS count FROM ({sql}) WHERE "{dimension}" IS NOT NULL '
+           f'GROUP BY "{dimension}" ORDER BY count DESC, "{dimension}"')
+    params.update(start=to_epoch(start), end=to_epoch(end))
+    if top is not None:
+        sql += " LIMIT :top"
+        params['top'] = top
+    return get_connection('insight.db').execute(sql, params).fetchall()
+
+
+def retest_failure_counts(start, end, dimension, sub_category=None, top=None):
+    """ retest_failure_rows as a Series dimension -> count, like value_counts()
+    :param start:
+    :param end:
+    :param dimension:
+    :param sub_category:
+    :param top:
+    :return:
+    """
+    return counts_series(retest_failure_rows(start, end, dimension, sub_category, top), dimension)
 
 
+def subcategory_breakdown(start, end, sub_categories, dimensions=('FIXTURE_ID', 'CARRIER_PN')):
+    """ retest_failure_counts of every dimension for every sub category, in one grouped query
+    (the first row of a sn is taken within each sub category, like retest_failure_counts(..., sub_category))
+    :param start:
+    :param end:
+    :param sub_categories:
+    :param dimensions: columns of fail_record
+    :return: {dimension: DataFrame with the columns 'Sub Category', dimension, 'count'} by count descending
+    """
+    names = [f':sub_category_{i}' for i in range(len(sub_categories))]
+    firsts = RETEST_FAILURES_SQL.format(columns=select_columns(['Sub Category', *dimensions]),
+                                        partition=', "Sub Category"',
+                                        filters=f' AND "Sub Category" IN ({", ".join(names) or "NULL"})')
+    parts = [f'SELECT {i} AS dimension, "Sub Category", "{dimension}" AS value, COUNT(*) AS count FROM firsts '
+             f'WHERE "{dimension}" IS NOT NULL GROUP BY "Sub Category", "{dimension}"'
+             for i, dimension in enumerate(dimensions)]
+    sql = f"WITH firsts AS ({firsts}) {' UNION ALL '.join(parts)} ORDER BY dimension, count DESC, value"
+    params = {name[1:]: sub_category for name, sub_category in zip(names, sub_categories)}
+    params.update(start=to_epoch(start), end=to_epoch(end))
+    import pandas as pd
+
+    # 按 dimension 分拣, 不先 fetchall 整个结果
+    grouped = {i: [] for i in range(len(dimensions))}
+    for row in iter_rows('insight.db', sql, params):
+        grouped[row[0]].append(row[1:])
+    return {dimension: pd.DataFrame(grouped[i], columns=['Sub Category', dimension, 'count'])
+            for i, dimension in enumerate(dimensions)}
+
+
+@cached('insight.db', 'fail_record', 'record')
+def search_top_fail_subcategory(start, end, top=None):
+    return retest_failure_counts(start, end, 'Sub Category', top=top)
+
+
+@cached('insight.db', 'record')
 def get_input_count(start_time, end_time):
-    # conn = sqlite3.connect('insight.db')
-    sql_query = f'SELECT COUNT(*) FROM record WHERE "Test End Time" BETWEEN? AND? '
-    result = get_records(sql_query, start_time, end_time)
-    input_count = result[0][0]
-    return input_count
+    # 整小时部分从 record 的按小时汇总表读
+    return sum(count for _, count in grouped_counts('insight.db', 'record_hourly', start_time, end_time,
+                                                    ['Test Result']))
 
 
 def get_fail_sn(start, end):
     sql_query = f"""SELECT "Serial Number" FROM record 
-                    WHERE "Test End Time" BETWEEN? AND? 
+                    WHERE "Test End Epoch" BETWEEN? AND? 
                     AND "Test Result" = 'FAIL' """
-    result = get_records(sql_query, start, end)
+    result = get_records(sql_query, to_epoch(start), to_epoch(end))
 
     return result
 
@@ -237,95 +364,23 @@ def check_for_csv_file(directory):
     return len(csv_files)
 
 
-def tester_count_of_failure(start, end, sub_category):
-    conn = sqlite3.connect('insight.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    top_fail_count = pd.Series(name='FIXTURE_ID')
-    try:
-        cur.execute("""SELECT * FROM fail_record 
-                            WHERE "EndTime" BETWEEN ? AND ?
-                            AND "Sub Category" = ? """,
-                    (start_time, end_time, sub_category))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(fail_record)")
-        column_names = [i[1] for i in cur.fetchall()]
-        # Create a DataFrame object
-        df = pd.DataFrame(rows, columns=column_names)
-        # drop true failed SerialNumber
-        fail_items = get_fail_sn(start_time, end_time)
-        drop_list = []
-        for sn in fail_items:
-            drop_list.append(sn[0])
-        df.drop(df[df['SerialNumber'].isin(drop_list)].index, axis=0, inplace=True)
-
-        # drop duplicate SerialNumber
-        df.drop_duplicates(subset='SerialNumber', inplace=True)
-        top_fail_count = df['FIXTURE_ID'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_fail_count
-
-
-def carrier_count_of_failure(start, end, sub_category):
+@cached('insight.db', 'fail_record', 'record')
+def tester_count_of_failure(start, end, sub_category, top=None):
+    return retest_failure_counts(start, end, 'FIXTURE_ID', sub_category, top)
+
+
+@cached('insight.db', 'fail_record', 'record')
+def carrier_count_of_failure(start, end, sub_category, top=None):
     """
     :param start:
     :param end:
     :param sub_category:
+    :param top:
     :return: the carrier sn top fail (value_count)
     """
-    conn = sqlite3.connect('insight.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    top_fail_count = pd.Series(name='CARRIER_PN')
-    try:
-        cur.execute("""SELECT * FROM fail_record 
-                            WHERE "EndTime" BETWEEN ? AND ?
-                            AND "Sub Category" = ? """,
-                    (start_time, end_time, sub_category))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(fail_record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        # drop true failed SerialNumber
-        fail_items = get_fail_sn(start_time, end_time)
-        drop_list = []
-        for sn in fail_items:
-            drop_list.append(sn[0])
-        df.drop(df[df['SerialNumber'].isin(drop_list)].index, axis=0, inplace=True)
-        df.drop_duplicates(subset='SerialNumber', inplace=True)
-
-        top_fail_count = df['CARRIER_PN'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_fail_count
-
-
-start = '2024-01-09 20:00:00'
-end = '2024-01-16 20:00:00'
-
-
-sub_category = search_top_fail_subcategory(start, end).head(6).to_frame()
-sub_category['rate'] = sub_category['count']/get_input_count(start, end)*100
-sub_category.to_csv('out/top_6_fail_item.csv', index=True, header=True)
-
-print(get_input_count(start, end))
-print(sub_category)
+    return retest_failure_counts(start, end, 'CARRIER_PN', sub_category, top)
+
+
 # start = '2024-01-09 20:00:00'
 # end = '2024-01-16 20:00:00'
 # total_input=105980
@@ -338,67 +393,50 @@ print(sub_category)
 # Digital OS Test_DPOS       156  0.147198
 # FailToReceiveDriftAlarm    120  0.113229
 def plot_tester_count_by_subcategory(start, end):
+    _plot_distribution(start, end, 'FIXTURE_ID')
+
+
+def plot_carrier_count_by_subcategory(start, end):
+    _plot_distribution(start, end, 'CARRIER_PN')
+
+
+def _plot_distribution(start, end, column):
+    """ the figure of fail_report for one window, shown in a window; fail_report.run writes many without display
+    :param start:
+    :param end:
+    :param column: column of one of fail_report.FIGURES
+    :return:
+    """
+    # fail_report imports this module
+    import fail_report
+    from matplotlib import pyplot as plt
+
+    data = fail_report.collect(start, end)
+    data['top'].to_csv('out/top_fail_category.csv', index=True, header=True)
+    _, _, png_name, limit, head, color = next(figure for figure in fail_report.FIGURES if figure[0] == column)
     # 创建2x3子图网格
-    fig, axs = plt.subplots(2, 3, figsize=(12, 8))
-    limit = 80
-    angle = 90  # 旋转角度，可以设置为0、45、90、-45等值
-    sub_category = search_top_fail_subcategory(start, end).head(6).to_frame()
-    sub_category['rate'] = sub_category['count'] / get_input_count(start, end) * 100
-    sub_category.to_csv('out/top_fail_category.csv', index=True, header=True)
-    failures = sub_category.index
-    # print(sub_category)
-    # print(tester_count_of_failure(start, end, failures[0]).values)
-    x = []
-    y = []
-    for i in range(6):
-        x.append(tester_count_of_failure(start, end, failures[i]).index)
-        y.append(tester_count_of_failure(start, end, failures[i]).values)
-        axs[i // 3, i % 3].bar(x[i], y[i], width=0.6, alpha=0.5, color='green')
-        axs[i // 3, i % 3].set_title(failures[i])
-        axs[i // 3, i % 3].set_ylim(0, limit)
-        axs[i // 3, i % 3].set_xticklabels([])
-        for j, v in enumerate(y[i]):
-            axs[i // 3, i % 3].text(j - 0.3, v + 1.3, x[i][j], rotation=angle, fontsize=8)
-
-    # 调整子图之间的间距
-    plt.tight_layout()
+    fig = plt.figure(figsize=(12, 8))
+    fail_report.draw_distribution(fig, list(data['top'].index), data[column], column, limit, head, color)
     # 保存、显示图表
-
-    plt.savefig('out/tester_distribution_on_fail_items.png')
+    plt.savefig(os.path.join('out', png_name))
     plt.show()
 
 
-def plot_carrier_count_by_subcategory(start, end):
-    # 创建2x3子图网格
-    fig, axs = plt.subplots(2, 3, figsize=(12, 8))
-    limit = 40
-    angle = 90  # 旋转角度，可以设置为0、45、90、-45等值
+if __name__ == '__main__':
+    # 忽略警告
+    warnings.filterwarnings('ignore')
+    # 设置日志记录器
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO)
+    start = '2024-01-09 20:00:00'
+    end = '2024-01-16 20:00:00'
+
     sub_category = search_top_fail_subcategory(start, end).head(6).to_frame()
     sub_category['rate'] = sub_category['count'] / get_input_count(start, end) * 100
-    sub_category.to_csv('out/top_fail_category.csv', index=True, header=True)
-    failures = sub_category.index
-    # print(sub_category)
-    # print(tester_count_of_failure(start, end, failures[0]).values)
-    x = []
-    y = []
-    for i in range(6):
-        x.append(carrier_count_of_failure(start, end, failures[i]).head(20).index)
-        y.append(carrier_count_of_failure(start, end, failures[i]).head(20).values)
-        axs[i // 3, i % 3].bar(x[i], y[i], width=0.6, alpha=0.5, color='orange')
-        axs[i // 3, i % 3].set_title(failures[i])
-        axs[i // 3, i % 3].set_ylim(0, limit)
-        axs[i // 3, i % 3].set_xticklabels([])
-        for j, v in enumerate(y[i]):
-            axs[i // 3, i % 3].text(j - 0.3, v + 1.3, x[i][j], rotation=angle, fontsize=8)
-
-    # 调整子图之间的间距
-    plt.tight_layout()
-    # 保存、显示图表
+    sub_category.to_csv('out/top_6_fail_item.csv', index=True, header=True)
 
-    plt.savefig('out/carrier_distribution_on_fail_items.png')
-    plt.show()
+    print(get_input_count(start, end))
+    print(sub_category)
 
-#
-plot_tester_count_by_subcategory(start, end)
-plot_carrier_count_by_subcategory(start, end)
+    plot_tester_count_by_subcategory(start, end)
+    plot_carrier_count_by_subcategory(start, end)
 
@@ -1,20 +1,44 @@
 import glob
 import logging
 import os
-import sqlite3
+import time
 import warnings
 from datetime import datetime, timedelta
 
-import pandas as pd
-from tqdm import tqdm
+import metrics
+from db_pool import get_connection
+from dictionary import insert_rows
+from ingest_ledger import file_digest, is_ingested, mark_done, mark_failed, quarantine
+from migrate import upgrade
+from pareto import pareto, pareto_rows
+from query_cache import cached, record_change, whole_days_span
+from rollup import add_rows, grouped_counts
+from streaming import iter_rows
+from timestamps import add_epoch, parse_time, to_epoch
 
 ############collect record from insight csv files
 #just
-# 忽略警告
-warnings.filterwarnings('ignore')
-
-# 设置日志记录器
-logging.basicConfig(filename='insight_record.log', level=logging.INFO)
+# 日志文件, 由脚本入口 (__main__, cli.py) 设置, 导入本模块没有副作用;
+# pandas / tqdm 在用到的函数中才导入
+LOG_FILE = 'insight_record.log'
+
+# record 表需要的列, csv 中其它列不读入内存
+# 数值列也按字符串读入, 由表的 REAL 类型在入库时转换, 省去 pandas 的类型推断
+RECORD_DTYPES = {'Serial Number': str,
+                 'Test Result': str,
+                 'Test End Time': str,
+                 'Fixture ID': str,
+                 'Test Software Version': str,
+                 'Sub-test': str,
+                 'Sub-sub-test': str,
+                 'Fail Message': str,
+                 'Value': str,
+                 'Lower Limit': str,
+                 'Upper Limit': str}
+# 每次读入并写入数据库的行数
+CHUNK_ROWS = 100000
+# get_fpy 返回的列
+FPY_COLUMNS = ['input_count', 'pass_count', 'pass_rate', 'fail_count', 'fail_rate', 'retest_count', 'retest_rate']
 
 
 def db_operation(func):
@@ -24,22 +48,26 @@ def db_operation(func):
     """
 
     def wrapper(*args, **kwargs):
-        # 连接数据库
-        conn = sqlite3.connect('insight.db')
+        # 获取本线程的数据库连接
+        conn = get_connection('insight.db')
+        started = time.perf_counter()
         try:
             # 执行数据库操作
             result = func(conn, *args, **kwargs)
-            # 提交事务并关闭连接
+            # 提交事务
             conn.commit()
         except Exception as e:
-            # 回滚事务并关闭连接
+            # 回滚事务
             conn.rollback()
+            # 记录日志和错误计数
+            logging.error(f"{func.__name__} failed: {type(e).__name__}: {e}")
+            metrics.inc('db_operation_errors_total', function=func.__name__, db='insight.db', error=type(e).__name__)
             raise e
         finally:
-            # 关闭连接
-            conn.close()
-            # 记录日志
-            logging.info(f"{func.__name__} executed successfully")
+            metrics.observe('db_operation_seconds', time.perf_counter() - started, function=func.__name__,
+                            db='insight.db')
+        # 记录日志
+        logging.info(f"{func.__name__} executed successfully")
         return result
 
     return wrapper
@@ -68,62 +96,98 @@ def create_table(conn):
 
 
 @db_operation
-def insert_data(conn, data):
-    data.to_sql('record', conn, if_exists='append', index=False)
-    conn.commit()
+def insert_chunks(conn, chunks, digest, filename, started_at):
+    """ append every chunk to record as soon as it is parsed, the whole file and its
+    ingest_ledger entry are one transaction (to_sql would commit after every chunk)
+    :param conn:
+    :param chunks: iterable of dataframes
+    :param digest:
+    :param filename:
+    :param started_at:
+    :return: the number of rows inserted
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT IFNULL(MAX(rowid), 0) FROM record")
+    last_rowid = cursor.fetchone()[0]
+    row_count = 0
+    inserted = 0
+    # the time spent reading the next chunk is the read stage
+    for chunk in metrics.timed_iter(chunks, 'ingest_stage_seconds', source='record', stage='read'):
+        with metrics.timer('ingest_stage_seconds', source='record', stage='transform'):
+            chunk = add_epoch(chunk, 'Test End Time', 'Test End Epoch')
+            rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+        with metrics.timer('ingest_stage_seconds', source='record', stage='insert'):
+            inserted += insert_rows(conn, 'insight.db', 'record', list(chunk.columns), rows)
+        row_count += len(chunk)
+    # one grouped pass over the rows of this file instead of a trigger per row
+    with metrics.timer('ingest_stage_seconds', source='record', stage='rollup'):
+        add_rows(conn, 'insight.db', 'record', 'rowid > ?', (last_rowid,))
+        record_change(conn, 'insight.db', 'record', 'rowid > ?', (last_rowid,))
+    mark_done(conn, digest, filename, row_count, started_at)
+    metrics.inc('ingest_rows_total', row_count, source='record', outcome='read')
+    metrics.inc('ingest_rows_total', inserted, source='record', outcome='inserted')
+    metrics.inc('ingest_rows_total', row_count - inserted, source='record', outcome='skipped')
+    return row_count
 
 
 def is_table_exists(db_name, table_name):
     if not os.path.exists(db_name):
         print(f"{db_name} does not exist")
         return False
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
+    # a dictionary encoded table (dictionary.py) is a view over <table>_data
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (table_name,))
     result = cursor.fetchone()
-    conn.close()
     if result:
         return True
     else:
         return False
 
 
-def csv_to_database(folder_path, filename):
+def csv_to_database(folder_path, filename, chunk_rows=CHUNK_ROWS):
     if filename.endswith(".csv"):
         file_path = os.path.join(folder_path, filename)
         print(f"Processing {file_path}")
+        digest = file_digest(file_path)
+        if is_ingested('insight.db', digest):
+            print(f"{filename} has already been ingested, skipped")
+            metrics.inc('ingest_files_total', source='record', outcome='duplicate')
+            os.remove(file_path)
+            return
+        started_at = time.time()
+        metrics.inc('ingest_bytes_total', os.path.getsize(file_path), source='record')
         try:
-            # Open the csv file
-            data = pd.read_csv(str(file_path))
-            to_delete = ['Product Code', 'Product Assembly Type', 'Start Time', 'Site', 'product', 'Station ID',
-                         'Station Name', 'Units', 'start_time', 'station_id', 'Station Type', 'Test Head ID', 'Test',
-                         'Parent Special Build Name', 'Child Special Build Name', 'Configuration Code',
-                         'Week Of Manufacture']
-            for cloumn in to_delete:
-                if cloumn in data.columns:
-                    data = data.drop(cloumn, axis=1)
+            import pandas as pd
+
+            # Stream the csv file, only the columns of record are parsed
+            chunks = pd.read_csv(str(file_path), usecols=lambda column: column in RECORD_DTYPES,
+                                 dtype=RECORD_DTYPES, chunksize=chunk_rows)
             if not is_table_exists('insight.db', 'record'):
                 create_table()
-                insert_data(data)
-            else:
-                insert_data(data)
-            print(f"{filename} has been successfully inserted into database")
+            upgrade('insight.db')
+            row_count = insert_chunks(chunks, digest, filename, started_at)
         except Exception as e:
             print(e)
-        finally:
-            os.remove(file_path)
+            metrics.inc('ingest_files_total', source='record', outcome='failed')
+            metrics.inc('ingest_errors_total', source='record', error=type(e).__name__)
+            mark_failed('insight.db', digest, filename, started_at, e)
+            quarantine(file_path)
+            return
+        metrics.inc('ingest_files_total', source='record', outcome='done')
+        print(f"{filename} has been successfully inserted into database, {row_count} rows")
+        os.remove(file_path)
 
 
 def add_from_files(folder_path):
+    from tqdm import tqdm
+
     # Loop through each file in the folder
     for filename in tqdm(os.listdir(folder_path), desc="add csv to database", mininterval=1):
         csv_to_database(folder_path, filename)
     # print("all files has been processed successfully")
 
 
-#
-path = 'csv_files/record'
-add_from_files(path)
 # create_table()
 @db_operation
 def get_records(conn, sql,start_time, end_time ):
@@ -139,106 +203,118 @@ def get_records_by_tester(conn, sql, start_time, end_time, tester):
     result = cursor.fetchall()
     return result
 
-def get_fpy_by_tester(start_time, end_time):
-    conn = sqlite3.connect('insight.db')
-
-    testers = ['100101', '100102', '100103', '100104', '100105', '100106', '100201', '100202', '100203', '100204',
-                          '100205', '100206', '100301', '100302', '100303', '100304', '100305', '100306', '100401', '100402', '100403',
-                          '100404', '100405', '100406', '100501', '100502', '100503', '100504', '100505', '100506', '100601', '100602']
-    testers_fpy = pd.DataFrame(index=testers, columns=['input_count', 'pass_count', 'pass_rate', 'fail_count', 'fail_rate', 'retest_count', 'retest_rate','fail_msg'])
-    for terster in testers:
-        sql_query = f"""SELECT COUNT(*) FROM record 
-                            WHERE "Test End Time" BETWEEN? AND? 
-                            AND "Fixture ID" = ? """
-        result = get_records_by_tester(sql_query,start_time, end_time,terster)
-        input_count = result[0][0]
-        testers_fpy.loc[terster]['input_count'] = input_count
-        if input_count == 0:
-            testers_fpy.loc[terster] = 0, 0, 0, 0, 0, 0, 0,'none'
-            continue
 
-        sql_query = f"""SELECT COUNT(*) FROM record 
-                        WHERE "Test End Time" BETWEEN? AND? 
-                        AND "Fixture ID" = ? 
-                        AND "Test Result" = 'PASS' """
-        result = get_records_by_tester(sql_query,start_time, end_time,terster)
-        pass_count = result[0][0]
-        testers_fpy.loc[terster]['pass_count'] = pass_count
-        testers_fpy.loc[terster]['pass_rate'] = pass_count / input_count
-
-        sql_query = f"""SELECT COUNT(*) FROM record 
-                                WHERE "Test End Time" BETWEEN? AND? 
-                                AND "Fixture ID" = ? 
-                                AND "Test Result" = 'FAIL' """
-        result = get_records_by_tester(sql_query, start_time, end_time, terster)
-        fail_count = result[0][0]
-        testers_fpy.loc[terster]['fail_count'] = fail_count
-        testers_fpy.loc[terster]['fail_rate'] = fail_count / input_count
-
-        sql_query = f"""SELECT COUNT(*) FROM record 
-                                        WHERE "Test End Time" BETWEEN? AND? 
-                                        AND "Fixture ID" = ? 
-                                        AND "Test Result" = 'RETEST' """
-        result = get_records_by_tester(sql_query, start_time, end_time, terster)
-        retest_count = result[0][0]
-        testers_fpy.loc[terster]['retest_count'] = retest_count
-        testers_fpy.loc[terster]['retest_rate'] = retest_count / input_count
-
-        testers_fpy.loc[terster]['fail_msg'] =failure_count_of_tester(start_time, end_time,"RETEST", terster)
-
-    return testers_fpy.sort_values(by="retest_rate", ascending=False)
-
-
-def get_fpy(start_time, end_time):
-    conn = sqlite3.connect('insight.db')
-    sql_query = f'SELECT COUNT(*) FROM record WHERE "Test End Time" BETWEEN? AND? '
-    result = get_records( sql_query,start_time, end_time)
-    input_count = result[0][0]
+@cached('insight.db', 'record')
+def get_fpy_by_tester(start_time, end_time):
+    """ yield of every fixture that tested in the time range, sorted by retest rate
+    :param start_time:
+    :param end_time:
+    :return: DataFrame indexed by fixture id with the columns input_count, pass_count, pass_rate, fail_count,
+             fail_rate, retest_count, retest_rate and fail_msg (the [(fail message, count), ...] of the retests)
+    """
+    # fixture 列表来自数据本身, 整小时部分的 (fixture, 结果) 计数从按小时汇总表读
+    counts = {}
+    for tester, result, count in grouped_counts('insight.db', 'record_hourly', start_time, end_time,
+                                                ['Fixture ID', 'Test Result']):
+        if tester is not None:
+            counts.setdefault(tester, {})[result] = count
+
+    # retest 的 fail message 分布, 一次分组查询
+    sql_query = """SELECT "Fixture ID", "Fail Message", COUNT(*) AS count
+                   FROM record WHERE "Test End Epoch" BETWEEN ? AND ? AND "Test Result" = 'RETEST'
+                   AND "Fail Message" IS NOT NULL
+                   GROUP BY "Fixture ID", "Fail Message"
+                   ORDER BY "Fixture ID", count DESC, "Fail Message" """
+    fail_msg = {}
+    for tester, message, count in iter_rows('insight.db', sql_query, (to_epoch(start_time), to_epoch(end_time))):
+        fail_msg.setdefault(tester, []).append((message, count))
+
+    import pandas as pd
+
+    testers = sorted(counts)
+    rows = [fpy_of_counts(counts[tester]) + (fail_msg.get(tester, []),) for tester in testers]
+    testers_fpy = pd.DataFrame(rows, index=pd.Index(testers, name='Fixture ID'), columns=FPY_COLUMNS + ['fail_msg'])
+    return testers_fpy.sort_values(by="retest_rate", ascending=False, kind='stable')
+
+
+def fpy_of_counts(counts):
+    """ the get_fpy tuple of a {"Test Result": count} dict
+    :param counts:
+    :return:
+    """
+    input_count = sum(counts.values())
     if input_count == 0:
         return 0, 0, 0, 0, 0, 0, 0
-    # print(f'input:\t{input_count}')
-
-    sql_query = f'SELECT COUNT(*) FROM record WHERE "Test End Time" BETWEEN? AND? AND "Test Result" = "PASS" '
-    result = get_records(sql_query, start_time, end_time)
-    pass_count = result[0][0]
-    pass_rate = pass_count / input_count
-    # print(f'pass:\t{pass_count}\t\tYeild:\t{pass_rate:.2%}')
-
-    sql_query = f'SELECT COUNT(*) FROM record WHERE "Test End Time" BETWEEN? AND? AND "Test Result" = "FAIL" '
-    result = get_records(sql_query, start_time, end_time)
-    fail_count = result[0][0]
-    fail_rate = fail_count / input_count
-    # print(f'fail:\t{fail_count}\t\tfail_rate:\t{fail_rate:.2%}')
-
-    sql_query = f'SELECT COUNT(*) FROM record WHERE "Test End Time" BETWEEN? AND? AND "Test Result" = "RETEST" '
-    result = get_records(sql_query, start_time, end_time)
-    retest_count = result[0][0]
-    retest_rate = retest_count / input_count
-    # print(f'retest:\t{retest_count}\t\tretest_rate:\t{retest_rate:.2%}')
-
-    # print(f'tesing:\t{testing_count}')
-
-    conn.close()
-    return input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate
-
-
-def get_fpy_time_period(start, end):
-    start_datetime = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_datetime = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
+    pass_count = counts.get('PASS', 0)
+    fail_count = counts.get('FAIL', 0)
+    retest_count = counts.get('RETEST', 0)
+    return (input_count, pass_count, pass_count / input_count, fail_count, fail_count / input_count,
+            retest_count, retest_count / input_count)
+
+
+@cached('insight.db', 'record')
+def get_fpy(start_time, end_time, backend='sqlite'):
+    if backend == 'archive':
+        # 已归档的天读 parquet 归档
+        from archive import archive_counts
+
+        return fpy_of_counts(dict(archive_counts('insight.db', 'record', ['Test Result'], start_time, end_time)))
+    # 整小时部分从按小时汇总表读, 首尾不足一小时的部分按 "Test Result" 分组扫描原始记录
+    counts = dict(grouped_counts('insight.db', 'record_hourly', start_time, end_time, ['Test Result']))
+    return fpy_of_counts(counts)
+
+
+@cached('insight.db', 'record', span=whole_days_span)
+def get_fpy_time_period(start, end, as_frame=False):
+    """ daily fpy from start, one day per period until the period start passes end
+    :param start:
+    :param end:
+    :param as_frame: return a DataFrame instead of a list of tuples
+    :return: [(period_start, period_end, input_count, pass_count, pass_rate, fail_count, fail_rate,
+              retest_count, retest_rate), ...]
+    """
+    start_datetime = parse_time(start)
+    end_datetime = parse_time(end)
     delta = timedelta(days=1)
-    current_datetime = start_datetime
+    days = int((end_datetime - start_datetime) / delta) + 1 if end_datetime >= start_datetime else 0
+    period_end = start_datetime + days * delta
+
+    # 一次扫描整个时间段, 按 (天, "Test Result") 分组计数
+    sql_query = """SELECT ("Test End Epoch" - ?) / 86400 AS day, "Test Result", COUNT(*)
+                   FROM record WHERE "Test End Epoch" BETWEEN ? AND ?
+                   GROUP BY day, "Test Result"
+                """
+    if days and start_datetime.minute == start_datetime.second == 0:
+        # 从整点开始的每一天都由整小时组成, 按小时读汇总表再归到各天
+        rows = []
+        hourly = grouped_counts('insight.db', 'record_hourly', start_datetime, period_end, ['hour', 'Test Result'])
+        for hour, result_type, count in hourly:
+            if hour is not None:
+                rows.append(((datetime.strptime(hour, '%Y-%m-%d %H:%M:%S') - start_datetime) // delta,
+                             result_type, count))
+    else:
+        start_epoch = to_epoch(start_datetime)
+        # 分组结果按批读取, 边读边归到各天
+        rows = iter_rows('insight.db', sql_query, (start_epoch, start_epoch, to_epoch(period_end))) if days else []
+    daily_counts = [{} for _ in range(days)]
+    for day, result_type, count in rows:
+        if day is None:
+            # stop time that is not a date
+            continue
+        # "Test End Time" == period_end belongs to the last period
+        counts = daily_counts[min(day, days - 1)]
+        counts[result_type] = counts.get(result_type, 0) + count
+
     time_periods = []
+    for i, counts in enumerate(daily_counts):
+        current_time_start = (start_datetime + i * delta).strftime('%Y-%m-%d %H:%M:%S')
+        current_time_end = (start_datetime + (i + 1) * delta).strftime('%Y-%m-%d %H:%M:%S')
+        time_periods.append((current_time_start, current_time_end) + fpy_of_counts(counts))
 
-    while current_datetime <= end_datetime:
-        current_time_start = current_datetime.strftime('%Y-%m-%d %H:%M:%S')
-        current_datetime_end = current_datetime + delta
-        current_time_end = current_datetime_end.strftime('%Y-%m-%d %H:%M:%S')
-        input_count, pass_count, pass_rate, fail_count, fail_rate, retest_count, retest_rate = get_fpy(
-            current_time_start, current_time_end)
-        time_periods.append((current_time_start, current_time_end, input_count, pass_count, pass_rate, fail_count,
-                             fail_rate, retest_count, retest_rate))
-        current_datetime += delta
+    if as_frame:
+        import pandas as pd
 
+        return pd.DataFrame(time_periods, columns=['start', 'end'] + FPY_COLUMNS)
     return time_periods
 
 #
@@ -257,130 +333,56 @@ def get_fpy_time_period(start, end):
 #     print(i)
 
 
-def search_top_tester(start, end, result):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('insight.db')
-
-    # Create a cursor object
-    cur = conn.cursor()
-    df = pd.DataFrame()
-
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        # Execute a SELECT query to retrieve data where "Test End Time" is between the time range
-        cur.execute("""SELECT * FROM record 
-                             WHERE "Test End Time" BETWEEN ? AND ? 
-                             AND "Test Result"=? """,
-                    (start_time, end_time,result))
-        # Fetch all the rows that match the condition
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df["Fixture ID"].value_counts()
-
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
-
-
-def search_top_failure(start, end, result):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('insight.db')
-
-    # Create a cursor object
-    cur = conn.cursor()
-    df = pd.DataFrame()
-
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        # Execute a SELECT query to retrieve data where "Test End Time" is between the time range
-        cur.execute("""SELECT * FROM record 
-                            WHERE "Test End Time" BETWEEN ? AND ?
-                            AND "Test Result"=?""",
-                    (start_time, end_time, result))
-        # Fetch all the rows that match the condition
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df["Fail Message"].value_counts()
-
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
-
-
-def failure_count_of_tester(start, end, result, tester):
-    conn = sqlite3.connect('insight.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        cur.execute("""SELECT * FROM record 
-                            WHERE "Test End Time" BETWEEN ? AND ? 
-                            AND "Test Result"=?
-                            AND "Fixture ID"=?""",
-                    (start_time, end_time, result, tester))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['Fail Message'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return [x for x in top_failcount.items()]
-
-
-def tester_count_of_failure(start, end, result, failure):
-    conn = sqlite3.connect('insight.db')
-    cur = conn.cursor()
-    # Define the time range
-    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-    end_time = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
-    try:
-        cur.execute("""SELECT * FROM record 
-                            WHERE "Test End Time" BETWEEN ? AND ?
-                            AND "Test Result"=?
-                            AND "Fail Message" = ? """,
-                    (start_time, end_time, result, failure))
-        rows = cur.fetchall()
-        cur.execute(f"PRAGMA table_info(record)")
-        column_names = [i[1] for i in cur.fetchall()]
-
-        df = pd.DataFrame(rows, columns=column_names)
-        top_failcount = df['Fixture ID'].value_counts()
-    except Exception as e:
-        print(e)
-        print("fail to  search")
-    finally:
-        # Close the cursor and the connection
-        cur.close()
-        conn.close()
-    return top_failcount
+@cached('insight.db', 'record')
+def search_top_tester(start, end, result, top=None):
+    """ count of the records with this result of every fixture
+    :param start:
+    :param end:
+    :param result:
+    :param top: only the top fixtures
+    :return: Series "Fixture ID" -> count, like value_counts()
+    """
+    return pareto('insight.db', 'record', 'Fixture ID', start, end, {'Test Result': result}, top)
+
+
+@cached('insight.db', 'record')
+def search_top_failure(start, end, result, top=None):
+    """ count of every fail message of the records with this result
+    :param start:
+    :param end:
+    :param result:
+    :param top: only the top messages
+    :return: Series "Fail Message" -> count, like value_counts()
+    """
+    return pareto('insight.db', 'record', 'Fail Message', start, end, {'Test Result': result}, top)
+
+
+@cached('insight.db', 'record')
+def failure_count_of_tester(start, end, result, tester, top=None):
+    """ count of every fail message of the records of tester with this result
+    :param start:
+    :param end:
+    :param result:
+    :param tester:
+    :param top:
+    :return: [(fail message, count), ...]
+    """
+    return pareto_rows('insight.db', 'record', 'Fail Message', start, end,
+                       {'Test Result': result, 'Fixture ID': tester}, top)
+
+
+@cached('insight.db', 'record')
+def tester_count_of_failure(start, end, result, failure, top=None):
+    """ count of the records with this result and fail message of every fixture
+    :param start:
+    :param end:
+    :param result:
+    :param failure:
+    :param top:
+    :return: Series "Fixture ID" -> count, like value_counts()
+    """
+    return pareto('insight.db', 'record', 'Fixture ID', start, end, {'Test Result': result, 'Fail Message': failure},
+                  top)
 
 
 # start = '2024-01-08 20:00:00'
@@ -411,4 +413,13 @@ def run_analysis(path, start, end):
 # start = '2024-01-09 20:00:00'
 # end = '2024-01-10 20:00:00'
 # path='csv_files'
-# get_fpy_by_tester(start, end)[['input_count', 'pass_count', 'pass_rate',  'retest_count', 'retest_rate','fail_msg']]
\ No newline at end of file
+# get_fpy_by_tester(start, end)[['input_count', 'pass_count', 'pass_rate',  'retest_count', 'retest_rate','fail_msg']]
+
+
+if __name__ == '__main__':
+    # 忽略警告
+    warnings.filterwarnings('ignore')
+    # 设置日志记录器
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO)
+    path = 'csv_files/record'
+    add_from_files(path)
@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def mes_db(tmp_path, monkeypatch):
+    """ collect_data2 on an empty, upgraded mes1.db in a temporary directory, with the query cache on """
+    import collect_data2
+    import query_cache
+    from db_pool import close_all
+    from migrate import upgrade
+
+    monkeypatch.chdir(tmp_path)
+    query_cache.configure(enabled=True)
+    collect_data2.create_table()
+    upgrade('mes1.db')
+    yield collect_data2
+    close_all()
+
+
+@pytest.fixture
+def mes_rows():
+    """ mes_rows((fixture, stop_time, result, sn), ...) is a TSP-E dataframe for collect_data2.insert_dataframe """
+    import pandas as pd
+
+    from json_batch import RECORD_COLUMNS
+
+    def frame(*rows):
+        return pd.DataFrame([(fixture, stop_time, result, sn, 'v1', '', 'C1', 'TSP-E')
+                             for fixture, stop_time, result, sn in rows], columns=RECORD_COLUMNS)
+
+    return frame
@@ -0,0 +1,70 @@
+############################################################################
+#
+# 数据库连接管理: 每个线程(进程)对每个数据库只保持一个长连接,
+# 连接打开时设置 WAL 日志模式和 PRAGMAS 中的参数, 并缓存预编译语句.
+# WAL 模式下分析查询读数据时不会阻塞入库写入.
+#
+############################################################################
+import os
+import sqlite3
+import threading
+
+# 新连接打开时执行的 PRAGMA, 可通过 configure() 修改
+PRAGMAS = {'journal_mode': 'WAL',
+           'synchronous': 'NORMAL',
+           'cache_size': -65536,  # 负数单位为 KiB, 即 64 MiB
+           'mmap_size': 268435456,  # 256 MiB
+           'busy_timeout': 30000,  # ms
+           'temp_store': 'MEMORY'}
+# 每个连接缓存的预编译语句数量
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def _connections():
+    # a forked child must not reuse the connections of its parent
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    return _local.connections
+
+
+def configure(cached_statements=None, **pragmas):
+    """ change the pragmas (e.g. cache_size, mmap_size, busy_timeout) used by connections opened from now on,
+    the connections of the calling thread are closed so that they are reopened with the new settings
+    :param cached_statements:
+    :param pragmas:
+    :return:
+    """
+    global CACHED_STATEMENTS
+    if cached_statements is not None:
+        CACHED_STATEMENTS = cached_statements
+    PRAGMAS.update(pragmas)
+    close_all()
+
+
+def get_connection(db_name):
+    """ the connection of the calling thread to db_name, opened on first use
+    :param db_name:
+    :return:
+    """
+    connections = _connections()
+    key = os.path.abspath(db_name)
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_name, cached_statements=CACHED_STATEMENTS)
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        connections[key] = conn
+    return conn
+
+
+def close_all():
+    """ close the connections of the calling thread
+    :return:
+    """
+    connections = _connections()
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
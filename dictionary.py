@@ -0,0 +1,228 @@
+############################################################################
+#
+# 字典编码存储: 低基数的字符串列(治具、站、版本、失败信息、结果、分类...)存到按列共用的 dim_<列> 表,
+# 数据表 <表>_data 中只存整数 id; 原表名改为视图, 列名和列顺序不变(末尾多一列 rowid), 已有的查询不需要修改.
+# 入库通过 insert_rows 写入, 值到 id 的对照保存在内存中, 只有新值才写 dim 表.
+# 转换是一次性的, 需要时手动执行:
+# python dictionary.py mes1.db insight.db
+# 不要对转换后的数据库执行 VACUUM: <表>_data 没有 INTEGER PRIMARY KEY, VACUUM 可能重新编号 rowid,
+# 而 record1_state.last_rowid、汇总表的增量 (rowid > ?) 和 data_changes 都依赖 rowid.
+#
+############################################################################
+import argparse
+import os
+import re
+
+from db_pool import get_connection
+
+# (数据库, 表) -> 字典编码的列
+DICTIONARY_COLUMNS = {
+    ('mes1.db', 'record'): ['fixture_id', 'test_station', 'sw_version', 'failure_message', 'Carrier_sn', 'result'],
+    ('insight.db', 'record'): ['Test Result', 'Fixture ID', 'Test Software Version', 'Sub-test', 'Sub-sub-test',
+                               'Fail Message'],
+    ('insight.db', 'fail_record'): ['Test Pass/Fail Status', 'Version', 'CARRIER_PN', 'FIXTURE_ID', 'Category',
+                                    'Sub Category', 'Sub Sub Category'],
+}
+
+# (数据库, dim 表) -> {'ids': {值: id}, 'top': 最大 id 的 (id, 值)}
+_keys = {}
+
+
+def _slug(column):
+    return re.sub(r'[^0-9a-z]+', '_', column.lower()).strip('_')
+
+
+def dim_table(column):
+    """ the dimension table of column, columns with the same name up to case and punctuation share one
+    :param column:
+    :return:
+    """
+    return f'dim_{_slug(column)}'
+
+
+def id_column(column):
+    return f'{_slug(column)}_id'
+
+
+def is_normalized(conn, table):
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f'{table}_data',))
+    return cursor.fetchone() is not None
+
+
+def _load(conn, key, dim):
+    ids = {value: id_ for id_, value in conn.execute(f"SELECT id, value FROM {dim}")}
+    top = conn.execute(f"SELECT id, value FROM {dim} ORDER BY id DESC LIMIT 1").fetchone()
+    _keys[key] = {'ids': ids, 'top': top}
+    return _keys[key]
+
+
+def _cache(conn, db_name, dim):
+    """ the value -> id cache of dim, reloaded if the table no longer ends with the last id the cache knows
+    (a rolled back ingest, or values added by another process)
+    :param conn:
+    :param db_name:
+    :param dim:
+    :return:
+    """
+    key = (os.path.abspath(db_name), dim)
+    cache = _keys.get(key)
+    if cache is None or conn.execute(f"SELECT id, value FROM {dim} ORDER BY id DESC LIMIT 1").fetchone() != \
+            cache['top']:
+        cache = _load(conn, key, dim)
+    return cache
+
+
+def encode(conn, db_name, column, values):
+    """ the ids of values in the dimension table of column, new values are added to it
+    :param conn:
+    :param db_name:
+    :param column:
+    :param values:
+    :return: list of ids, None for None
+    """
+    dim = dim_table(column)
+    cache = _cache(conn, db_name, dim)
+    ids = cache['ids']
+    result = []
+    for value in values:
+        if value is None:
+            result.append(None)
+            continue
+        id_ = ids.get(value)
+        if id_ is None:
+            id_ = conn.execute(f"INSERT INTO {dim} (value) VALUES (?)", (value,)).lastrowid
+            ids[value] = id_
+            cache['top'] = (id_, value)
+        result.append(id_)
+    return result
+
+
+def insert_rows(conn, db_name, table, columns, rows, or_ignore=False):
+    """ insert rows into table, encoding the dictionary columns if the table is normalized
+    :param conn:
+    :param db_name:
+    :param table:
+    :param columns: column names of the rows
+    :param rows: iterable of tuples
+    :param or_ignore: INSERT OR IGNORE
+    :return: number of inserted rows
+    """
+    verb = 'INSERT OR IGNORE' if or_ignore else 'INSERT'
+    placeholders = ', '.join('?' * len(columns))
+    encoded = DICTIONARY_COLUMNS.get((os.path.basename(db_name), table), [])
+    if not encoded or not is_normalized(conn, table):
+        names = ', '.join(f'"{column}"' for column in columns)
+        cursor = conn.executemany(f"{verb} INTO {table} ({names}) VALUES ({placeholders})", rows)
+        return max(cursor.rowcount, 0)
+    positions = [i for i, column in enumerate(columns) if column in encoded]
+    names = ', '.join(f'"{id_column(column)}"' if column in encoded else f'"{column}"' for column in columns)
+    rows = [list(row) for row in rows]
+    for i in positions:
+        for row, id_ in zip(rows, encode(conn, db_name, columns[i], [row[i] for row in rows])):
+            row[i] = id_
+    cursor = conn.executemany(f"{verb} INTO {table}_data ({names}) VALUES ({placeholders})", rows)
+    return max(cursor.rowcount, 0)
+
+
+def view_sql(table, columns, encoded):
+    """ the view named table over <table>_data that decodes the encoded columns
+    :param table:
+    :param columns: [(name, type), ...] in the order of the view
+    :param encoded:
+    :return:
+    """
+    select = []
+    joins = []
+    for name, _ in columns:
+        if name in encoded:
+            alias = f'j{len(joins)}'
+            joins.append(f'LEFT JOIN {dim_table(name)} AS {alias} ON {alias}.id = d."{id_column(name)}"')
+            select.append(f'{alias}.value AS "{name}"')
+        else:
+            select.append(f'd."{name}" AS "{name}"')
+    # rowid is kept for the writers that address the rows they just inserted by rowid
+    select.append('d.rowid AS rowid')
+    return f"CREATE VIEW {table} AS SELECT {', '.join(select)} FROM {table}_data AS d {' '.join(joins)}"
+
+
+def normalize_statements(conn, table, encoded):
+    """ the sql that moves table to <table>_data with dictionary encoded columns and replaces it with a view
+    :param conn:
+    :param table:
+    :param encoded: the columns to encode
+    :return: [sql, ...]
+    """
+    columns = [(row[1], row[2]) for row in conn.execute(f"PRAGMA table_info({table})")]
+    statements = [f"CREATE TABLE IF NOT EXISTS {dim_table(name)} (id INTEGER PRIMARY KEY, value UNIQUE)"
+                  for name in encoded]
+    statements += [f'INSERT OR IGNORE INTO {dim_table(name)} (value) SELECT DISTINCT "{name}" FROM {table} '
+                   f'WHERE "{name}" IS NOT NULL' for name in encoded]
+    definitions = ', '.join(f'"{id_column(name)}" INTEGER' if name in encoded else f'"{name}" {type_}'
+                            for name, type_ in columns)
+    statements.append(f"CREATE TABLE {table}_data ({definitions})")
+    targets = ', '.join(f'"{id_column(name)}"' if name in encoded else f'"{name}"' for name, _ in columns)
+    values = ', '.join(f'(SELECT id FROM {dim_table(name)} WHERE value = t."{name}")' if name in encoded
+                       else f't."{name}"' for name, _ in columns)
+    statements.append(f"INSERT INTO {table}_data (rowid, {targets}) SELECT t.rowid, {values} FROM {table} AS t")
+    # the same indexes on the id columns
+    indexes = []
+    for _, index, unique, origin, _ in conn.execute(f"PRAGMA index_list({table})"):
+        if origin != 'c':
+            continue
+        names = [row[2] for row in conn.execute(f"PRAGMA index_info({index})")]
+        keys = ', '.join(f'"{id_column(name)}"' if name in encoded else f'"{name}"' for name in names)
+        indexes.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table}_data ({keys})")
+    statements.append(f"DROP TABLE {table}")
+    statements += indexes
+    statements.append(view_sql(table, columns, encoded))
+    return statements
+
+
+def normalize(db_name, verbose=False):
+    """ convert the tables of db_name to dictionary encoded storage, each table in one transaction
+    :param db_name:
+    :param verbose:
+    :return: the converted tables
+    """
+    # the migrations of the wide tables must run first; migrate imports this module through timestamps
+    from migrate import upgrade
+
+    upgrade(db_name)
+    conn = get_connection(db_name)
+    done = []
+    for (name, table), encoded in DICTIONARY_COLUMNS.items():
+        if name != os.path.basename(db_name) or is_normalized(conn, table):
+            continue
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is None:
+            continue
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for sql in normalize_statements(conn, table, encoded):
+                conn.execute(sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done.append(table)
+        if verbose:
+            print(f"{db_name}: {table} normalized")
+    _keys.clear()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="store the low cardinality columns of mes1.db and insight.db "
+                                                 "in dictionary tables")
+    parser.add_argument('databases', nargs='*', default=['mes1.db', 'insight.db'])
+    args = parser.parse_args()
+    for db_name in args.databases:
+        if not os.path.exists(db_name):
+            print(f"{db_name} does not exist")
+            continue
+        if not normalize(db_name, verbose=True):
+            print(f"{db_name}: nothing to normalize")
+
+
+if __name__ == '__main__':
+    main()
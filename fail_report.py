@@ -0,0 +1,156 @@
+############################################################################
+#
+# 失败分类报告的批量生成: 每个时间段的 top 6 sub category, 以及每个 sub category 下治具和 carrier 的分布.
+# 每个时间段只查三次: top sub category, 投入数, 治具和 carrier 分布合在一个分组查询 (subcategory_breakdown);
+# 画图不用交互式后端 (matplotlib Figure + Agg), 在进程池中进行, 可以在 cron 或服务器上运行.
+# 每个时间段输出到 out/<开始>-<结束>/ 下: top_fail_category.csv, tester/carrier_by_subcategory.csv 和两张 png.
+# python fail_report.py --window "2024-01-09 20:00:00" "2024-01-16 20:00:00" --window ...
+# python fail_report.py --daily "2024-01-09 20:00:00" "2024-01-16 20:00:00"   # 每天一个时间段
+#
+############################################################################
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from matplotlib.figure import Figure
+
+from collect_fail_record import get_input_count, search_top_fail_subcategory, subcategory_breakdown
+from timestamps import format_time, parse_time
+
+REPORT_DIR = 'out'
+TOP_CATEGORIES = 6
+
+# 分布图: (fail_record 的列, csv 文件, png 文件, y 轴上限, 每个子图最多画几个值, 颜色)
+FIGURES = [('FIXTURE_ID', 'tester_by_subcategory.csv', 'tester_distribution_on_fail_items.png', 80, None, 'green'),
+           ('CARRIER_PN', 'carrier_by_subcategory.csv', 'carrier_distribution_on_fail_items.png', 40, 20, 'orange')]
+
+
+def window_dir(start, end, out_dir=REPORT_DIR):
+    return os.path.join(out_dir, f"{parse_time(start):%Y%m%d_%H%M%S}-{parse_time(end):%Y%m%d_%H%M%S}")
+
+
+def daily_windows(start, end):
+    """ one window per day from start, the last one ends at end
+    :param start:
+    :param end:
+    :return: [(start, end), ...]
+    """
+    windows = []
+    current = parse_time(start)
+    end = parse_time(end)
+    while current < end:
+        windows.append((format_time(current), format_time(min(current + timedelta(days=1), end))))
+        current += timedelta(days=1)
+    return windows
+
+
+def collect(start, end, top=TOP_CATEGORIES):
+    """ the data of the report of one window
+    :param start:
+    :param end:
+    :param top: number of sub categories
+    :return: {'start', 'end', 'top': DataFrame count / rate (% of the input) by sub category,
+              column of each figure: DataFrame 'Sub Category', column, 'count'}
+    """
+    sub_category = search_top_fail_subcategory(start, end, top=top).to_frame()
+    input_count = get_input_count(start, end)
+    sub_category['rate'] = sub_category['count'] / input_count * 100 if input_count else 0.0
+    data = {'start': format_time(start), 'end': format_time(end), 'top': sub_category}
+    data.update(subcategory_breakdown(start, end, list(sub_category.index), [figure[0] for figure in FIGURES]))
+    return data
+
+
+def draw_distribution(fig, sub_categories, counts, column, limit, head, color, angle=90):
+    """ one bar chart of the values of column per sub category on a 2x3 grid
+    :param fig:
+    :param sub_categories:
+    :param counts: DataFrame 'Sub Category', column, 'count'
+    :param column:
+    :param limit: y axis upper limit, raised to fit the highest bar
+    :param head: only the first head values of a sub category
+    :param color:
+    :param angle: rotation of the value labels
+    :return:
+    """
+    axs = fig.subplots(2, 3)
+    for i, ax in enumerate(axs.flat):
+        if i >= len(sub_categories):
+            ax.set_axis_off()
+            continue
+        rows = counts[counts['Sub Category'] == sub_categories[i]]
+        if head is not None:
+            rows = rows.head(head)
+        x = list(rows[column])
+        y = list(rows['count'])
+        ax.bar(range(len(x)), y, width=0.6, alpha=0.5, color=color)
+        ax.set_title(sub_categories[i])
+        ax.set_ylim(0, max([limit] + [v * 1.2 for v in y]))
+        ax.set_xticks([])
+        for j, v in enumerate(y):
+            ax.text(j - 0.3, v + 1.3, x[j], rotation=angle, fontsize=8)
+    fig.tight_layout()
+
+
+def render(data, out_dir=REPORT_DIR):
+    """ write the csv files and the figures of one window, runs in the worker processes
+    :param data: the result of collect
+    :param out_dir:
+    :return: the written files
+    """
+    target = window_dir(data['start'], data['end'], out_dir)
+    os.makedirs(target, exist_ok=True)
+    files = [os.path.join(target, 'top_fail_category.csv')]
+    data['top'].to_csv(files[-1], index=True, header=True)
+    sub_categories = list(data['top'].index)
+    for column, csv_name, png_name, limit, head, color in FIGURES:
+        files.append(os.path.join(target, csv_name))
+        data[column].to_csv(files[-1], index=False)
+        # Figure 不经过 pyplot, 不需要显示器, 也不会留在全局的图列表中
+        fig = Figure(figsize=(12, 8))
+        draw_distribution(fig, sub_categories, data[column], column, limit, head, color)
+        files.append(os.path.join(target, png_name))
+        fig.savefig(files[-1])
+    return files
+
+
+def run(windows, out_dir=REPORT_DIR, max_workers=None, verbose=False):
+    """ the reports of every window, the queries run here one window after another,
+    the rendering of a window starts in the pool as soon as its data is ready
+    :param windows: [(start, end), ...]
+    :param out_dir:
+    :param max_workers: size of the process pool, default os.cpu_count()
+    :param verbose:
+    :return: {(start, end): [written files]}
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    futures = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for start, end in windows:
+            futures[(start, end)] = pool.submit(render, collect(start, end), out_dir)
+        written = {}
+        for window, future in futures.items():
+            written[window] = future.result()
+            if verbose:
+                print(f"{window[0]} ~ {window[1]}: {window_dir(window[0], window[1], out_dir)}")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write the fail category reports (csv and png) of time windows")
+    parser.add_argument('--window', nargs=2, action='append', default=[], metavar=('START', 'END'),
+                        help="a time window, may be repeated")
+    parser.add_argument('--daily', nargs=2, metavar=('START', 'END'), help="one window per day from START to END")
+    parser.add_argument('--out', default=REPORT_DIR, help="output folder")
+    parser.add_argument('--workers', type=int, help="number of rendering processes")
+    args = parser.parse_args()
+    windows = [tuple(window) for window in args.window]
+    if args.daily:
+        windows += daily_windows(*args.daily)
+    if not windows:
+        parser.error("no time window, use --window or --daily")
+    run(windows, args.out, args.workers, verbose=True)
+
+
+if __name__ == '__main__':
+    main()
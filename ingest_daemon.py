@@ -0,0 +1,181 @@
+############################################################################
+#
+# 常驻入库进程: 监听 xlsx_files, csv_files/record, csv_files/fail_record,
+# 文件写完(大小和修改时间在 settle_seconds 内不再变化)后按目录交给对应的解析函数入库.
+# 有 inotify_simple 时用 inotify 监听, 否则按 poll_interval 轮询目录.
+# pandas, 模块和 fail key 配置只加载一次, 数据库连接(db_pool)在整个进程生命周期内保持打开.
+#
+############################################################################
+import argparse
+import logging
+import os
+import signal
+import time
+import warnings
+
+import collect_data2
+import collect_fail_record
+import collect_record
+import metrics
+from db_pool import close_all
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# (目录, 文件后缀, 入库函数)
+ROUTES = [('xlsx_files', '.xlsx', collect_data2.process_file),
+          ('csv_files/record', '.csv', collect_record.csv_to_database),
+          ('csv_files/fail_record', '.csv', collect_fail_record.csv_to_database)]
+
+
+def route(file_path):
+    """ the ingest function for file_path, None if the file is not watched
+    :param file_path:
+    :return:
+    """
+    folder_path, filename = os.path.split(file_path)
+    for folder, suffix, ingest in ROUTES:
+        if os.path.abspath(folder_path) == os.path.abspath(folder) and filename.endswith(suffix):
+            return ingest
+    return None
+
+
+def scan():
+    """ all the files currently waiting in the watched folders
+    :return:
+    """
+    for folder, suffix, _ in ROUTES:
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            if entry.is_file() and entry.name.endswith(suffix):
+                yield entry.path
+
+
+def ingest_file(file_path):
+    """ ingest file_path with the function of its folder
+    :param file_path:
+    :return: False if the ingest raised, e.g. on a locked database, the file is left where it is
+    """
+    ingest = route(file_path)
+    if ingest is None:
+        return True
+    folder_path, filename = os.path.split(file_path)
+    try:
+        ingest(folder_path, filename)
+    except Exception as e:
+        # the ingest functions handle their own errors, this only keeps the daemon alive
+        print(e)
+        logging.exception(f"ingest of {file_path} failed")
+        return False
+    return True
+
+
+class Daemon:
+    def __init__(self, settle_seconds=2.0, poll_interval=1.0, use_inotify=True):
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.inotify = None
+        self.watches = {}
+        # file_path -> (size, mtime_ns, time the file was first seen with this size and mtime)
+        self.pending = {}
+        self.running = False
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+            for folder, _, _ in ROUTES:
+                os.makedirs(folder, exist_ok=True)
+                wd = self.inotify.add_watch(folder, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+                self.watches[wd] = folder
+
+    def wait_for_files(self):
+        """ block up to poll_interval and return the paths that may have changed
+        :return:
+        """
+        if self.inotify is None:
+            time.sleep(self.poll_interval)
+            return list(scan())
+        events = self.inotify.read(timeout=int(self.poll_interval * 1000))
+        return [os.path.join(self.watches[event.wd], event.name) for event in events if event.name]
+
+    def track(self, file_path, now):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            self.pending.pop(file_path, None)
+            return
+        size_mtime = (stat.st_size, stat.st_mtime_ns)
+        seen = self.pending.get(file_path)
+        if seen is None or seen[:2] != size_mtime:
+            self.pending[file_path] = size_mtime + (now,)
+
+    def settled_files(self, now):
+        """ the pending files whose size and mtime did not change for settle_seconds, they stay pending until
+        ingested (a quarantined or removed file is dropped by track)
+        :param now:
+        :return:
+        """
+        for file_path in list(self.pending):
+            self.track(file_path, now)
+            seen = self.pending.get(file_path)
+            if seen is not None and now - seen[2] >= self.settle_seconds:
+                yield file_path
+
+    def ingest(self, file_path):
+        if ingest_file(file_path):
+            self.pending.pop(file_path, None)
+        elif file_path in self.pending:
+            # retry after another settle_seconds
+            self.pending[file_path] = self.pending[file_path][:2] + (time.time(),)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        mode = 'inotify' if self.inotify is not None else f'polling every {self.poll_interval}s'
+        print(f"watching {', '.join(folder for folder, _, _ in ROUTES)} ({mode})")
+        logging.info(f"ingest daemon started ({mode})")
+        # warm up the fail key config before the first file arrives
+        collect_fail_record.load_config()
+        # files left over from a previous run
+        now = time.time()
+        for file_path in scan():
+            self.track(file_path, now)
+        while self.running:
+            for file_path in self.wait_for_files():
+                if route(file_path) is not None:
+                    self.track(file_path, time.time())
+            for file_path in self.settled_files(time.time()):
+                self.ingest(file_path)
+        close_all()
+        logging.info("ingest daemon stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="watch the input folders and ingest new files")
+    parser.add_argument('--poll', action='store_true', help="poll the folders even if inotify is available")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="seconds a file must stay unchanged before it is ingested")
+    parser.add_argument('--interval', type=float, default=1.0, help="polling interval in seconds")
+    parser.add_argument('--metrics-dir', help="write ingest.prom and ingest.json with the ingest metrics here")
+    parser.add_argument('--metrics-interval', type=float, default=60.0, help="seconds between two metrics files")
+    args = parser.parse_args()
+    # 入库模块导入时不再设置日志, 由入口设置
+    warnings.filterwarnings('ignore')
+    logging.basicConfig(filename=collect_data2.LOG_FILE, level=logging.INFO)
+    if args.metrics_dir:
+        os.makedirs(args.metrics_dir, exist_ok=True)
+        metrics.start_exporter(os.path.join(args.metrics_dir, 'ingest.prom'),
+                               os.path.join(args.metrics_dir, 'ingest.json'), args.metrics_interval)
+    try:
+        Daemon(settle_seconds=args.settle, poll_interval=args.interval, use_inotify=not args.poll).run()
+    finally:
+        metrics.stop_exporter()
+
+
+if __name__ == '__main__':
+    main()
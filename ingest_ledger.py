@@ -0,0 +1,127 @@
+############################################################################
+#
+# 入库台账: 以文件内容的 sha256 为键, 记录每个文件的入库状态、行数和耗时.
+# 已入库的文件再次送达时不再解析, 解析失败的文件移到 quarantine 目录等待重试.
+#
+############################################################################
+import hashlib
+import os
+import shutil
+import time
+from datetime import datetime
+
+from db_pool import get_connection
+
+QUARANTINE_DIR = 'quarantine'
+
+
+def file_digest(file_path):
+    """ sha256 of the file content
+    :param file_path:
+    :return:
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def create_ledger(conn):
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS ingest_ledger (
+                   digest TEXT PRIMARY KEY,
+                   filename TEXT,
+                   status TEXT,
+                   row_count INTEGER,
+                   started_at TIMESTAMP,
+                   finished_at TIMESTAMP,
+                   duration REAL,
+                   error TEXT)""")
+
+
+def is_ingested(db_name, digest):
+    """ True if the file with this digest has already been ingested into db_name
+    :param db_name:
+    :param digest:
+    :return:
+    """
+    conn = get_connection(db_name)
+    create_ledger(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT status FROM ingest_ledger WHERE digest = ?", (digest,))
+    result = cursor.fetchone()
+    return bool(result) and result[0] == 'done'
+
+
+def _mark(conn, digest, filename, status, row_count, started_at, error):
+    create_ledger(conn)
+    finished_at = time.time()
+    conn.execute("""INSERT INTO ingest_ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(digest) DO UPDATE SET
+                    filename = excluded.filename, status = excluded.status, row_count = excluded.row_count,
+                    started_at = excluded.started_at, finished_at = excluded.finished_at,
+                    duration = excluded.duration, error = excluded.error""",
+                 (digest, filename, status, row_count,
+                  datetime.fromtimestamp(started_at).strftime('%Y-%m-%d %H:%M:%S'),
+                  datetime.fromtimestamp(finished_at).strftime('%Y-%m-%d %H:%M:%S'),
+                  finished_at - started_at, error))
+
+
+def mark_done(conn, digest, filename, row_count, started_at):
+    """ record a successful ingest, call it inside the transaction that inserts the rows
+    so that the rows and the ledger entry are committed together
+    :param conn:
+    :param digest:
+    :param filename:
+    :param row_count:
+    :param started_at: time.time() when the file was picked up
+    :return:
+    """
+    _mark(conn, digest, filename, 'done', row_count, started_at, None)
+
+
+def mark_failed(db_name, digest, filename, started_at, error):
+    """ record a failed ingest in its own transaction
+    :param db_name:
+    :param digest:
+    :param filename:
+    :param started_at:
+    :param error:
+    :return:
+    """
+    conn = get_connection(db_name)
+    try:
+        _mark(conn, digest, filename, 'failed', None, started_at, repr(error))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def quarantine(file_path, quarantine_dir=QUARANTINE_DIR):
+    """ move a file that failed to ingest to quarantine_dir/<source folder>/
+    :param file_path:
+    :param quarantine_dir:
+    :return: the new path
+    """
+    target_dir = os.path.join(quarantine_dir, os.path.basename(os.path.dirname(os.path.abspath(file_path))))
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, os.path.basename(file_path))
+    shutil.move(file_path, target)
+    return target
+
+
+def retry_quarantined(folder_path, quarantine_dir=QUARANTINE_DIR):
+    """ move the quarantined files of folder_path back so that the next run picks them up again
+    :param folder_path:
+    :param quarantine_dir:
+    :return: number of files moved back
+    """
+    source_dir = os.path.join(quarantine_dir, os.path.basename(os.path.abspath(folder_path)))
+    if not os.path.isdir(source_dir):
+        return 0
+    filenames = os.listdir(source_dir)
+    for filename in filenames:
+        shutil.move(os.path.join(source_dir, filename), os.path.join(folder_path, filename))
+    return len(filenames)
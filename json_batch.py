@@ -0,0 +1,146 @@
+############################################################################
+#
+# '数据信息' 列的批量解码: 一个批次的 json 字符串拼成一个 json 数组一次解码,
+# 再由每个站点预先定义的字段提取函数直接生成 record 表的各列,
+# 不再像 res/dva/tsp.JsonToListDataFrame 那样逐行修改、删除字典里的键再组装 dataframe.
+# 安装了 orjson 时用 orjson 解码, 否则用标准库 json.
+#
+############################################################################
+import gc
+from itertools import islice
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    _loads = json.loads
+
+# record 表的列顺序, 所有站点的 dataframe 入库前都按此顺序对齐
+RECORD_COLUMNS = ['fixture_id', 'stop_time', 'result', 'sn', 'sw_version', 'failure_message', 'Carrier_sn',
+                  'test_station']
+BATCH_SIZE = 10000
+
+
+def _first_test(value):
+    # 'a;b;c' -> 'a', missing value -> ''
+    return value.split(';')[0] if value else ''
+
+
+def _tsp(records):
+    return {'fixture_id': [r.get('fixture_id') for r in records],
+            'stop_time': [r.get('stop_time') for r in records],
+            'result': [r.get('result') for r in records],
+            'sn': [r['sn'].split('+')[0] for r in records],
+            'sw_version': [r.get('sw_version') for r in records],
+            'failure_message': [_first_test(r.get('failure_message')) for r in records],
+            'Carrier_sn': [r['station_string'].split(';')[-1] for r in records],
+            'test_station': 'TSP-E'}
+
+
+def _res(records):
+    return {'fixture_id': [r.get('fixture_id') for r in records],
+            'stop_time': [r.get('stop_time') for r in records],
+            'result': [r.get('result') for r in records],
+            'sn': [r.get('sn') for r in records],
+            'sw_version': [r.get('sw_version') for r in records],
+            'failure_message': [_first_test(r.get('list_of_failing_tests')) for r in records],
+            'Carrier_sn': [r.get('Carrier_sn') for r in records],
+            'test_station': 'OQC-Resistance'}
+
+
+def _dva(records):
+    return {'fixture_id': [r['station_id'].split('_IQC')[0] for r in records],
+            'stop_time': [r.get('stop_time') for r in records],
+            'result': [r.get('result') for r in records],
+            'sn': [r.get('sn') for r in records],
+            'sw_version': [r.get('sw_version') for r in records],
+            'failure_message': [_first_test(r.get('list_of_failing_tests')) for r in records],
+            'Carrier_sn': [r.get('fixture_id') for r in records],
+            'test_station': 'DVA'}
+
+
+# 站点 -> 字段提取函数, 与 res/dva/tsp.JsonToListDataFrame 的转换规则一致
+EXTRACTORS = {'res': _res, 'dva': _dva, 'tsp': _tsp}
+# 站点 -> 必须有的字段 (与 JsonToListDataFrame 一样用 r[key] 读取), 其他字段缺少时为空
+REQUIRED_FIELDS = {'res': [], 'dva': ['station_id'], 'tsp': ['sn', 'station_string']}
+
+
+def station_of(filename):
+    """ the station type of an MES export, from its file name
+    :param filename:
+    :return: 'res', 'dva', 'tsp' or None
+    """
+    for station in EXTRACTORS:
+        if station in filename or station.upper() in filename:
+            return station
+    return None
+
+
+def _cell_text(value):
+    # empty cells (None, NaN) have no record, bytes and numbers are decoded like the text of the cell
+    if value is None or value != value:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def decode_batch(json_strings):
+    """ decode a list of json strings in one call, cells that are not strings are converted, empty ones skipped
+    :param json_strings:
+    :return: list of the decoded objects, one per non-empty cell
+    """
+    texts = [item if isinstance(item, str) else _cell_text(item) for item in json_strings]
+    texts = [text for text in texts if text is not None]
+    try:
+        decoded = _loads('[' + ','.join(texts) + ']')
+        # a cell holding several json values, e.g. '{..},{..}', would shift every later row
+        if len(decoded) == len(texts):
+            return decoded
+    except ValueError:
+        pass
+    # decode one by one so the error points at the broken row
+    return [_loads(text) for text in texts]
+
+
+def decode_records(json_strings, station, batch_size=BATCH_SIZE):
+    """ decode the '数据信息' json strings of one station into a record dataframe
+    :param json_strings: iterable of json strings, e.g. xlsx_reader.iter_info_column()
+    :param station: 'res', 'dva' or 'tsp'
+    :param batch_size: json strings decoded per call
+    :return: dataframe with RECORD_COLUMNS
+    """
+    import pandas as pd
+
+    extract = EXTRACTORS[station]
+    columns = {column: [] for column in RECORD_COLUMNS}
+    row_count = 0
+    json_strings = iter(json_strings)
+    # the decoded objects hold no reference cycles, the cyclic gc would only rescan them over and over
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while True:
+            batch = list(islice(json_strings, batch_size))
+            if not batch:
+                break
+            records = decode_batch(batch)
+            try:
+                extracted = extract(records)
+            except KeyError as e:
+                raise ValueError(f"a {station} record has no {e.args[0]!r}, "
+                                 f"required: {', '.join(REQUIRED_FIELDS[station])}") from None
+            for column, values in extracted.items():
+                if isinstance(values, str):
+                    # constant column, e.g. test_station
+                    columns[column] = values
+                else:
+                    columns[column].extend(values)
+            row_count += len(records)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return pd.DataFrame(columns, columns=RECORD_COLUMNS, index=range(row_count))
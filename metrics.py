@@ -0,0 +1,217 @@
+############################################################################
+#
+# 进程内的运行指标: 计数器和耗时直方图, 按名称和标签累计, 记录一次只是加锁后几次加法, 可以一直开着.
+#   db_operation_seconds{function, db}              db_operation 包装的函数的耗时
+#   db_operation_errors_total{function, db, error}  db_operation 包装的函数抛出的异常
+#   ingest_stage_seconds{source, stage}             入库各阶段 (read / parse / transform / insert / rollup) 的耗时
+#   ingest_rows_total{source, outcome}              读入 (read)、写入 (inserted)、跳过 (skipped) 的行数
+#   ingest_bytes_total{source}                      读入的文件字节数
+#   ingest_files_total{source, outcome}             入库 (done)、失败 (failed)、重复 (duplicate) 的文件数
+#   ingest_errors_total{source, error}              入库失败的异常
+# 导出为 Prometheus 文本格式 (node_exporter textfile collector) 和 JSON 快照, start_exporter 定期写文件.
+# 进程池中的子进程有各自的指标, 它们的耗时由主进程汇总 (见 collect_data2.add_from_xlsx).
+#
+############################################################################
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+# 直方图的桶上限 (秒)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+HELP = {'db_operation_seconds': "duration of the functions wrapped by db_operation",
+        'db_operation_errors_total': "exceptions raised by the functions wrapped by db_operation",
+        'ingest_stage_seconds': "duration of an ingest stage of one file or batch",
+        'ingest_rows_total': "rows read, inserted and skipped by the ingest",
+        'ingest_bytes_total': "bytes of the ingested files",
+        'ingest_files_total': "files done, failed and skipped as duplicates by the ingest",
+        'ingest_errors_total': "exceptions that failed an ingest"}
+ENABLED = True
+
+_lock = threading.Lock()
+# (名称, 标签) -> 值
+_counters = {}
+# (名称, 标签) -> [每个桶的个数 (最后一个是 +Inf), 总和, 个数]
+_histograms = {}
+_exporter = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """ add value to a counter
+    :param name:
+    :param value:
+    :param labels:
+    :return:
+    """
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """ add a duration to a histogram
+    :param name:
+    :param seconds:
+    :param labels:
+    :return:
+    """
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    bucket = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bucket] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """ observe the duration of the with block, also when it raises """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def timed_iter(iterable, name, **labels):
+    """ iterate iterable, observing the time every item takes to produce, e.g. the chunks of pd.read_csv
+    :param iterable:
+    :param name:
+    :param labels:
+    :return:
+    """
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe(name, time.perf_counter() - started, **labels)
+        yield item
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    """ the current values
+    :return: {'time', 'counters': [{'name', 'labels', 'value'}, ...],
+              'histograms': [{'name', 'labels', 'count', 'sum', 'buckets': {upper bound: cumulative count}}, ...]}
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (list(counts), total, count)) for key, (counts, total, count)
+                            in _histograms.items())
+    result = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'counters': [], 'histograms': []}
+    for (name, labels), value in counters:
+        result['counters'].append({'name': name, 'labels': dict(labels), 'value': value})
+    for (name, labels), (counts, total, count) in histograms:
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        result['histograms'].append({'name': name, 'labels': dict(labels), 'count': count, 'sum': total,
+                                     'buckets': buckets})
+    return result
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text(data=None):
+    """ the values in the Prometheus text exposition format
+    :param data: a snapshot(), default the current values
+    :return:
+    """
+    data = data or snapshot()
+    lines = []
+    described = set()
+    for kind, items in (('counter', data['counters']), ('histogram', data['histograms'])):
+        for item in items:
+            name = item['name']
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                lines.append(f"{name}{_labels_text(item['labels'])} {item['value']}")
+                continue
+            for bound, count in item['buckets'].items():
+                lines.append(f"{name}_bucket{_labels_text(item['labels'], [('le', bound)])} {count}")
+            lines.append(f"{name}_sum{_labels_text(item['labels'])} {item['sum']}")
+            lines.append(f"{name}_count{_labels_text(item['labels'])} {item['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path, text):
+    # a reader (node_exporter) never sees half of the file
+    temp = f'{path}.tmp'
+    with open(temp, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temp, path)
+
+
+def write(prometheus_path=None, json_path=None):
+    """ write the current values to a Prometheus text file and/or a JSON file
+    :param prometheus_path:
+    :param json_path:
+    :return:
+    """
+    data = snapshot()
+    if prometheus_path:
+        _write(prometheus_path, prometheus_text(data))
+    if json_path:
+        _write(json_path, json.dumps(data, indent=2, ensure_ascii=False))
+
+
+def start_exporter(prometheus_path=None, json_path=None, interval=60):
+    """ write the files every interval seconds in a daemon thread until stop_exporter
+    :param prometheus_path:
+    :param json_path:
+    :param interval:
+    :return:
+    """
+    stop_exporter()
+    stopped = threading.Event()
+
+    def loop():
+        while not stopped.wait(interval):
+            write(prometheus_path, json_path)
+
+    thread = threading.Thread(target=loop, name='metrics-exporter', daemon=True)
+    thread.start()
+    _exporter.update(stopped=stopped, thread=thread, paths=(prometheus_path, json_path))
+
+
+def stop_exporter():
+    """ stop the exporter thread and write the files one last time """
+    if not _exporter:
+        return
+    _exporter['stopped'].set()
+    _exporter['thread'].join()
+    write(*_exporter['paths'])
+    _exporter.clear()
@@ -0,0 +1,278 @@
+############################################################################
+#
+# mes1.db / insight.db 的索引和表结构迁移.
+# 每个迁移有一个版本号, 已执行的版本记录在 schema_migrations 表中;
+# 迁移涉及的表都存在时才会执行, 表还没建立的迁移留到下次 upgrade 时再执行.
+# python migrate.py                   # 升级 mes1.db 和 insight.db
+# python migrate.py insight.db --explain   # 升级并打印内置查询升级前后的 EXPLAIN QUERY PLAN
+# python migrate.py --compact              # 升级并合并按小时汇总表的增量行
+#
+############################################################################
+import argparse
+import os
+from datetime import datetime
+
+from db_pool import get_connection
+from query_cache import CHANGES_STATEMENTS
+from rollup import compact, rollup_statements
+from timestamps import epoch_statements, to_epoch
+
+# archive.py 归档到的最后一天和已处理的最后一条 data_changes
+ARCHIVE_STATE_STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS archive_state (
+       table_name TEXT PRIMARY KEY,
+       last_day TEXT,
+       last_change INTEGER,
+       updated_at TIMESTAMP)"""]
+
+# 数据库 -> [(版本, 说明, 涉及的表, [sql, ...] 或 按表结构生成 sql 的函数 conn -> [sql, ...]), ...]
+MIGRATIONS = {
+    'mes1.db': [
+        (1, 'record natural key', ['record'], [
+            # duplicated rows left by the old row-by-row ingest
+            "DELETE FROM record WHERE rowid NOT IN (SELECT MIN(rowid) FROM record GROUP BY sn, test_station, stop_time)",
+            # also serves sn = ? and sn = ? AND test_station = ? lookups
+            "CREATE UNIQUE INDEX IF NOT EXISTS record_natural_key ON record (sn, test_station, stop_time)"]),
+        (2, 'record station/result/time index', ['record'], [
+            "CREATE INDEX IF NOT EXISTS record_station_result_time ON record (test_station, result, stop_time)",
+            "CREATE INDEX IF NOT EXISTS record_station_time ON record (test_station, stop_time)"]),
+        (3, 'record1 time index', ['record1'], [
+            "CREATE INDEX IF NOT EXISTS record1_time_result ON record1 (stop_time, result_type)"]),
+        (4, 'record1 per station classification', ['record', 'record1'], [
+            # record1 only held TSP-E before generate_record1 covered every station
+            "ALTER TABLE record1 ADD COLUMN test_station TEXT",
+            "UPDATE record1 SET test_station = 'TSP-E' WHERE test_station IS NULL",
+            "DELETE FROM record1 WHERE rowid NOT IN (SELECT MAX(rowid) FROM record1 GROUP BY sn, test_station)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS record1_sn_station ON record1 (sn, test_station)",
+            "CREATE INDEX IF NOT EXISTS record1_station_time_result ON record1 (test_station, stop_time, result_type)",
+            # high-water mark of the records already classified into record1
+            """CREATE TABLE IF NOT EXISTS record1_state (
+               last_rowid INTEGER,
+               stop_time TIMESTAMP,
+               updated_at TIMESTAMP)""",
+            "INSERT INTO record1_state VALUES (0, NULL, NULL)"]),
+        # the rollups are filled by the epoch migrations of their source tables
+        (5, 'record hourly rollups', ['record'],
+         rollup_statements('mes1.db', 'record_hourly', fill=False)
+         + rollup_statements('mes1.db', 'record_failure_hourly', fill=False)),
+        (6, 'record1 hourly rollup', ['record', 'record1'], rollup_statements('mes1.db', 'record1_hourly', fill=False)),
+        (7, 'data change log', [], CHANGES_STATEMENTS),
+        (8, 'parquet archive state', [], ARCHIVE_STATE_STATEMENTS),
+        (9, 'record epoch time', ['record'], epoch_statements(
+            'mes1.db', 'record', ['record_station_result_time', 'record_station_time'],
+            {'record_station_result_epoch': ['test_station', 'result', 'stop_epoch'],
+             'record_station_epoch': ['test_station', 'stop_epoch']})),
+        (10, 'record1 epoch time', ['record1'], epoch_statements(
+            'mes1.db', 'record1', ['record1_time_result', 'record1_station_time_result'],
+            {'record1_station_epoch_result': ['test_station', 'stop_epoch', 'result_type']})),
+    ],
+    'insight.db': [
+        (1, 'record time/fixture/result index', ['record'], [
+            'CREATE INDEX IF NOT EXISTS record_time_fixture_result '
+            'ON record ("Test End Time", "Fixture ID", "Test Result")',
+            'CREATE INDEX IF NOT EXISTS record_result_time ON record ("Test Result", "Test End Time")',
+            'CREATE INDEX IF NOT EXISTS record_sn ON record ("Serial Number")']),
+        (2, 'fail_record time/sub category index', ['fail_record'], [
+            'CREATE INDEX IF NOT EXISTS fail_record_time_subcategory ON fail_record (EndTime, "Sub Category")',
+            'CREATE INDEX IF NOT EXISTS fail_record_subcategory_time ON fail_record ("Sub Category", EndTime)']),
+        (3, 'record fixture/time/result index', ['record'], [
+            'CREATE INDEX IF NOT EXISTS record_fixture_time_result '
+            'ON record ("Fixture ID", "Test End Time", "Test Result")']),
+        (4, 'record hourly rollups', ['record'],
+         rollup_statements('insight.db', 'record_hourly', fill=False)
+         + rollup_statements('insight.db', 'record_failure_hourly', fill=False)
+         # get_fpy_by_tester reads record_hourly now
+         + ['DROP INDEX IF EXISTS record_fixture_time_result']),
+        (5, 'data change log', [], CHANGES_STATEMENTS),
+        (6, 'record sn/result/time index', ['record'], [
+            # NOT EXISTS of the retest-only fail_record queries, also serves "Serial Number" = ? lookups
+            'CREATE INDEX IF NOT EXISTS record_sn_result_time '
+            'ON record ("Serial Number", "Test Result", "Test End Time")',
+            'DROP INDEX IF EXISTS record_sn']),
+        (7, 'parquet archive state', [], ARCHIVE_STATE_STATEMENTS),
+        (8, 'record epoch time', ['record'], epoch_statements(
+            'insight.db', 'record', ['record_time_fixture_result', 'record_result_time', 'record_sn_result_time'],
+            {'record_epoch_fixture_result': ['Test End Epoch', 'Fixture ID', 'Test Result'],
+             'record_result_epoch': ['Test Result', 'Test End Epoch'],
+             'record_sn_result_epoch': ['Serial Number', 'Test Result', 'Test End Epoch']})),
+        (9, 'fail_record epoch time', ['fail_record'], epoch_statements(
+            'insight.db', 'fail_record', ['fail_record_time_subcategory', 'fail_record_subcategory_time'],
+            {'fail_record_epoch_subcategory': ['EndEpoch', 'Sub Category'],
+             'fail_record_subcategory_epoch': ['Sub Category', 'EndEpoch']})),
+    ],
+}
+
+_START = '2024-01-02 20:00:00'
+_END = '2024-01-09 20:00:00'
+_START_EPOCH = to_epoch(_START)
+_END_EPOCH = to_epoch(_END)
+# 分析函数使用的查询, 用于对比升级前后的查询计划: 名称 -> [(sql, 参数), ...], 当前的写法在前,
+# 后面是旧表结构上的写法 (没有 epoch 列、record1 没有 test_station、没有按小时汇总表), 解释第一个能用的
+BUILTIN_QUERIES = {
+    'mes1.db': [
+        ('get_fpy', [
+            ("SELECT result_type, COUNT(*) FROM record1 WHERE test_station = ? AND stop_epoch BETWEEN ? AND ? "
+             "GROUP BY result_type", ('TSP-E', _START_EPOCH, _END_EPOCH)),
+            ("SELECT result_type, COUNT(*) FROM record1 WHERE test_station = ? AND stop_time BETWEEN ? AND ? "
+             "GROUP BY result_type", ('TSP-E', _START, _END)),
+            ("SELECT result_type, COUNT(*) FROM record1 WHERE stop_time BETWEEN ? AND ? GROUP BY result_type",
+             (_START, _END))]),
+        ('search_top_*', [
+            ("SELECT fixture_id, count FROM record_hourly WHERE hour >= ? AND hour < ? "
+             "AND test_station = ? AND result = 'FAIL'", (_START, _END, 'TSP-E')),
+            ("SELECT fixture_id, COUNT(*) FROM record WHERE stop_time BETWEEN ? AND ? "
+             "AND test_station = ? AND result = 'FAIL' GROUP BY fixture_id", (_START, _END, 'TSP-E'))]),
+        ('carrier_count_of_tester', [
+            ("SELECT Carrier_sn, COUNT(*) AS count FROM record WHERE stop_epoch BETWEEN ? AND ? "
+             "AND Carrier_sn IS NOT NULL AND test_station = ? AND result = 'FAIL' "
+             "AND fixture_id = ? GROUP BY Carrier_sn ORDER BY count DESC",
+             (_START_EPOCH, _END_EPOCH, 'TSP-E', '100301')),
+            ("SELECT Carrier_sn, COUNT(*) AS count FROM record WHERE stop_time BETWEEN ? AND ? "
+             "AND Carrier_sn IS NOT NULL AND test_station = ? AND result = 'FAIL' "
+             "AND fixture_id = ? GROUP BY Carrier_sn ORDER BY count DESC", (_START, _END, 'TSP-E', '100301'))]),
+        ('search_by_sn', [("SELECT * FROM record WHERE sn = ?", ('G9P3503G0QL21KHA6',))]),
+        ('generate_record1', [
+            ("SELECT sn, test_station, stop_time, result FROM record WHERE sn = ? AND test_station = ?",
+             ('G9P3503G0QL21KHA6', 'TSP-E'))]),
+    ],
+    'insight.db': [
+        ('get_fpy', [
+            ('SELECT "Test Result", COUNT(*) FROM record WHERE "Test End Epoch" BETWEEN ? AND ? '
+             'GROUP BY "Test Result"', (_START_EPOCH, _END_EPOCH)),
+            ('SELECT "Test Result", COUNT(*) FROM record WHERE "Test End Time" BETWEEN ? AND ? '
+             'GROUP BY "Test Result"', (_START, _END))]),
+        ('get_fpy_by_tester', [
+            ('SELECT "Fixture ID", "Fail Message", COUNT(*) FROM record '
+             'WHERE "Test End Epoch" BETWEEN ? AND ? AND "Test Result" = \'RETEST\' '
+             'GROUP BY "Fixture ID", "Fail Message"', (_START_EPOCH, _END_EPOCH)),
+            ('SELECT "Fixture ID", "Fail Message", COUNT(*) FROM record '
+             'WHERE "Test End Time" BETWEEN ? AND ? AND "Test Result" = \'RETEST\' '
+             'GROUP BY "Fixture ID", "Fail Message"', (_START, _END))]),
+        ('search_top_tester', [
+            ('SELECT "Fixture ID", count FROM record_hourly WHERE hour >= ? AND hour < ? '
+             'AND "Test Result" = ?', (_START, _END, 'RETEST')),
+            ('SELECT "Fixture ID", COUNT(*) FROM record WHERE "Test End Time" BETWEEN ? AND ? '
+             'AND "Test Result" = ? GROUP BY "Fixture ID"', (_START, _END, 'RETEST'))]),
+        ('get_fail_sn', [
+            ('SELECT "Serial Number" FROM record WHERE "Test End Epoch" BETWEEN ? AND ? '
+             'AND "Test Result" = \'FAIL\'', (_START_EPOCH, _END_EPOCH)),
+            ('SELECT "Serial Number" FROM record WHERE "Test End Time" BETWEEN ? AND ? '
+             'AND "Test Result" = \'FAIL\'', (_START, _END))]),
+        ('tester_count_of_failure', [
+            ('SELECT FIXTURE_ID, COUNT(*) FROM fail_record WHERE EndEpoch BETWEEN ? AND ? '
+             'AND "Sub Category" = ? AND NOT EXISTS (SELECT 1 FROM record '
+             'WHERE "Serial Number" = fail_record.SerialNumber AND "Test Result" = \'FAIL\' '
+             'AND "Test End Epoch" BETWEEN ? AND ?) GROUP BY FIXTURE_ID',
+             (_START_EPOCH, _END_EPOCH, 'FSProbe Cal', _START_EPOCH, _END_EPOCH)),
+            ('SELECT FIXTURE_ID, COUNT(*) FROM fail_record WHERE EndTime BETWEEN ? AND ? '
+             'AND "Sub Category" = ? AND NOT EXISTS (SELECT 1 FROM record '
+             'WHERE "Serial Number" = fail_record.SerialNumber AND "Test Result" = \'FAIL\' '
+             'AND "Test End Time" BETWEEN ? AND ?) GROUP BY FIXTURE_ID',
+             (_START, _END, 'FSProbe Cal', _START, _END))]),
+    ],
+}
+
+
+def _migrations(db_name):
+    return MIGRATIONS.get(os.path.basename(db_name), [])
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+
+
+def applied_versions(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                 version INTEGER PRIMARY KEY,
+                 name TEXT,
+                 applied_at TIMESTAMP)""")
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+
+def upgrade(db_name, verbose=False):
+    """ apply the pending migrations of db_name whose tables exist, each in its own transaction
+    :param db_name:
+    :param verbose: print every applied migration
+    :return: list of the applied versions
+    """
+    conn = get_connection(db_name)
+    applied = applied_versions(conn)
+    pending = [migration for migration in _migrations(db_name) if migration[0] not in applied]
+    if not pending:
+        return []
+    tables = _tables(conn)
+    done = []
+    for version, name, needed, statements in pending:
+        if not set(needed) <= tables:
+            continue
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for sql in statements(conn) if callable(statements) else statements:
+                conn.execute(sql)
+            conn.execute("INSERT INTO schema_migrations VALUES (?, ?, ?)",
+                         (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done.append(version)
+        if verbose:
+            print(f"{db_name}: applied {version} {name}")
+    return done
+
+
+def explain(conn, sql, params):
+    """ the EXPLAIN QUERY PLAN of sql as a list of lines
+    :param conn:
+    :param sql:
+    :param params:
+    :return:
+    """
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def explain_builtin(db_name):
+    """ the query plan of every built-in query, in the first of its forms that the schema of db_name supports
+    :param db_name:
+    :return: {query name: [plan lines]}
+    """
+    conn = get_connection(db_name)
+    plans = {}
+    for name, forms in BUILTIN_QUERIES.get(os.path.basename(db_name), []):
+        for sql, params in forms:
+            try:
+                plans[name] = explain(conn, sql, params)
+                break
+            except Exception as e:
+                plans[name] = [f"n/a ({e})"]
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="create and maintain the indexes of mes1.db and insight.db")
+    parser.add_argument('databases', nargs='*', default=['mes1.db', 'insight.db'])
+    parser.add_argument('--explain', action='store_true',
+                        help="print the query plan of the built-in queries before and after the upgrade")
+    parser.add_argument('--compact', action='store_true', help="merge the delta rows of the hourly rollups")
+    args = parser.parse_args()
+    for db_name in args.databases:
+        if not os.path.exists(db_name):
+            print(f"{db_name} does not exist")
+            continue
+        before = explain_builtin(db_name) if args.explain else {}
+        applied = upgrade(db_name, verbose=True)
+        if not applied:
+            print(f"{db_name}: up to date")
+        if args.compact:
+            compact(db_name)
+        if args.explain:
+            after = explain_builtin(db_name)
+            for name in after:
+                print(f"\n[{db_name}] {name}")
+                print("  before: " + "\n          ".join(before.get(name, [])))
+                print("  after:  " + "\n          ".join(after[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+############################################################################
+#
+# Pareto 查询: 时间范围内按条件过滤后, 某一列每个值的记录数, 从多到少排列.
+# GROUP BY / COUNT / ORDER BY / LIMIT 都在 SQLite 中完成, 只有每个值的计数返回 Python;
+# 列和过滤条件都在某个按小时汇总表中时, 整小时部分从汇总表读 (rollup.grouped_counts).
+# pareto('mes1.db', 'record', 'fixture_id', start, end, {'test_station': 'TSP-E', 'result': 'FAIL'}, top=10)
+#
+############################################################################
+import os
+
+from db_pool import get_connection
+from rollup import ROLLUPS, grouped_counts, rollups_of
+from timestamps import epoch_column, to_epoch
+
+
+def rollup_for(db_name, table, columns):
+    """ a rollup of table that has all the columns, None if there is none
+    :param db_name:
+    :param table:
+    :param columns:
+    :return:
+    """
+    for rollup in rollups_of(db_name, table):
+        if set(columns) <= set(ROLLUPS[os.path.basename(db_name)][rollup][2]):
+            return rollup
+    return None
+
+
+def pareto_rows(db_name, table, dimension, start, end, where=None, top=None, backend='sqlite'):
+    """ the count of every non NULL value of dimension among the rows of table between start and end
+    :param db_name:
+    :param table:
+    :param dimension: column to count
+    :param start: '%Y-%m-%d %H:%M:%S' or datetime
+    :param end:
+    :param where: {column: value} filters
+    :param top: only the top values
+    :param backend: 'archive' reads the archived days from the parquet archive (archive.py)
+    :return: [(value, count), ...] by count descending
+    """
+    where = where or {}
+    if backend == 'archive':
+        # archive 需要 pandas 和 pyarrow, 只在用到时导入
+        from archive import archive_counts
+
+        return archive_counts(db_name, table, [dimension], start, end, where, skip_null=True, limit=top)
+    rollup = rollup_for(db_name, table, [dimension] + list(where))
+    if rollup is not None:
+        return grouped_counts(db_name, rollup, start, end, [dimension], where, skip_null=True, limit=top)
+
+    epoch = epoch_column(db_name, table)
+    filters = ''.join(f' AND "{column}" = ?' for column in where)
+    sql = (f'SELECT "{dimension}", COUNT(*) AS count FROM {table} '
+           f'WHERE "{epoch}" BETWEEN ? AND ? AND "{dimension}" IS NOT NULL{filters} '
+           f'GROUP BY "{dimension}" ORDER BY count DESC, "{dimension}"')
+    params = [to_epoch(start), to_epoch(end)] + list(where.values())
+    if top is not None:
+        sql += " LIMIT ?"
+        params.append(top)
+    return get_connection(db_name).execute(sql, params).fetchall()
+
+
+def pareto(db_name, table, dimension, start, end, where=None, top=None, backend='sqlite'):
+    """ pareto_rows as a Series shaped like DataFrame[dimension].value_counts()
+    :param db_name:
+    :param table:
+    :param dimension:
+    :param start:
+    :param end:
+    :param where:
+    :param top:
+    :param backend:
+    :return: Series value -> count named 'count', the index is named after dimension
+    """
+    return counts_series(pareto_rows(db_name, table, dimension, start, end, where, top, backend), dimension)
+
+
+def counts_series(rows, dimension):
+    """ [(value, count), ...] as a Series shaped like DataFrame[dimension].value_counts()
+    :param rows:
+    :param dimension:
+    :return:
+    """
+    import pandas as pd
+
+    return pd.Series([count for _, count in rows], index=pd.Index([value for value, _ in rows], name=dimension),
+                     name='count', dtype='int64')
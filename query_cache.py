@@ -0,0 +1,211 @@
+############################################################################
+#
+# 分析函数的查询结果缓存 (LRU), 键为 函数 + 参数.
+# 入库事务调用 record_change 在 data_changes 表中记录改动的表和时间范围, 与数据一起提交;
+# 每次调用缓存函数前读取新的 data_changes 行, 淘汰表和时间范围与改动重叠的结果,
+# 因此其它进程(如 ingest_daemon)的入库也能让缓存失效.
+# @cached('insight.db', 'fail_record', 'record')   # 函数的前两个参数为 start, end
+# @cached('mes1.db', 'record1', span=whole_days_span)   # 实际读取的时间范围与 start, end 不同时
+#
+############################################################################
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from db_pool import get_connection
+from timestamps import epoch_column, format_time, parse_time
+
+# 缓存的结果数量上限, 可通过 configure() 修改
+MAXSIZE = 256
+ENABLED = True
+
+CHANGES_STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS data_changes (
+       id INTEGER PRIMARY KEY,
+       table_name TEXT,
+       first_time TIMESTAMP,
+       last_time TIMESTAMP,
+       changed_at TIMESTAMP)"""]
+
+_lock = threading.Lock()
+# key -> (value, db_name, tables, (start, end) or None if unknown)
+_entries = OrderedDict()
+# 数据库 -> 已处理的 data_changes 最大 id
+_seen = {}
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def configure(maxsize=None, enabled=None):
+    """ change the size limit or switch the cache on and off, the cached results are dropped
+    :param maxsize:
+    :param enabled:
+    :return:
+    """
+    global MAXSIZE, ENABLED
+    if maxsize is not None:
+        MAXSIZE = maxsize
+    if enabled is not None:
+        ENABLED = enabled
+    clear()
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def cache_info():
+    """ hits, misses, evictions and the current number of results
+    :return:
+    """
+    with _lock:
+        return dict(_stats, size=len(_entries), maxsize=MAXSIZE)
+
+
+def record_change(conn, db_name, table, condition, params=()):
+    """ log the time range of the rows of table matching condition as changed,
+    call it in the transaction that writes the rows so that the log is committed with them
+    :param conn:
+    :param db_name:
+    :param table:
+    :param condition: sql condition on table, e.g. 'rowid > ?' for the rows just inserted
+    :param params:
+    :return:
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_changes'").fetchone() is None:
+        return
+    epoch = epoch_column(db_name, table)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(params, dict):
+        params = dict(params, table_name=table, changed_at=now)
+        names = ':table_name', ':changed_at'
+    else:
+        params = (table, now) + tuple(params)
+        names = '?', '?'
+    conn.execute(f'INSERT INTO data_changes (table_name, first_time, last_time, changed_at) '
+                 f'SELECT {names[0]}, datetime(MIN("{epoch}"), \'unixepoch\'), '
+                 f'datetime(MAX("{epoch}"), \'unixepoch\'), {names[1]} FROM {table} '
+                 f'WHERE {condition} HAVING COUNT(*) > 0', params)
+
+
+def _sync(db_name):
+    """ evict the results that overlap the changes of db_name committed since the last call
+    :param db_name:
+    :return: the id of the last change seen
+    """
+    key = os.path.abspath(db_name)
+    conn = get_connection(db_name)
+    try:
+        if key not in _seen:
+            # nothing cached for db_name yet, the changes before the first call do not matter
+            with _lock:
+                _seen[key] = conn.execute("SELECT IFNULL(MAX(id), 0) FROM data_changes").fetchone()[0]
+            return _seen[key]
+        seen = _seen[key]
+        changes = conn.execute("SELECT id, table_name, first_time, last_time FROM data_changes WHERE id > ? "
+                               "ORDER BY id", (seen,)).fetchall()
+    except Exception:
+        # data_changes is created by the first upgrade of db_name, every change logged after that is new
+        with _lock:
+            _seen.setdefault(key, 0)
+        return _seen[key]
+    if not changes:
+        return seen
+    with _lock:
+        for cache_key, (_, entry_db, tables, span) in list(_entries.items()):
+            if entry_db != key:
+                continue
+            for _, table, first_time, last_time in changes:
+                if table in tables and first_time is not None and (
+                        span is None or first_time <= span[1] and last_time >= span[0]):
+                    del _entries[cache_key]
+                    _stats['evictions'] += 1
+                    break
+        _seen[key] = max(_seen.get(key, 0), changes[-1][0])
+        return _seen[key]
+
+
+def cached(db_name, *tables, span=None):
+    """ decorator, cache the results of an analysis function whose first two arguments are start and end;
+    a result is dropped when one of the tables changes between start and end (at any time if they are not
+    passed positionally)
+    :param db_name:
+    :param tables: the tables the function reads
+    :param span: function called with the arguments of the decorated function, returns the (start, end) it
+                 really reads when that is not its first two arguments, e.g. whole_days_span
+    :return:
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            try:
+                key = (func.__module__, func.__qualname__, _freeze(args), _freeze(kwargs))
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+            seen = _sync(db_name)
+            with _lock:
+                entry = _entries.get(key)
+                if entry is not None:
+                    _entries.move_to_end(key)
+                    _stats['hits'] += 1
+                    return _copy(entry[0])
+                _stats['misses'] += 1
+            value = func(*args, **kwargs)
+            with _lock:
+                # a change seen by another thread meanwhile may not be in the result
+                if _seen.get(os.path.abspath(db_name), 0) == seen:
+                    window = _span(args if span is None else span(*args, **kwargs))
+                    _entries[key] = (value, os.path.abspath(db_name), tables, window)
+                    while len(_entries) > MAXSIZE:
+                        _entries.popitem(last=False)
+            return _copy(value)
+
+        return wrapper
+
+    return decorator
+
+
+def _freeze(value):
+    # a hashable key of the arguments, e.g. the {column: value} filters of fail_pareto
+    if isinstance(value, dict):
+        return dict, frozenset((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return set, frozenset(_freeze(item) for item in value)
+    return value
+
+
+def whole_days_span(start, end, *args, **kwargs):
+    """ the span of a function that reads one whole day after another from start until the day that contains
+    end, e.g. get_fpy_time_period
+    :param start:
+    :param end:
+    :return: (start, end of the last day)
+    """
+    try:
+        start, end = parse_time(start), parse_time(end)
+    except (TypeError, ValueError):
+        return None
+    delta = timedelta(days=1)
+    days = int((end - start) / delta) + 1 if end >= start else 0
+    return start, start + days * delta
+
+
+def _span(args):
+    # start and end in the format of data_changes, whatever the caller passed (text of any format, datetime)
+    try:
+        return format_time(args[0]), format_time(args[1])
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+def _copy(value):
+    # callers may modify the returned dataframe / series / list
+    return value.copy() if hasattr(value, 'copy') else value
@@ -0,0 +1,186 @@
+############################################################################
+#
+# 按小时汇总的计数表: 每个汇总表按 (hour, 分组列...) 记录源表的行数.
+# 写入源表的事务在同一事务中调用 add_rows/remove_rows, 把这批行按小时分组后的增量追加到汇总表,
+# 同一个键可以有多行增量, 读取时求和; compact() 把增量合并为每个键一行.
+# 小时由整数时间戳 (timestamps.py) 计算; 汇总表由 migrate.py 创建, 加 epoch 列的迁移按已有数据回填.
+# grouped_counts 对查询范围内的整小时读汇总表, 只对首尾不足一小时的部分按整数时间戳 (timestamps.py) 扫描源表.
+#
+############################################################################
+import os
+
+from db_pool import get_connection
+from timestamps import format_time, to_epoch
+
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+
+# (数据库, 表) -> 时间列
+TIME_COLUMNS = {('mes1.db', 'record'): 'stop_time',
+                ('mes1.db', 'record1'): 'stop_time',
+                ('insight.db', 'record'): 'Test End Time',
+                ('insight.db', 'fail_record'): 'EndTime'}
+
+# 数据库 -> {汇总表: (源表, epoch 列, [分组列, ...])}
+ROLLUPS = {
+    'mes1.db': {
+        'record_hourly': ('record', 'stop_epoch', ['test_station', 'fixture_id', 'result']),
+        'record_failure_hourly': ('record', 'stop_epoch', ['test_station', 'result', 'failure_message']),
+        'record1_hourly': ('record1', 'stop_epoch', ['test_station', 'result_type']),
+    },
+    'insight.db': {
+        'record_hourly': ('record', 'Test End Epoch', ['Fixture ID', 'Test Result']),
+        'record_failure_hourly': ('record', 'Test End Epoch', ['Test Result', 'Fail Message']),
+    },
+}
+
+
+def _quote(column):
+    return f'"{column}"'
+
+
+def _hour_of(epoch):
+    return f"strftime('{HOUR_FORMAT}', {epoch}, 'unixepoch')"
+
+
+def rollups_of(db_name, table):
+    """ the rollups of db_name whose source is table
+    :param db_name:
+    :param table:
+    :return: [rollup, ...]
+    """
+    return [rollup for rollup, (source, _, _) in ROLLUPS.get(os.path.basename(db_name), {}).items() if source == table]
+
+
+def _delta_sql(db_name, rollup, condition, sign):
+    table, epoch, columns = ROLLUPS[os.path.basename(db_name)][rollup]
+    keys = ', '.join(_quote(column) for column in columns)
+    return (f"INSERT INTO {rollup} SELECT {_hour_of(_quote(epoch))} AS hour, {keys}, {sign}COUNT(*) "
+            f"FROM {table} WHERE {condition} GROUP BY hour, {keys}")
+
+
+def _apply(conn, db_name, table, condition, params, sign):
+    for rollup in rollups_of(db_name, table):
+        # a rollup that does not exist yet is filled from the whole table when its migration runs
+        if _has_table(conn, rollup):
+            conn.execute(_delta_sql(db_name, rollup, condition, sign), params)
+
+
+def add_rows(conn, db_name, table, condition, params=()):
+    """ add the rows of table matching condition to its rollups, call it in the transaction that writes the rows;
+    the rollups only get new delta rows, readers sum the counts of a key
+    :param conn:
+    :param db_name:
+    :param table:
+    :param condition: sql condition on table, e.g. 'rowid > ?' for the rows just inserted
+    :param params:
+    :return:
+    """
+    _apply(conn, db_name, table, condition, params, '')
+
+
+def remove_rows(conn, db_name, table, condition, params=()):
+    """ take the rows of table matching condition out of its rollups, before they are updated or deleted
+    :param conn:
+    :param db_name:
+    :param table:
+    :param condition:
+    :param params:
+    :return:
+    """
+    _apply(conn, db_name, table, condition, params, '-')
+
+
+def rollup_statements(db_name, rollup, fill=True):
+    """ the sql that creates the rollup table and fills it from the existing rows
+    :param db_name:
+    :param rollup:
+    :param fill: False only creates the table, for a source table that has no epoch column yet
+    :return: [sql, ...]
+    """
+    _, _, columns = ROLLUPS[os.path.basename(db_name)][rollup]
+    keys = ', '.join(_quote(column) for column in columns)
+    statements = [
+        # the key columns have no type so that the values are stored exactly as in the source table
+        f"CREATE TABLE IF NOT EXISTS {rollup} (hour TIMESTAMP, {keys}, count INTEGER)",
+        f"CREATE INDEX IF NOT EXISTS {rollup}_key ON {rollup} (hour, {keys}, count)"]
+    if fill:
+        statements += [f"DELETE FROM {rollup}", _delta_sql(db_name, rollup, 'true', '')]
+    return statements
+
+
+def compact(db_name):
+    """ merge the delta rows of every rollup of db_name into one row per key
+    :param db_name:
+    :return:
+    """
+    conn = get_connection(db_name)
+    try:
+        for rollup, (_, _, columns) in ROLLUPS.get(os.path.basename(db_name), {}).items():
+            if not _has_table(conn, rollup):
+                continue
+            keys = ', '.join(_quote(column) for column in columns)
+            conn.execute(f"CREATE TEMP TABLE compacted AS SELECT hour, {keys}, SUM(count) AS count FROM {rollup} "
+                         f"GROUP BY hour, {keys} HAVING SUM(count) <> 0")
+            conn.execute(f"DELETE FROM {rollup}")
+            conn.execute(f"INSERT INTO {rollup} SELECT * FROM temp.compacted")
+            conn.execute("DROP TABLE temp.compacted")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _has_table(conn, table):
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone() is not None
+
+
+def grouped_counts(db_name, rollup, start, end, by, where=None, skip_null=False, limit=None):
+    """ the number of source rows of rollup whose time is between start and end, grouped by the columns in by;
+    the whole hours of the range are read from the rollup table, the partial hours at both ends from the source table
+    :param db_name:
+    :param rollup:
+    :param start: '%Y-%m-%d %H:%M:%S' or datetime
+    :param end:
+    :param by: group columns of the rollup, 'hour' groups by the hour of the time column
+    :param where: {column: value} filters on the group columns
+    :param skip_null: leave out the rows where a column in by is NULL
+    :param limit: only the first limit groups
+    :return: [(value of each column in by, ..., count), ...] by count descending
+    """
+    table, epoch, columns = ROLLUPS[os.path.basename(db_name)][rollup]
+    where = where or {}
+    conn = get_connection(db_name)
+    filters = ''.join(f" AND {_quote(column)} = ?" for column in where)
+    if skip_null:
+        filters += ''.join(f" AND {_quote(column)} IS NOT NULL" for column in by if column != 'hour')
+    names = ', '.join(_quote(column) for column in by)
+    source_by = ', '.join(f"{_hour_of(_quote(epoch))} AS hour" if column == 'hour' else _quote(column)
+                          for column in by)
+
+    def source_part(condition, params):
+        return (f"SELECT {source_by}, COUNT(*) AS count FROM {table} WHERE {condition}{filters} GROUP BY {names}",
+                params + list(where.values()))
+
+    start = to_epoch(start)
+    end = to_epoch(end)
+    # the first and last whole hour of the range
+    first_hour = -(-start // 3600) * 3600
+    last_hour = end // 3600 * 3600
+
+    epoch = _quote(epoch)
+    if first_hour < last_hour and _has_table(conn, rollup):
+        parts = [(f"SELECT {names}, count FROM {rollup} WHERE hour >= ? AND hour < ?{filters}",
+                  [format_time(first_hour), format_time(last_hour)] + list(where.values())),
+                 source_part(f"{epoch} >= ? AND {epoch} < ?", [start, first_hour]),
+                 source_part(f"{epoch} >= ? AND {epoch} <= ?", [last_hour, end])]
+    else:
+        parts = [source_part(f"{epoch} BETWEEN ? AND ?", [start, end])]
+    sql = (f"SELECT {names}, SUM(count) AS count FROM ({' UNION ALL '.join(part for part, _ in parts)}) "
+           f"GROUP BY {names} HAVING SUM(count) > 0 ORDER BY SUM(count) DESC, {names}")
+    params = [param for _, part_params in parts for param in part_params]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
@@ -0,0 +1,80 @@
+############################################################################
+#
+# 分析查询的流式读取: 只选需要的列, 游标按 BATCH_ROWS 行一批 fetchmany, 边读边累计,
+# 不 fetchall 整个结果, 也不为了一列建整个 DataFrame.
+# configure(memory_limit_mb=...) 给 SQLite 设内存上限: 页缓存、mmap 和堆按上限分配,
+# 排序/分组/窗口函数的临时数据超出时写到临时文件 (temp_store = FILE),
+# 大时间范围的查询在小内存的机器上也能完成.
+# streaming.configure(memory_limit_mb=512)
+# for rows in iter_batches('insight.db', 'SELECT "Fixture ID" FROM record WHERE ...', params): ...
+#
+############################################################################
+from db_pool import PRAGMAS, configure as configure_connections, get_connection
+
+# 每次 fetchmany 的行数
+BATCH_ROWS = 10000
+# SQLite 的内存上限 (MB), None 表示使用 db_pool.PRAGMAS 的设置
+MEMORY_LIMIT_MB = None
+
+_DEFAULT_PRAGMAS = dict(PRAGMAS)
+
+
+def memory_pragmas(memory_limit_mb):
+    """ the pragmas that keep SQLite within memory_limit_mb: a quarter for the page cache, a quarter for mmap,
+    half of it as the soft heap limit, temporary b-trees and sorts on disk
+    :param memory_limit_mb:
+    :return: {pragma: value}
+    """
+    limit = memory_limit_mb * 2 ** 20
+    return {'cache_size': -(limit // 4 // 1024),
+            'mmap_size': min(_DEFAULT_PRAGMAS.get('mmap_size', 0), limit // 4),
+            'soft_heap_limit': limit // 2,
+            'temp_store': 'FILE'}
+
+
+def configure(memory_limit_mb=None, batch_rows=None):
+    """ set the memory limit of the connections opened from now on (the connections of the calling thread are
+    reopened) and the batch size of iter_batches; memory_limit_mb=0 goes back to the db_pool defaults
+    :param memory_limit_mb:
+    :param batch_rows:
+    :return:
+    """
+    global BATCH_ROWS, MEMORY_LIMIT_MB
+    if batch_rows is not None:
+        BATCH_ROWS = batch_rows
+    if memory_limit_mb is None:
+        return
+    MEMORY_LIMIT_MB = memory_limit_mb or None
+    if MEMORY_LIMIT_MB is None:
+        # soft_heap_limit is process wide, 0 removes it
+        configure_connections(**_DEFAULT_PRAGMAS, soft_heap_limit=0)
+    else:
+        configure_connections(**memory_pragmas(MEMORY_LIMIT_MB))
+
+
+def iter_batches(db_name, sql, params=(), batch_rows=None):
+    """ the rows of sql in lists of at most batch_rows rows, only one batch is in memory at a time
+    :param db_name:
+    :param sql:
+    :param params:
+    :param batch_rows: default BATCH_ROWS
+    :return: iterator of lists of tuples
+    """
+    cursor = get_connection(db_name).execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_rows or BATCH_ROWS)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def iter_rows(db_name, sql, params=(), batch_rows=None):
+    """ the rows of sql one by one, read in batches
+    :return: iterator of tuples
+    """
+    for rows in iter_batches(db_name, sql, params, batch_rows):
+        yield from rows
+
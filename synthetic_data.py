@@ -0,0 +1,308 @@
+############################################################################
+#
+# 生成测试用的数据, 目录结构与入库脚本读取的一致, 生成的目录可以直接作为工作目录使用:
+#   <out>/xlsx_files/{res,dva,tsp}_0000.xlsx          MES 导出, '数据信息' 列是每条测试记录的 json
+#   <out>/csv_files/record/record_0000.csv            Insight 参数记录, 每次测试若干行 (Sub-test / Sub-sub-test)
+#   <out>/csv_files/fail_record/fail_record_0000.csv  Insight 失败记录, fail key 取自 Config-File_D95x-TSP_0809.csv
+# 每个产品测试 1 到 3 次: 一次通过, 失败后重测通过 (retest), 或三次都失败; 治具、carrier、失败项的分布是偏斜的,
+# Pareto 的结果有明显的头部. 每个文件由 (seed, 类型, 文件序号) 决定, 相同参数生成的文件内容相同.
+# python synthetic_data.py synthetic --rows 100000
+# python synthetic_data.py synthetic --rows 10000000 --days 30 --workers 8
+#
+############################################################################
+import argparse
+import csv
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+
+from collect_fail_record import CONFIG_PATH
+from json_batch import EXTRACTORS
+from xlsx_reader import INFO_COLUMN
+
+START = '2024-01-02 20:00:00'
+DAYS = 7
+# 每个文件的行数, xlsx 一个工作表最多 1048576 行
+ROWS_PER_FILE = 100000
+KINDS = ['mes', 'record', 'fail']
+# Insight 每次测试的参数行数
+MEASUREMENTS = 5
+
+FIXTURES = [f'100{line}0{slot}' for line in range(1, 7) for slot in range(1, 7)]
+CARRIERS = [f'{i:08X}' for i in range(200)]
+VERSIONS = ['1.2.3', '1.2.4', '1.3.0']
+FAILURES = {'res': ['Resistance_Open', 'Resistance_High', 'Resistance_Low', 'ContactCheck', 'CalibrationError'],
+            'dva': ['DisplayPowerOnFailed', 'MuraDetected', 'DeadPixel', 'BrightnessLow', 'ColorShift', 'Flicker'],
+            'tsp': ['FSTestProbeFsItems_OOS', 'PowerTestOOS', 'OpenShortTestOOS', 'DisplayPowerOnFailed',
+                    'TouchNoiseOOS', 'ForceCalFail', 'LeakageOOS']}
+SUB_TESTS = [('Power Test', 'VBAT_Curr_mA', 10.0, 60.0), ('Power Test', 'VDD_Volt_V', 1.7, 1.9),
+             ('Open Short', 'Pin_Resistance_Ohm', 0.0, 5.0), ('Touch', 'Noise_Max', 0.0, 120.0),
+             ('Force', 'Cal_Gain', 0.9, 1.1), ('Display', 'Brightness_nit', 400.0, 650.0)]
+FAIL_COLUMNS = ['Site', 'Product', 'SerialNumber', 'Special Build Name', 'Special Build Description', 'Unit Number',
+                'Station ID', 'Test Pass/Fail Status', 'StartTime', 'EndTime', 'Version', 'List of Failing Tests',
+                'fixture_id', 'CARRIER_PN', 'FIXTURE_ID', 'CARRIER_TOTAL_TEST', 'CARRIER_UNIT_FAIL']
+# Insight 导出在表头和数据之间的 5 行, 入库时被删除
+FAIL_INFO_ROWS = ['Display Name ---->', 'PDCA Priority ---->', 'Upper Limit ---->', 'Lower Limit ---->',
+                  'Measurement Unit ---->']
+RECORD_COLUMNS = ['Site', 'Product', 'Serial Number', 'Station ID', 'Test Result', 'Test Start Time', 'Test End Time',
+                  'Fixture ID', 'Test Software Version', 'Sub-test', 'Sub-sub-test', 'Fail Message', 'Value',
+                  'Lower Limit', 'Upper Limit', 'Measurement Unit']
+
+
+@lru_cache(maxsize=None)
+def _cum_weights(n):
+    return list(accumulate(1 / rank for rank in range(1, n + 1)))
+
+
+def _skewed(rng, values):
+    """ a value of values, the first values much more often (weight 1 / rank) """
+    return rng.choices(values, cum_weights=_cum_weights(len(values)))[0]
+
+
+def fail_keys(config_path=CONFIG_PATH):
+    """ the fail keys of the config file as the first failing test of 'List of Failing Tests'
+    :param config_path:
+    :return: ['FINAL_RESULT_FLAG AID_FailToGetLastError_1158 NA', ...]
+    """
+    with open(config_path, newline='', encoding='utf-8-sig') as file:
+        return [row['Key'].replace('^^', ' ') for row in csv.DictReader(file) if row['Key']]
+
+
+def unit_tests(rng, count, start, seconds, prefix):
+    """ the tests of the units of one file, in time order: each unit passes at once (80%), fails and passes
+    on a retest, or fails three times; the fixtures near the head of FIXTURES fail more often
+    :param rng:
+    :param count: number of tests
+    :param start: datetime of the first test
+    :param seconds: time span of the tests
+    :param prefix: of the serial numbers, unique per seed and file
+    :return: iterator of (sn, attempt, last attempt, passed, fixture, carrier, stop datetime)
+    """
+    step = seconds / max(count, 1)
+    produced = 0
+    unit = 0
+    while produced < count:
+        sn = f'{prefix}{unit:08d}'
+        unit += 1
+        outcome = rng.random()
+        attempts = 1 if outcome < 0.8 else 2 if outcome < 0.95 else 3
+        attempts = min(attempts, count - produced)
+        for attempt in range(attempts):
+            passed = attempt == attempts - 1 and outcome < 0.95
+            fixture = rng.choice(FIXTURES) if passed else _skewed(rng, FIXTURES)
+            stop = start + timedelta(seconds=int((produced + rng.random()) * step))
+            yield sn, attempt, attempts - 1, passed, fixture, _skewed(rng, CARRIERS), stop
+            produced += 1
+
+
+def mes_json(rng, station, test):
+    """ one '数据信息' json string of station, with the keys json_batch / res / dva / tsp read
+    :param rng:
+    :param station: 'res', 'dva' or 'tsp'
+    :param test: an item of unit_tests
+    :return:
+    """
+    sn, _, _, passed, fixture, carrier, stop = test
+    failure = '' if passed else f'{_skewed(rng, FAILURES[station])};{rng.choice(FAILURES[station])}'
+    info = {'product': 'D95x',
+            'start_time': (stop - timedelta(seconds=rng.randint(60, 180))).strftime('%Y-%m-%d %H:%M:%S'),
+            'stop_time': stop.strftime('%Y-%m-%d %H:%M:%S'),
+            'result': 'PASS' if passed else 'FAIL',
+            'sw_version': _skewed(rng, VERSIONS)}
+    if station == 'tsp':
+        info.update(sn=f'{sn}+{rng.randint(0, 9)}', fixture_id=fixture, test_station_name='TSP-E',
+                    station_id='TSP-E_01', failure_message=failure, station_string=f'TSP;E;2941{carrier}',
+                    bobcat_signature=f'{rng.getrandbits(128):032x}', audit_mode=0)
+    elif station == 'res':
+        info.update(sn=sn, fixture_id=fixture, test_station_name='OQC-Resistance', list_of_failing_tests=failure,
+                    Carrier_sn=carrier)
+    else:
+        info.update(sn=sn, fixture_id=carrier, station_id=f'{fixture}_IQC_01', test_station_name='DVA',
+                    list_of_failing_tests=failure)
+    return json.dumps(info, ensure_ascii=False)
+
+
+def write_xlsx(file_path, station, tests, seed):
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['序号', 'SN', INFO_COLUMN])
+    for i, test in enumerate(tests):
+        sheet.append([i + 1, test[0], mes_json(rng, station, test)])
+    workbook.save(file_path)
+
+
+def record_rows(rng, test):
+    """ the Insight parametric rows of one test, a test that is retested later is 'RETEST'
+    :param rng:
+    :param test: an item of unit_tests
+    :return:
+    """
+    sn, attempt, last, passed, fixture, _, stop = test
+    result = 'PASS' if passed else 'RETEST' if attempt < last else 'FAIL'
+    failing = None if passed else rng.randrange(MEASUREMENTS)
+    version = _skewed(rng, VERSIONS)
+    rows = []
+    for i, (sub_test, sub_sub_test, lower, upper) in enumerate(SUB_TESTS[:MEASUREMENTS]):
+        if i == failing:
+            value = upper + (upper - lower) * rng.uniform(0.01, 0.5)
+            message = f'{sub_test} {sub_sub_test} out of limit'
+        else:
+            value = rng.uniform(lower, upper)
+            message = ''
+        rows.append(['ICHQ', 'D95x', sn, f'{fixture}_TSP', result, '', stop.strftime('%Y-%m-%d %H:%M:%S'), fixture,
+                     version, sub_test, sub_sub_test, message, f'{value:.4f}', lower, upper, ''])
+    return rows
+
+
+def write_record_csv(file_path, tests, seed):
+    rng = random.Random(seed)
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(RECORD_COLUMNS)
+        for test in tests:
+            writer.writerows(record_rows(rng, test))
+
+
+def fail_row(rng, test, keys):
+    """ one row of the Insight fail export
+    :param rng:
+    :param test: an item of unit_tests
+    :param keys: fail_keys(), about 2% of the failures get a key that is not in the config file
+    :return:
+    """
+    sn, attempt, _, passed, fixture, carrier, stop = test
+    if passed:
+        failing = ''
+    else:
+        first = _skewed(rng, keys) if rng.random() < 0.98 else f'UNKNOWN_TEST_{rng.randint(1, 20)} NA'
+        failing = f'{first};{rng.choice(keys)}'
+    return ['ICHQ', 'D95x', sn, '', '', '', f'{fixture}_TSP', 'PASS' if passed else 'FAIL',
+            (stop - timedelta(seconds=rng.randint(60, 180))).strftime('%Y-%m-%d %H:%M:%S'),
+            stop.strftime('%Y-%m-%d %H:%M:%S'), _skewed(rng, VERSIONS), failing, fixture, carrier, fixture,
+            rng.randint(1, 500), rng.randint(0, 3)]
+
+
+def write_fail_csv(file_path, tests, seed, config_path=CONFIG_PATH):
+    rng = random.Random(seed)
+    keys = fail_keys(config_path)
+    # shuffled, _skewed makes the first keys the common failures
+    keys = rng.sample(keys, len(keys))
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['D95x TSP fail export'])
+        writer.writerow(FAIL_COLUMNS)
+        for label in FAIL_INFO_ROWS:
+            writer.writerow([label] + [''] * (len(FAIL_COLUMNS) - 1))
+        for test in tests:
+            writer.writerow(fail_row(rng, test, keys))
+
+
+def write_file(kind, file_path, station, index, count, start, seconds, seed):
+    """ one generated file, runs in the worker processes
+    :param kind: 'mes', 'record' or 'fail'
+    :param file_path:
+    :param station: the MES station of kind 'mes'
+    :param index: number of the file within kind (and station)
+    :param count: number of tests, the record csv has MEASUREMENTS rows per test
+    :param start: datetime of the first test of the file
+    :param seconds: time span of the file
+    :param seed:
+    :return: (file_path, rows)
+    """
+    # the stations of MES test the same units, the record and fail files of an index share their first units;
+    # the seed is part of the serial numbers so that runs with different seeds into one database do not collide
+    prefix = f'G{seed}N{index:04d}' if kind == 'mes' else f'I{seed}N{index:04d}'
+    source = station if kind == 'mes' else 'insight'
+    tests = unit_tests(random.Random(f'{seed}-{source}-{index}'), count, start, seconds, prefix)
+    seed = f'{seed}-{kind}-{station}-{index}'
+    if kind == 'mes':
+        write_xlsx(file_path, station, tests, seed)
+        return file_path, count
+    if kind == 'record':
+        write_record_csv(file_path, tests, seed)
+        return file_path, count * MEASUREMENTS
+    write_fail_csv(file_path, tests, seed)
+    return file_path, count
+
+
+def plan(out_dir, rows, start=START, days=DAYS, rows_per_file=ROWS_PER_FILE, kinds=KINDS, seed=0):
+    """ the files to generate, each kind has rows rows spread over days from start
+    (the MES rows split over the three stations, the files of a kind cover consecutive time slices)
+    :return: [write_file arguments, ...]
+    """
+    start = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+    folders = {'mes': os.path.join(out_dir, 'xlsx_files'),
+               'record': os.path.join(out_dir, 'csv_files', 'record'),
+               'fail': os.path.join(out_dir, 'csv_files', 'fail_record')}
+    jobs = []
+    for kind in kinds:
+        os.makedirs(folders[kind], exist_ok=True)
+        stations = list(EXTRACTORS) if kind == 'mes' else [None]
+        for station in stations:
+            total = rows // len(stations)
+            if kind == 'record':
+                total //= MEASUREMENTS
+            per_file = rows_per_file // MEASUREMENTS if kind == 'record' else rows_per_file
+            files = max(1, -(-total // per_file))
+            seconds = days * 86400 / files
+            for index in range(files):
+                count = min(per_file, total - index * per_file)
+                name = {'mes': f'{station}_{index:04d}.xlsx', 'record': f'record_{index:04d}.csv',
+                        'fail': f'fail_record_{index:04d}.csv'}[kind]
+                jobs.append((kind, os.path.join(folders[kind], name), station, index, count,
+                             start + timedelta(seconds=index * seconds), seconds, seed))
+    return jobs
+
+
+def generate(out_dir, rows, start=START, days=DAYS, rows_per_file=ROWS_PER_FILE, kinds=KINDS, seed=0,
+             max_workers=None, verbose=False):
+    """ write the synthetic files of kinds to out_dir
+    :param out_dir:
+    :param rows: rows per kind
+    :param start: '%Y-%m-%d %H:%M:%S' of the first test
+    :param days: time span of the data
+    :param rows_per_file:
+    :param kinds: some of KINDS
+    :param seed:
+    :param max_workers: size of the process pool, default os.cpu_count()
+    :param verbose:
+    :return: {kind: rows written}
+    """
+    jobs = plan(out_dir, rows, start, days, rows_per_file, kinds, seed)
+    written = {kind: 0 for kind in kinds}
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        futures = [(job[0], pool.submit(write_file, *job)) for job in jobs]
+        for kind, future in futures:
+            file_path, count = future.result()
+            written[kind] += count
+            if verbose:
+                print(f"{file_path}: {count} rows")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write synthetic MES xlsx and Insight csv files")
+    parser.add_argument('out', help="output folder, gets xlsx_files/ and csv_files/")
+    parser.add_argument('--rows', type=int, default=100000, help="rows of each kind")
+    parser.add_argument('--start', default=START)
+    parser.add_argument('--days', type=float, default=DAYS)
+    parser.add_argument('--rows-per-file', type=int, default=ROWS_PER_FILE)
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=KINDS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help="number of writer processes")
+    args = parser.parse_args()
+    written = generate(args.out, args.rows, args.start, args.days, args.rows_per_file, args.kinds, args.seed,
+                       args.workers, verbose=True)
+    for kind, count in written.items():
+        print(f"{kind}: {count} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import pytest
+
+import archive
+
+pytest.importorskip('pyarrow')
+
+
+def test_archived_day_round_trip(mes_db, mes_rows):
+    mes_db.insert_dataframe(mes_rows(('100301', '2024-01-03 08:00:00', 'PASS', 'SN1'),
+                                     ('100302', '2024-01-03 09:00:00', 'FAIL', 'SN2'),
+                                     ('100302', '2024-01-03 09:30:00', 'PASS', 'SN2'),
+                                     ('100301', '2024-01-03 23:59:59', 'FAIL', 'SN3'),
+                                     ('100303', '2024-01-04 10:00:00', 'PASS', 'SN4'),
+                                     ('100303', '2024-01-04 11:00:00', 'FAIL', 'SN5')))
+    mes_db.generate_record1()
+
+    # 2024-01-03 goes to parquet, 2024-01-04 stays in SQLite only
+    written = archive.export('mes1.db', until='2024-01-04')
+    assert written['record1'] == 1
+
+    import pyarrow.dataset as ds
+
+    day = ds.dataset(archive.table_dir('mes1.db', 'record1'), format='parquet', partitioning='hive').to_table()
+    assert sorted(day['sn'].to_pylist()) == ['SN1', 'SN2', 'SN3']
+    assert set(day['date'].to_pylist()) == {'2024-01-03'}
+
+    # SN1 PASS, SN2 RETEST, SN3 TO_BE_TESTING on the archived day
+    assert mes_db.get_fpy('2024-01-03 00:00:00', '2024-01-03 23:59:59', backend='archive')[:2] == (3, 1)
+    for start, end in (('2024-01-03 00:00:00', '2024-01-03 23:59:59'),
+                       ('2024-01-03 08:30:00', '2024-01-04 10:30:00'),
+                       ('2024-01-02 00:00:00', '2024-01-05 00:00:00')):
+        assert mes_db.get_fpy(start, end, backend='archive') == mes_db.get_fpy(start, end)
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from json_batch import RECORD_COLUMNS, decode_batch, decode_records
+
+# a fixed sample of the '数据信息' json of every station, with the optional fields missing in some records
+SAMPLES = {
+    'res': [{'fixture_id': '200101', 'stop_time': '2024/1/9 8:05:00', 'result': 'PASS', 'sn': 'G9P3503G0QL21KHA6',
+             'sw_version': '1.2.3', 'list_of_failing_tests': '', 'Carrier_sn': 'C0001', 'start_time': 'x'},
+            {'fixture_id': '200102', 'stop_time': '2024-01-09 08:06:00', 'result': 'FAIL', 'sn': 'G9P3503G0QL21KHA7',
+             'sw_version': '1.2.3', 'list_of_failing_tests': 'OpenShortTestOOS;FSProbe Cal', 'Carrier_sn': 'C0002'},
+            {'stop_time': '2024-01-09 08:07:00', 'result': 'FAIL', 'sn': 'G9P3503G0QL21KHA8'}],
+    'dva': [{'station_id': '300101_IQC_1', 'stop_time': '2024/1/9 8:05:00', 'result': 'PASS', 'sn': 'G9P3503G0QL21KHB6',
+             'sw_version': '2.0', 'list_of_failing_tests': '', 'fixture_id': 'F01'},
+            {'station_id': '300102_IQC_2', 'stop_time': '2024-01-09 08:06:00', 'result': 'FAIL',
+             'sn': 'G9P3503G0QL21KHB7', 'list_of_failing_tests': 'DVA_Gain;DVA_Offset', 'fixture_id': 'F02'}],
+    'tsp': [{'fixture_id': '100301', 'stop_time': '2024/1/9 8:05:00', 'result': 'PASS', 'sn': 'G9P3503G0QL21KHC6+1',
+             'sw_version': '3.1', 'failure_message': '', 'station_string': 'TSP;L1;CARRIER01', 'mac_address': 'm'},
+            {'fixture_id': '100302', 'stop_time': '2024-01-09 08:06:00', 'result': 'FAIL', 'sn': 'G9P3503G0QL21KHC7',
+             'sw_version': '3.1', 'failure_message': 'FSTestProbeFsItems_OOS;b', 'station_string': 'TSP;CARRIER02'},
+            {'stop_time': '2024-01-09 08:07:00', 'result': 'FAIL', 'sn': 'G9P3503G0QL21KHC8',
+             'station_string': 'CARRIER03'}],
+}
+
+
+def rows(df):
+    return df.reindex(columns=RECORD_COLUMNS).astype(object).where(df.notna(), None).values.tolist()
+
+
+@pytest.mark.parametrize('station', sorted(SAMPLES))
+def test_same_as_json_to_list_dataframe(station):
+    # the per row conversion of the station modules, which are not part of this repository
+    module = pytest.importorskip(station)
+    json_strings = [json.dumps(record) for record in SAMPLES[station]]
+
+    expected = module.JsonToListDataFrame(json_strings).generate_dataframe()
+
+    assert rows(decode_records(json_strings, station, batch_size=2)) == rows(expected)
+
+
+def test_missing_required_field():
+    with pytest.raises(ValueError, match="'station_string'"):
+        decode_records([json.dumps({'sn': 'G9P3503G0QL21KHC6'})], 'tsp')
+
+
+def test_decode_batch_cells():
+    assert decode_batch(['{"a": 1}', None, float('nan'), b'{"b": 2}']) == [{'a': 1}, {'b': 2}]
+    # a cell holding two json values must not shift the rows after it
+    with pytest.raises(ValueError):
+        decode_batch(['{"a": 1},{"a": 2}', '{"b": 2}'])
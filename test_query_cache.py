@@ -0,0 +1,63 @@
+import query_cache
+from query_cache import cached
+
+calls = []
+
+
+@cached('cache_test.db', 'record')
+def pareto_of(start, end, dimension, where=None, top=None):
+    calls.append((start, end, dimension, where, top))
+    return [(dimension, len(calls))]
+
+
+def test_dict_argument_is_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    query_cache.configure(enabled=True)
+    calls.clear()
+    hits = query_cache.cache_info()['hits']
+
+    first = pareto_of('2024-01-02 20:00:00', '2024-01-09 20:00:00', 'Carrier_sn', {'fixture_id': '100301'})
+    second = pareto_of('2024-01-02 20:00:00', '2024-01-09 20:00:00', 'Carrier_sn', {'fixture_id': '100301'})
+
+    assert second == first
+    assert len(calls) == 1
+    assert query_cache.cache_info()['hits'] == hits + 1
+
+
+def test_different_filters_are_different_keys(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    query_cache.configure(enabled=True)
+    calls.clear()
+
+    pareto_of('2024-01-02 20:00:00', '2024-01-09 20:00:00', 'Carrier_sn', where={'fixture_id': '100301'})
+    pareto_of('2024-01-02 20:00:00', '2024-01-09 20:00:00', 'Carrier_sn', where={'fixture_id': '100302'})
+    pareto_of('2024-01-02 20:00:00', '2024-01-09 20:00:00', 'Carrier_sn', where=[('fixture_id', '100301')])
+
+    assert len(calls) == 3
+
+
+def test_ingest_after_end_evicts_daily_fpy(mes_db, mes_rows):
+    mes_db.insert_dataframe(mes_rows(('100301', '2024-01-03 08:00:00', 'PASS', 'SN1'),
+                                     ('100301', '2024-01-03 09:00:00', 'FAIL', 'SN2'),
+                                     ('100301', '2024-01-03 10:00:00', 'FAIL', 'SN3')))
+    mes_db.generate_record1()
+    # the whole day from 00:00 is read although end is 12:00
+    before = mes_db.get_fpy_time_period('2024-01-03 00:00:00', '2024-01-03 12:00:00')
+    assert before[0][2:4] == (3, 1)
+
+    mes_db.insert_dataframe(mes_rows(('100301', '2024-01-03 15:00:00', 'PASS', 'SN4')))
+    mes_db.generate_record1()
+    after = mes_db.get_fpy_time_period('2024-01-03 00:00:00', '2024-01-03 12:00:00')
+    assert after[0][2:4] == (4, 2)
+
+
+def test_ingest_outside_the_span_keeps_the_result(mes_db, mes_rows):
+    mes_db.insert_dataframe(mes_rows(('100301', '2024-01-03 08:00:00', 'PASS', 'SN1')))
+    mes_db.generate_record1()
+    mes_db.get_fpy_time_period('2024-01-03 00:00:00', '2024-01-03 12:00:00')
+
+    mes_db.insert_dataframe(mes_rows(('100301', '2024-01-05 15:00:00', 'PASS', 'SN2')))
+    mes_db.generate_record1()
+    hits = query_cache.cache_info()['hits']
+    mes_db.get_fpy_time_period('2024-01-03 00:00:00', '2024-01-03 12:00:00')
+    assert query_cache.cache_info()['hits'] == hits + 1
@@ -0,0 +1,141 @@
+############################################################################
+#
+# 整数时间戳: 每个表在时间文本列之外有一个整数 epoch 列 (秒), 范围查询都按 epoch 列比较整数.
+# 时间文本是本地时间, 不带时区, epoch 按 UTC 解释.
+# 入库时由 add_epoch 从时间文本计算 epoch 列, 时间文本原样保留供显示和已有的查询使用;
+# 已有的数据由 migrate.py 的迁移用 to_epoch 回填 (注册为 SQLite 函数), 不用 strftime('%s', ...),
+# 它不认识 '2024/1/9 8:05:00' 这样没有补零的时间.
+# to_epoch('2024-01-02 20:00:00') == to_epoch('2024/1/2 20:00') == to_epoch(datetime(2024, 1, 2, 20))
+#
+############################################################################
+import calendar
+import os
+import re
+from datetime import date, datetime, timedelta
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# (数据库, 表) -> epoch 列, 时间文本列见 rollup.TIME_COLUMNS
+EPOCH_COLUMNS = {('mes1.db', 'record'): 'stop_epoch',
+                 ('mes1.db', 'record1'): 'stop_epoch',
+                 ('insight.db', 'record'): 'Test End Epoch',
+                 ('insight.db', 'fail_record'): 'EndEpoch'}
+
+_EPOCH = datetime(1970, 1, 1)
+_SINGLE_DIGIT = re.compile(r'(?<!\d)(\d)(?!\d)')
+
+
+def epoch_column(db_name, table):
+    return EPOCH_COLUMNS[(os.path.basename(db_name), table)]
+
+
+def parse_time(value):
+    """ value as a naive datetime
+    :param value: datetime, date, epoch seconds or text such as '2024-01-02 20:00:00', '2024/01/02 20:00',
+                  '2024-01-02T20:00:00.123'
+    :return:
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, (int, float)):
+        return _EPOCH + timedelta(seconds=value)
+    if hasattr(value, 'to_pydatetime'):
+        # pandas Timestamp
+        return value.to_pydatetime().replace(tzinfo=None)
+    text = str(value).strip().replace('/', '-')
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        # '2024-1-9 8:05:00' -> '2024-01-09 08:05:00', the fraction of a second is left as it is
+        head, dot, fraction = text.partition('.')
+        return datetime.fromisoformat(_SINGLE_DIGIT.sub(r'0\1', head) + dot + fraction).replace(tzinfo=None)
+
+
+def to_epoch(value):
+    """ the epoch seconds of a time, fractions of a second are dropped
+    :param value: anything parse_time accepts
+    :return: int
+    """
+    if isinstance(value, int):
+        return value
+    return calendar.timegm(parse_time(value).timetuple())
+
+
+def format_time(value):
+    """ value as '%Y-%m-%d %H:%M:%S'
+    :param value: anything parse_time accepts
+    :return:
+    """
+    return parse_time(value).strftime(TIME_FORMAT)
+
+
+def add_epoch(df, time_column, epoch_column_name):
+    """ add the epoch column of time_column to df, None where the time is not a date
+    :param df:
+    :param time_column:
+    :param epoch_column_name:
+    :return: df
+    """
+    # 只有入库时用到, 不让 migrate 等模块因导入本模块而加载 pandas
+    import pandas as pd
+
+    times = df[time_column]
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = times.astype('string').str.replace('/', '-', regex=False)
+    times = pd.to_datetime(times, errors='coerce', format='mixed')
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+    epochs = (times - pd.Timestamp(_EPOCH)) // pd.Timedelta(seconds=1)
+    df[epoch_column_name] = epochs.astype('Int64').astype(object).where(epochs.notna(), None)
+    return df
+
+
+def _sql_epoch(value):
+    # to_epoch as a SQLite function, NULL where the time is not a date like add_epoch
+    if not isinstance(value, str):
+        return None
+    try:
+        return to_epoch(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def epoch_statements(db_name, table, drop_indexes, create_indexes):
+    """ the migration that adds the epoch column of table, fills it from the time column, moves the time
+    indexes to it and refills the hourly rollups of table from it;
+    a table in dictionary encoded storage (dictionary.py) is altered through <table>_data
+    :param db_name:
+    :param table:
+    :param drop_indexes: [index, ...] on the time column
+    :param create_indexes: {index: [column, ...]}
+    :return: function conn -> [sql, ...], the statements depend on the storage of table
+    """
+    from dictionary import DICTIONARY_COLUMNS, id_column, is_normalized, view_sql
+    from rollup import TIME_COLUMNS, rollup_statements, rollups_of
+
+    time_column = TIME_COLUMNS[(os.path.basename(db_name), table)]
+    epoch = epoch_column(db_name, table)
+
+    def statements(conn):
+        normalized = is_normalized(conn, table)
+        encoded = DICTIONARY_COLUMNS.get((os.path.basename(db_name), table), []) if normalized else []
+        target = f'{table}_data' if normalized else table
+        # the same parsing as the ingest, strftime('%s') gives NULL for times that are not zero padded
+        conn.create_function('to_epoch', 1, _sql_epoch, deterministic=True)
+        sql = [f'ALTER TABLE {target} ADD COLUMN "{epoch}" INTEGER',
+               f'UPDATE {target} SET "{epoch}" = to_epoch("{time_column}")']
+        sql += [f'DROP INDEX IF EXISTS {index}' for index in drop_indexes]
+        for index, columns in create_indexes.items():
+            keys = ', '.join(f'"{id_column(column)}"' if column in encoded else f'"{column}"' for column in columns)
+            sql.append(f'CREATE INDEX IF NOT EXISTS {index} ON {target} ({keys})')
+        if normalized:
+            # the view lists its columns, it gets the new one when it is created again
+            columns = [(row[1], row[2]) for row in conn.execute(f"PRAGMA table_info({table})") if row[1] != 'rowid']
+            sql += [f'DROP VIEW {table}', view_sql(table, columns + [(epoch, 'INTEGER')], encoded)]
+        for rollup in rollups_of(db_name, table):
+            sql += rollup_statements(db_name, rollup)
+        return sql
+
+    return statements
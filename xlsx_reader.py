@@ -0,0 +1,69 @@
+############################################################################
+#
+# 只读取 MES 导出 xlsx 中的 '数据信息' 列, 逐行返回 json 字符串.
+# 安装了 python-calamine 时用 calamine 读取, 否则用 openpyxl 的 read_only 模式流式读取,
+# 两种方式都不会像 pd.read_excel 那样把整个工作簿载入成 dataframe.
+#
+############################################################################
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+INFO_COLUMN = '数据信息'
+
+
+def _column_index(header, column, file_path):
+    header = [str(cell).strip() if cell is not None else '' for cell in header]
+    if column not in header:
+        raise KeyError(f"{column} not found in {file_path}")
+    return header.index(column)
+
+
+def _iter_calamine(file_path, column):
+    workbook = CalamineWorkbook.from_path(file_path)
+    try:
+        rows = workbook.get_sheet_by_index(0).iter_rows()
+        index = _column_index(next(rows, []), column, file_path)
+        for row in rows:
+            if index < len(row):
+                yield row[index]
+    finally:
+        workbook.close()
+
+
+def _iter_openpyxl(file_path, column):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+        index = _column_index(header, column, file_path)
+        for (value,) in sheet.iter_rows(min_row=2, min_col=index + 1, max_col=index + 1, values_only=True):
+            yield value
+    finally:
+        workbook.close()
+
+
+def iter_info_column(file_path, column=INFO_COLUMN, engine=None):
+    """ yield the non-empty cells of column (the first sheet, first row is the header) one by one
+    :param file_path:
+    :param column:
+    :param engine: 'calamine' or 'openpyxl', default calamine when it is installed
+    :return: generator of json strings
+    """
+    if engine is None:
+        engine = 'calamine' if CalamineWorkbook is not None else 'openpyxl'
+    if engine == 'calamine':
+        if CalamineWorkbook is None:
+            raise ImportError("python-calamine is not installed")
+        values = _iter_calamine(file_path, column)
+    elif engine == 'openpyxl':
+        values = _iter_openpyxl(file_path, column)
+    else:
+        raise ValueError(f"unknown engine {engine}")
+    for value in values:
+        # calamine returns '' for empty cells, openpyxl returns None
+        if value is not None and value != '':
+            yield value